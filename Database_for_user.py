@@ -1,150 +1,270 @@
 import sqlite3
 import json
-from datetime import datetime
+from datetime import datetime, timezone
 import hashlib
 import os
+import time
+from db_pool import get_pool, release_pool
+from storage_profile import resolve_profile, apply_profile, read_profile, match_profile, diff_profile
+from bar_cache import RecentBarCache
+from session_cache import get_session_cache
+from valuation import PortfolioValuator
+from pagination import encode_page_token, decode_page_token
+from indicators import IndicatorEngine, compute_indicator
+from risk_engine import RiskEngine
+
+# Same text format SQLite uses for CURRENT_TIMESTAMP (UTC)
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+def format_timestamp(value):
+    """Normalize a datetime/epoch/str timestamp to the stored text format"""
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)):
+        value = datetime.fromtimestamp(value, tz=timezone.utc)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.strftime(TIMESTAMP_FORMAT)
+
+def utc_timestamp():
+    """Current UTC time in the stored text format"""
+    return datetime.now(timezone.utc).strftime(TIMESTAMP_FORMAT)
+
+def _price_row_params(row):
+    """Map a price row (tuple or dict) to stock_price_history insert params"""
+    if isinstance(row, dict):
+        return (row["symbol"], row["open"], row["high"], row["low"], row["close"],
+                row["volume"], format_timestamp(row.get("timestamp")))
+    
+    symbol, open_price, high_price, low_price, close_price, volume = row[:6]
+    timestamp = row[6] if len(row) > 6 else None
+    return (symbol, open_price, high_price, low_price, close_price, volume, format_timestamp(timestamp))
+
+def _trade_params(trade):
+    """Map a trade (tuple or dict) to (user_id, symbol, trade_type, shares, price, total_amount)"""
+    if isinstance(trade, dict):
+        total_amount = trade.get("total_amount")
+        if total_amount is None:
+            total_amount = trade["shares"] * trade["price"]
+        return (trade["user_id"], trade["symbol"], trade["trade_type"], trade["shares"], trade["price"], total_amount)
+    
+    user_id, symbol, trade_type, shares, price = trade[:5]
+    total_amount = trade[5] if len(trade) > 5 and trade[5] is not None else shares * price
+    return (user_id, symbol, trade_type, shares, price, total_amount)
 
 class StockDatabase:
-    def __init__(self, db_path="stock_trader.db"):
+    def __init__(self, db_path="stock_trader.db", pool_size=5, storage_profile=None, history_backend=None,
+                 history_cache_size=0, session_cache_size=10000, session_cache_ttl=30.0, bar_rollup=False):
         self.db_path = db_path
+        # Optional alternative store for price history (e.g. ColumnarPriceStore)
+        self.history_backend = history_backend
+        # Optional in-memory ring buffers of the newest bars per symbol
+        self.history_cache = RecentBarCache(history_cache_size) if history_cache_size else None
+        # Validated sessions, shared by every StockDatabase on this file
+        self.session_cache = (
+            get_session_cache(db_path, max_size=session_cache_size, ttl=session_cache_ttl)
+            if session_cache_size else None
+        )
+        # Incremental indicator series, created on first get_indicator call
+        self.indicators = None
+        # Mark-to-market engine, created on first revalue_portfolios call
+        self.valuator = None
+        # Monte Carlo VaR/CVaR engine, created on first compute_portfolio_risk call
+        self.risk = None
+        self.pool = get_pool(db_path, pool_size=pool_size)
+        self._pool_released = False
+        self.storage_profile = self._claim_storage_profile(storage_profile)
         self.init_database()
+        # OHLCV bar tables, brought up to date after every write to stock_price_history
+        self.bar_rollup = None
+        if bar_rollup:
+            if history_backend is not None:
+                self.close()
+                raise ValueError("bar_rollup reads stock_price_history and cannot be used with a history_backend")
+            from bar_rollup import BarRollup
+            self.bar_rollup = BarRollup(self)
+        if self.history_cache is not None:
+            self.warm_history_cache()
     
-    def init_database(self):
-        """Initialize the database with required tables"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Users table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                email TEXT UNIQUE,
-                password_hash TEXT NOT NULL,
-                first_name TEXT,
-                last_name TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_login TIMESTAMP,
-                is_active BOOLEAN DEFAULT 1
-            )
-        ''')
-        
-        # User sessions table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_sessions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                session_token TEXT UNIQUE NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                expires_at TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
-        
-        # User portfolios table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_portfolios (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                symbol TEXT NOT NULL,
-                shares REAL NOT NULL,
-                average_price REAL NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
-        
-        # Trading history table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS trading_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                symbol TEXT NOT NULL,
-                trade_type TEXT NOT NULL,
-                shares REAL NOT NULL,
-                price REAL NOT NULL,
-                total_amount REAL NOT NULL,
-                commission REAL DEFAULT 9.99,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
-        
-        # User balances table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_balances (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER UNIQUE,
-                cash_balance REAL DEFAULT 100000.0,
-                total_value REAL DEFAULT 100000.0,
-                last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
-        
-        # User preferences table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_preferences (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER UNIQUE,
-                dark_mode BOOLEAN DEFAULT 1,
-                default_timeframe TEXT DEFAULT '1D',
-                default_chart_type TEXT DEFAULT 'candlestick',
-                notifications_enabled BOOLEAN DEFAULT 1,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
-        
-        # Stock price history table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS stock_price_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                symbol TEXT NOT NULL,
-                open_price REAL NOT NULL,
-                high_price REAL NOT NULL,
-                low_price REAL NOT NULL,
-                close_price REAL NOT NULL,
-                volume INTEGER NOT NULL,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    def _claim_storage_profile(self, storage_profile):
+        """Use the shared pool's storage profile, setting it if this is the first instance
+        
+        The profile applies to every connection of the pool, so an instance
+        that asks for a different one than the pool already runs with is
+        refused. None takes whatever the pool has (the default profile for
+        a new pool).
+        """
+        requested = resolve_profile(storage_profile)
+        profile = self.pool.claim_setting("storage_profile", requested)
+        
+        if profile is requested:
+            self.pool.set_connect_hook("storage_profile", lambda conn: apply_profile(conn, profile))
+        elif storage_profile is not None and profile != requested:
+            self.close()
+            raise ValueError(
+                f"{self.db_path} is already open with storage profile '{profile['name']}', "
+                f"not '{requested['name']}'"
             )
-        ''')
         
-        conn.commit()
-        conn.close()
+        return profile
     
-    def create_user(self, username, password, email=None, first_name=None, last_name=None):
-        """Create a new user account"""
-        try:
-            conn = sqlite3.connect(self.db_path)
+    def init_database(self):
+        """Initialize the database with required tables
+        
+        Pooled connections are opened with the configured storage profile
+        (WAL journal, synchronous level, cache/mmap sizes, busy timeout),
+        so the tables are created in WAL mode.
+        """
+        with self.pool.connection() as conn:
             cursor = conn.cursor()
             
-            # Hash the password
-            password_hash = hashlib.sha256(password.encode()).hexdigest()
+            # Users table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT UNIQUE NOT NULL,
+                    email TEXT UNIQUE,
+                    password_hash TEXT NOT NULL,
+                    first_name TEXT,
+                    last_name TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    last_login TIMESTAMP,
+                    is_active BOOLEAN DEFAULT 1
+                )
+            ''')
             
+            # User sessions table
             cursor.execute('''
-                INSERT INTO users (username, email, password_hash, first_name, last_name)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (username, email, password_hash, first_name, last_name))
+                CREATE TABLE IF NOT EXISTS user_sessions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    session_token TEXT UNIQUE NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    expires_at TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users (id)
+                )
+            ''')
             
-            user_id = cursor.lastrowid
+            # User portfolios table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS user_portfolios (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    symbol TEXT NOT NULL,
+                    shares REAL NOT NULL,
+                    average_price REAL NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users (id)
+                )
+            ''')
             
-            # Initialize user balance
+            # Trading history table
             cursor.execute('''
-                INSERT INTO user_balances (user_id, cash_balance, total_value)
-                VALUES (?, 100000.0, 100000.0)
-            ''', (user_id,))
+                CREATE TABLE IF NOT EXISTS trading_history (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    symbol TEXT NOT NULL,
+                    trade_type TEXT NOT NULL,
+                    shares REAL NOT NULL,
+                    price REAL NOT NULL,
+                    total_amount REAL NOT NULL,
+                    commission REAL DEFAULT 9.99,
+                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users (id)
+                )
+            ''')
             
-            # Initialize user preferences
+            # User balances table
             cursor.execute('''
-                INSERT INTO user_preferences (user_id, dark_mode, default_timeframe, default_chart_type)
-                VALUES (?, 1, '1D', 'candlestick')
-            ''', (user_id,))
+                CREATE TABLE IF NOT EXISTS user_balances (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER UNIQUE,
+                    cash_balance REAL DEFAULT 100000.0,
+                    total_value REAL DEFAULT 100000.0,
+                    last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users (id)
+                )
+            ''')
             
-            conn.commit()
-            conn.close()
+            # User preferences table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS user_preferences (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER UNIQUE,
+                    dark_mode BOOLEAN DEFAULT 1,
+                    default_timeframe TEXT DEFAULT '1D',
+                    default_chart_type TEXT DEFAULT 'candlestick',
+                    notifications_enabled BOOLEAN DEFAULT 1,
+                    FOREIGN KEY (user_id) REFERENCES users (id)
+                )
+            ''')
+            
+            # Stock price history table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS stock_price_history (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    symbol TEXT NOT NULL,
+                    open_price REAL NOT NULL,
+                    high_price REAL NOT NULL,
+                    low_price REAL NOT NULL,
+                    close_price REAL NOT NULL,
+                    volume INTEGER NOT NULL,
+                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            # Same index as init_Database.sql; trade history is paged by user and time
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_trading_user_timestamp
+                ON trading_history(user_id, timestamp)
+            ''')
+            
+            # Same index as init_Database.sql; trades look positions up by owner and symbol
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_portfolios_user_symbol
+                ON user_portfolios(user_id, symbol)
+            ''')
+            
+            # Same index as init_Database.sql; per-symbol history reads are ordered by time
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_price_history_symbol_timestamp
+                ON stock_price_history(symbol, timestamp)
+            ''')
             
-            return {"success": True, "user_id": user_id, "message": "User created successfully"}
+            conn.commit()
+    
+    def create_user(self, username, password, email=None, first_name=None, last_name=None):
+        """Create a new user account"""
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                # Hash the password
+                password_hash = hashlib.sha256(password.encode()).hexdigest()
+                
+                cursor.execute('''
+                    INSERT INTO users (username, email, password_hash, first_name, last_name)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (username, email, password_hash, first_name, last_name))
+                
+                user_id = cursor.lastrowid
+                
+                # Initialize user balance
+                cursor.execute('''
+                    INSERT INTO user_balances (user_id, cash_balance, total_value)
+                    VALUES (?, 100000.0, 100000.0)
+                ''', (user_id,))
+                
+                # Initialize user preferences
+                cursor.execute('''
+                    INSERT INTO user_preferences (user_id, dark_mode, default_timeframe, default_chart_type)
+                    VALUES (?, 1, '1D', 'candlestick')
+                ''', (user_id,))
+                
+                conn.commit()
+                
+                return {"success": True, "user_id": user_id, "message": "User created successfully"}
         
         except sqlite3.IntegrityError:
             return {"success": False, "message": "Username or email already exists"}
@@ -154,82 +274,91 @@ class StockDatabase:
     def authenticate_user(self, username, password):
         """Authenticate user login"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            password_hash = hashlib.sha256(password.encode()).hexdigest()
-            
-            cursor.execute('''
-                SELECT id, username, first_name, last_name, email
-                FROM users 
-                WHERE username = ? AND password_hash = ? AND is_active = 1
-            ''', (username, password_hash))
-            
-            user = cursor.fetchone()
-            
-            if user:
-                user_id, username, first_name, last_name, email = user
-                
-                # Update last login
-                cursor.execute('''
-                    UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?
-                ''', (user_id,))
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
                 
-                # Create session token
-                session_token = hashlib.sha256(f"{username}{datetime.now()}".encode()).hexdigest()
+                password_hash = hashlib.sha256(password.encode()).hexdigest()
                 
-                # Store session
                 cursor.execute('''
-                    INSERT INTO user_sessions (user_id, session_token, expires_at)
-                    VALUES (?, ?, datetime('now', '+24 hours'))
-                ''', (user_id, session_token))
+                    SELECT id, username, first_name, last_name, email
+                    FROM users 
+                    WHERE username = ? AND password_hash = ? AND is_active = 1
+                ''', (username, password_hash))
                 
-                conn.commit()
-                conn.close()
+                user = cursor.fetchone()
                 
-                return {
-                    "success": True,
-                    "user_id": user_id,
-                    "username": username,
-                    "first_name": first_name,
-                    "last_name": last_name,
-                    "email": email,
-                    "session_token": session_token
-                }
-            else:
-                conn.close()
-                return {"success": False, "message": "Invalid username or password"}
+                if user:
+                    user_id, username, first_name, last_name, email = user
+                    
+                    # Update last login
+                    cursor.execute('''
+                        UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?
+                    ''', (user_id,))
+                    
+                    # Create session token
+                    session_token = hashlib.sha256(f"{username}{datetime.now()}".encode()).hexdigest()
+                    
+                    # Store session
+                    cursor.execute('''
+                        INSERT INTO user_sessions (user_id, session_token, expires_at)
+                        VALUES (?, ?, datetime('now', '+24 hours'))
+                    ''', (user_id, session_token))
+                    
+                    conn.commit()
+                    
+                    return {
+                        "success": True,
+                        "user_id": user_id,
+                        "username": username,
+                        "first_name": first_name,
+                        "last_name": last_name,
+                        "email": email,
+                        "session_token": session_token
+                    }
+                else:
+                    return {"success": False, "message": "Invalid username or password"}
         
         except Exception as e:
             return {"success": False, "message": f"Authentication error: {str(e)}"}
     
     def validate_session(self, session_token):
         """Validate user session"""
+        if self.session_cache is not None:
+            cached = self.session_cache.get(session_token)
+            if cached is not None:
+                return dict(cached)
+        
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            started = time.monotonic()
             
-            cursor.execute('''
-                SELECT u.id, u.username, u.first_name, u.last_name, u.email
-                FROM users u
-                JOIN user_sessions s ON u.id = s.user_id
-                WHERE s.session_token = ? AND s.expires_at > CURRENT_TIMESTAMP AND u.is_active = 1
-            ''', (session_token,))
-            
-            user = cursor.fetchone()
-            conn.close()
-            
-            if user:
-                return {
-                    "success": True,
-                    "user_id": user[0],
-                    "username": user[1],
-                    "first_name": user[2],
-                    "last_name": user[3],
-                    "email": user[4]
-                }
-            else:
-                return {"success": False, "message": "Invalid or expired session"}
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    SELECT u.id, u.username, u.first_name, u.last_name, u.email, s.expires_at
+                    FROM users u
+                    JOIN user_sessions s ON u.id = s.user_id
+                    WHERE s.session_token = ? AND s.expires_at > CURRENT_TIMESTAMP AND u.is_active = 1
+                ''', (session_token,))
+                
+                user = cursor.fetchone()
+                
+                if user:
+                    result = {
+                        "success": True,
+                        "user_id": user[0],
+                        "username": user[1],
+                        "first_name": user[2],
+                        "last_name": user[3],
+                        "email": user[4]
+                    }
+                    
+                    if self.session_cache is not None:
+                        self.session_cache.put(session_token, dict(result), user[5], started)
+                    
+                    return result
+                else:
+                    return {"success": False, "message": "Invalid or expired session"}
         
         except Exception as e:
             return {"success": False, "message": f"Session validation error: {str(e)}"}
@@ -237,22 +366,21 @@ class StockDatabase:
     def get_user_portfolio(self, user_id):
         """Get user's current portfolio"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT symbol, shares, average_price
-                FROM user_portfolios
-                WHERE user_id = ? AND shares > 0
-            ''', (user_id,))
-            
-            portfolio = cursor.fetchall()
-            conn.close()
-            
-            return {
-                "success": True,
-                "portfolio": [{"symbol": row[0], "shares": row[1], "average_price": row[2]} for row in portfolio]
-            }
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    SELECT symbol, shares, average_price
+                    FROM user_portfolios
+                    WHERE user_id = ? AND shares > 0
+                ''', (user_id,))
+                
+                portfolio = cursor.fetchall()
+                
+                return {
+                    "success": True,
+                    "portfolio": [{"symbol": row[0], "shares": row[1], "average_price": row[2]} for row in portfolio]
+                }
         
         except Exception as e:
             return {"success": False, "message": f"Error fetching portfolio: {str(e)}"}
@@ -260,206 +388,582 @@ class StockDatabase:
     def get_user_balance(self, user_id):
         """Get user's current balance"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT cash_balance, total_value
-                FROM user_balances
-                WHERE user_id = ?
-            ''', (user_id,))
-            
-            balance = cursor.fetchone()
-            conn.close()
-            
-            if balance:
-                return {
-                    "success": True,
-                    "cash_balance": balance[0],
-                    "total_value": balance[1]
-                }
-            else:
-                return {"success": False, "message": "Balance not found"}
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    SELECT cash_balance, total_value
+                    FROM user_balances
+                    WHERE user_id = ?
+                ''', (user_id,))
+                
+                balance = cursor.fetchone()
+                
+                if balance:
+                    return {
+                        "success": True,
+                        "cash_balance": balance[0],
+                        "total_value": balance[1]
+                    }
+                else:
+                    return {"success": False, "message": "Balance not found"}
         
         except Exception as e:
             return {"success": False, "message": f"Error fetching balance: {str(e)}"}
     
     def execute_trade(self, user_id, symbol, trade_type, shares, price, total_amount):
         """Execute a trade and update portfolio"""
+        result = self.execute_trades([(user_id, symbol, trade_type, shares, price, total_amount)])
+        
+        if not result["success"]:
+            return {"success": False, "message": result["message"]}
+        
+        trade = result["results"][0]
+        if not trade["success"]:
+            return {"success": False, "message": trade["message"]}
+        
+        return {"success": True, "message": "Trade executed successfully"}
+    
+    def execute_trades(self, trades, on_error="skip"):
+        """Execute many trades, across users, in one transaction
+        
+        Trades are (user_id, symbol, trade_type, shares, price, total_amount)
+        tuples or dicts with those keys (total_amount defaults to
+        shares * price) and are applied in order, so a later trade sees the
+        cash and shares left by earlier ones. Buys need enough cash, sells
+        enough shares. With on_error="skip" rejected trades are reported and
+        the rest committed; with on_error="abort" the first rejection rolls
+        back the whole batch.
+        """
+        if on_error not in ("skip", "abort"):
+            return {"success": False, "message": "on_error must be 'skip' or 'abort'"}
+        
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Record the trade
-            cursor.execute('''
-                INSERT INTO trading_history (user_id, symbol, trade_type, shares, price, total_amount)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (user_id, symbol, trade_type, shares, price, total_amount))
+            trades = [_trade_params(trade) for trade in trades]
+            user_ids = sorted({trade[0] for trade in trades})
             
-            if trade_type == 'buy':
-                # Check if user already owns this stock
-                cursor.execute('''
-                    SELECT shares, average_price FROM user_portfolios 
-                    WHERE user_id = ? AND symbol = ?
-                ''', (user_id, symbol))
-                
-                existing = cursor.fetchone()
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
                 
-                if existing:
-                    # Update existing position
-                    current_shares, current_avg = existing
-                    new_shares = current_shares + shares
-                    new_avg = ((current_shares * current_avg) + (shares * price)) / new_shares
+                try:
+                    # Load every affected balance and position up front, under the write lock
+                    balances = {}
+                    positions = {}
+                    for i in range(0, len(user_ids), 500):
+                        chunk = user_ids[i:i + 500]
+                        placeholders = ",".join("?" * len(chunk))
+                        
+                        cursor.execute(f'''
+                            SELECT user_id, cash_balance FROM user_balances WHERE user_id IN ({placeholders})
+                        ''', chunk)
+                        balances.update(cursor.fetchall())
+                        
+                        cursor.execute(f'''
+                            SELECT user_id, symbol, shares, average_price FROM user_portfolios
+                            WHERE user_id IN ({placeholders})
+                            ORDER BY id
+                        ''', chunk)
+                        for position_user, position_symbol, position_shares, position_avg in cursor.fetchall():
+                            positions.setdefault((position_user, position_symbol), [position_shares, position_avg, True])
                     
-                    cursor.execute('''
-                        UPDATE user_portfolios 
+                    cash = dict(balances)
+                    accepted = []
+                    results = []
+                    
+                    for index, (user_id, symbol, trade_type, shares, price, total_amount) in enumerate(trades):
+                        message = None
+                        position = positions.get((user_id, symbol))
+                        
+                        if trade_type not in ("buy", "sell"):
+                            message = f"Invalid trade type '{trade_type}'"
+                        elif shares <= 0:
+                            message = "Shares must be positive"
+                        elif user_id not in cash:
+                            message = "Balance not found"
+                        elif trade_type == "buy":
+                            if cash[user_id] < total_amount:
+                                message = "Insufficient cash balance"
+                            else:
+                                cash[user_id] -= total_amount
+                                if position is None or position[0] <= 0:
+                                    existed = position[2] if position else False
+                                    positions[(user_id, symbol)] = [shares, price, existed]
+                                else:
+                                    new_shares = position[0] + shares
+                                    position[1] = ((position[0] * position[1]) + (shares * price)) / new_shares
+                                    position[0] = new_shares
+                        else:
+                            if position is None or position[0] < shares:
+                                message = "Insufficient shares to sell"
+                            else:
+                                cash[user_id] += total_amount
+                                position[0] -= shares
+                        
+                        if message is None:
+                            accepted.append((user_id, symbol, trade_type, shares, price, total_amount))
+                            results.append({"index": index, "success": True})
+                        else:
+                            results.append({"index": index, "success": False, "message": message})
+                            if on_error == "abort":
+                                conn.rollback()
+                                return {
+                                    "success": False,
+                                    "message": f"Trade {index} rejected: {message}",
+                                    "executed": 0,
+                                    "rejected": 1,
+                                    "results": results
+                                }
+                    
+                    # Write the net effect of the batch with one statement per kind of change
+                    cursor.executemany('''
+                        INSERT INTO trading_history (user_id, symbol, trade_type, shares, price, total_amount)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                    ''', accepted)
+                    
+                    cursor.executemany('''
+                        UPDATE user_balances
+                        SET cash_balance = ?, last_updated = CURRENT_TIMESTAMP
+                        WHERE user_id = ?
+                    ''', [(cash[user_id], user_id) for user_id in cash if cash[user_id] != balances[user_id]])
+                    
+                    touched = {(trade[0], trade[1]) for trade in accepted}
+                    updates, inserts, deletes = [], [], []
+                    for key in touched:
+                        position_shares, position_avg, existed = positions[key]
+                        if position_shares > 0:
+                            (updates if existed else inserts).append((position_shares, position_avg) + key)
+                        elif existed:
+                            deletes.append(key)
+                    
+                    cursor.executemany('''
+                        UPDATE user_portfolios
                         SET shares = ?, average_price = ?, updated_at = CURRENT_TIMESTAMP
                         WHERE user_id = ? AND symbol = ?
-                    ''', (new_shares, new_avg, user_id, symbol))
-                else:
-                    # Create new position
-                    cursor.execute('''
-                        INSERT INTO user_portfolios (user_id, symbol, shares, average_price)
+                    ''', updates)
+                    cursor.executemany('''
+                        INSERT INTO user_portfolios (shares, average_price, user_id, symbol)
                         VALUES (?, ?, ?, ?)
-                    ''', (user_id, symbol, shares, price))
-                
-                # Update cash balance
-                cursor.execute('''
-                    UPDATE user_balances 
-                    SET cash_balance = cash_balance - ?, last_updated = CURRENT_TIMESTAMP
-                    WHERE user_id = ?
-                ''', (total_amount, user_id))
-            
-            elif trade_type == 'sell':
-                # Check if user has enough shares
-                cursor.execute('''
-                    SELECT shares FROM user_portfolios 
-                    WHERE user_id = ? AND symbol = ?
-                ''', (user_id, symbol))
-                
-                current_shares = cursor.fetchone()
-                
-                if current_shares and current_shares[0] >= shares:
-                    new_shares = current_shares[0] - shares
-                    
-                    if new_shares > 0:
-                        cursor.execute('''
-                            UPDATE user_portfolios 
-                            SET shares = ?, updated_at = CURRENT_TIMESTAMP
-                            WHERE user_id = ? AND symbol = ?
-                        ''', (new_shares, user_id, symbol))
-                    else:
-                        cursor.execute('''
-                            DELETE FROM user_portfolios 
-                            WHERE user_id = ? AND symbol = ?
-                        ''', (user_id, symbol))
+                    ''', inserts)
+                    cursor.executemany('''
+                        DELETE FROM user_portfolios WHERE user_id = ? AND symbol = ?
+                    ''', deletes)
                     
-                    # Update cash balance
-                    cursor.execute('''
-                        UPDATE user_balances 
-                        SET cash_balance = cash_balance + ?, last_updated = CURRENT_TIMESTAMP
-                        WHERE user_id = ?
-                    ''', (total_amount, user_id))
-                else:
+                    conn.commit()
+                
+                except Exception:
                     conn.rollback()
-                    conn.close()
-                    return {"success": False, "message": "Insufficient shares to sell"}
+                    raise
+                
+                return {
+                    "success": True,
+                    "executed": len(accepted),
+                    "rejected": len(trades) - len(accepted),
+                    "results": results
+                }
+        
+        except Exception as e:
+            return {"success": False, "message": f"Error executing trades: {str(e)}"}
+    
+    def revalue_portfolios(self, prices=None, write_positions=False):
+        """Recompute total_value, unrealized P&L and allocation for every account"""
+        try:
+            if self.valuator is None:
+                self.valuator = PortfolioValuator(self)
             
-            conn.commit()
-            conn.close()
+            result = self.valuator.revalue(prices, write_positions=write_positions)
+            return {"success": True, **result}
+        
+        except Exception as e:
+            return {"success": False, "message": f"Error revaluing portfolios: {str(e)}"}
+    
+    def get_portfolio_valuation(self, user_id):
+        """Get the latest valuation of one account from the last revalue_portfolios run"""
+        if self.valuator is None:
+            return {"success": False, "message": "Portfolios have not been valued yet"}
+        
+        valuation = self.valuator.get_valuation(user_id)
+        if valuation is None:
+            return {"success": False, "message": "Balance not found"}
+        return {"success": True, **valuation}
+    
+    def compute_portfolio_risk(self, prices=None, n_paths=None, horizon=None, seed=None, workers=None):
+        """Simulate correlated price paths and recompute VaR/CVaR for every account and the whole system"""
+        try:
+            if self.risk is None:
+                self.risk = RiskEngine(self)
             
-            return {"success": True, "message": f"Trade executed successfully"}
+            result = self.risk.run(prices, n_paths=n_paths, horizon=horizon, seed=seed, workers=workers)
+            return {"success": True, **result}
         
         except Exception as e:
-            return {"success": False, "message": f"Error executing trade: {str(e)}"}
+            return {"success": False, "message": f"Error computing portfolio risk: {str(e)}"}
+    
+    def get_portfolio_risk(self, user_id):
+        """Get one account's VaR/CVaR from the last compute_portfolio_risk run"""
+        if self.risk is None:
+            return {"success": False, "message": "Portfolio risk has not been computed yet"}
+        
+        risk = self.risk.get_user_risk(user_id)
+        if risk is None:
+            return {"success": False, "message": "No open positions for this account"}
+        return {"success": True, **risk}
     
-    def save_stock_price(self, symbol, open_price, high_price, low_price, close_price, volume):
+    def save_stock_price(self, symbol, open_price, high_price, low_price, close_price, volume, timestamp=None):
         """Save stock price data"""
+        if self.history_cache is not None:
+            return self.save_stock_prices([(symbol, open_price, high_price, low_price, close_price, volume, timestamp)])
+        
+        if self.history_backend is not None:
+            return self.history_backend.save_stock_price(symbol, open_price, high_price, low_price,
+                                                         close_price, volume, timestamp)
+        
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    INSERT INTO stock_price_history (symbol, open_price, high_price, low_price, close_price, volume, timestamp)
+                    VALUES (?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+                ''', (symbol, open_price, high_price, low_price, close_price, volume, format_timestamp(timestamp)))
+                
+                conn.commit()
             
-            cursor.execute('''
-                INSERT INTO stock_price_history (symbol, open_price, high_price, low_price, close_price, volume)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (symbol, open_price, high_price, low_price, close_price, volume))
+            self._update_bar_rollup()
+            return {"success": True}
+        
+        except Exception as e:
+            return {"success": False, "message": f"Error saving price data: {str(e)}"}
+    
+    def save_stock_prices(self, rows):
+        """Save many stock price rows in a single transaction
+        
+        Each row is either a (symbol, open, high, low, close, volume[, timestamp])
+        tuple or a dict with the keys get_stock_history returns plus "symbol".
+        Rows without a timestamp get the database's CURRENT_TIMESTAMP.
+        """
+        if self.history_cache is not None:
+            return self._save_stock_prices_cached(rows)
+        
+        if self.history_backend is not None:
+            return self.history_backend.save_stock_prices(rows)
+        
+        return self._insert_stock_prices(rows)
+    
+    def _insert_stock_prices(self, rows):
+        """Insert price rows into stock_price_history"""
+        try:
+            params = [_price_row_params(row) for row in rows]
             
-            conn.commit()
-            conn.close()
+            if not params:
+                return {"success": True, "count": 0}
             
-            return {"success": True}
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.executemany('''
+                    INSERT INTO stock_price_history (symbol, open_price, high_price, low_price, close_price, volume, timestamp)
+                    VALUES (?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+                ''', params)
+                
+                conn.commit()
+            
+            self._update_bar_rollup()
+            return {"success": True, "count": len(params)}
         
         except Exception as e:
             return {"success": False, "message": f"Error saving price data: {str(e)}"}
     
+    def _update_bar_rollup(self):
+        """Fold newly committed ticks into the bar tables
+        
+        A failed update leaves the watermark where it was, so the next
+        write (or a scheduled ``bar_rollup.update()``) catches up.
+        """
+        if self.bar_rollup is not None:
+            self.bar_rollup.update()
+    
+    def _save_stock_prices_cached(self, rows):
+        """Save rows with explicit timestamps and feed them to the history cache"""
+        now = utc_timestamp()
+        params = []
+        for row in rows:
+            row = _price_row_params(row)
+            if row[6] is None:
+                row = row[:6] + (now,)
+            params.append(row)
+        
+        if self.history_backend is not None:
+            result = self.history_backend.save_stock_prices(params)
+        else:
+            result = self._insert_stock_prices(params)
+        
+        if result["success"]:
+            bars_by_symbol = {}
+            for symbol, open_price, high_price, low_price, close_price, volume, timestamp in params:
+                bars_by_symbol.setdefault(symbol, []).append({
+                    "open": float(open_price),
+                    "high": float(high_price),
+                    "low": float(low_price),
+                    "close": float(close_price),
+                    "volume": int(volume),
+                    "timestamp": timestamp
+                })
+            self.history_cache.extend(bars_by_symbol)
+        
+        return result
+    
     def get_stock_history(self, symbol, limit=100):
         """Get stock price history"""
+        if self.history_cache is None:
+            return self._read_stock_history(symbol, limit)
+        
+        history = self.history_cache.get(symbol, limit)
+        if history is not None:
+            return {"success": True, "history": history}
+        
+        generation = self.history_cache.generation(symbol)
+        requested = max(limit, self.history_cache.capacity)
+        result = self._read_stock_history(symbol, requested)
+        
+        if result["success"]:
+            self.history_cache.load(symbol, result["history"], requested, generation)
+            result["history"] = result["history"][:limit]
+        
+        return result
+    
+    def warm_history_cache(self, symbols=None):
+        """Preload the history cache with the newest bars of every (or the given) symbol"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            if symbols is None:
+                if self.history_backend is not None and hasattr(self.history_backend, "symbols"):
+                    symbols = self.history_backend.symbols()
+                else:
+                    with self.pool.connection() as conn:
+                        symbols = [row[0] for row in conn.execute(
+                            "SELECT DISTINCT symbol FROM stock_price_history"
+                        )]
             
-            cursor.execute('''
-                SELECT open_price, high_price, low_price, close_price, volume, timestamp
-                FROM stock_price_history
-                WHERE symbol = ?
-                ORDER BY timestamp DESC
-                LIMIT ?
-            ''', (symbol, limit))
+            warmed = 0
+            for symbol in symbols:
+                generation = self.history_cache.generation(symbol)
+                result = self._read_stock_history(symbol, self.history_cache.capacity)
+                if result["success"] and self.history_cache.load(
+                        symbol, result["history"], self.history_cache.capacity, generation):
+                    warmed += 1
+            
+            return {"success": True, "symbols_warmed": warmed}
+        
+        except Exception as e:
+            return {"success": False, "message": f"Error warming history cache: {str(e)}"}
+    
+    def get_history_cache_stats(self):
+        """Get history cache hit/miss statistics"""
+        if self.history_cache is None:
+            return {"success": False, "message": "History cache is disabled"}
+        return {"success": True, "stats": self.history_cache.stats()}
+    
+    def _read_stock_history(self, symbol, limit):
+        """Read the newest price rows from the history backend or SQLite"""
+        if self.history_backend is not None:
+            return self.history_backend.get_stock_history(symbol, limit)
+        
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    SELECT open_price, high_price, low_price, close_price, volume, timestamp
+                    FROM stock_price_history
+                    WHERE symbol = ?
+                    ORDER BY timestamp DESC, id DESC
+                    LIMIT ?
+                ''', (symbol, limit))
+                
+                history = cursor.fetchall()
+                
+                return {
+                    "success": True,
+                    "history": [
+                        {
+                            "open": row[0],
+                            "high": row[1],
+                            "low": row[2],
+                            "close": row[3],
+                            "volume": row[4],
+                            "timestamp": row[5]
+                        } for row in history
+                    ]
+                }
+        
+        except Exception as e:
+            return {"success": False, "message": f"Error fetching stock history: {str(e)}"}
+    
+    def iter_stock_history(self, symbol, chunk_size=1000, page_token=None, newest_first=True,
+                           start=None, end=None, chunks=False):
+        """Stream price history lazily, one row (or one list of chunk_size rows) at a time
+        
+        Rows come in (timestamp, id) order, newest first by default, with
+        start <= timestamp < end. Only one chunk is in memory at a time and
+        no connection is held between chunks. page_token resumes after the
+        last row of a get_stock_history_page call.
+        """
+        scope = self._stock_history_scope(symbol, newest_first, start, end)
+        after = decode_page_token(page_token, scope) if page_token else None
+        
+        for chunk in self._stock_history_chunks(symbol, chunk_size, after, newest_first, start, end):
+            rows = [row for _, row in chunk]
+            if chunks:
+                yield rows
+            else:
+                yield from rows
+    
+    def get_stock_history_page(self, symbol, page_size=100, page_token=None, newest_first=True,
+                               start=None, end=None):
+        """Get one page of price history and a token for the next page (None on the last page)"""
+        try:
+            scope = self._stock_history_scope(symbol, newest_first, start, end)
+            after = decode_page_token(page_token, scope) if page_token else None
             
-            history = cursor.fetchall()
-            conn.close()
+            chunk = next(self._stock_history_chunks(symbol, page_size + 1, after, newest_first, start, end), [])
+            page = chunk[:page_size]
             
             return {
                 "success": True,
-                "history": [
-                    {
-                        "open": row[0],
-                        "high": row[1],
-                        "low": row[2],
-                        "close": row[3],
-                        "volume": row[4],
-                        "timestamp": row[5]
-                    } for row in history
-                ]
+                "history": [row for _, row in page],
+                "next_page_token": encode_page_token(scope, page[-1][0]) if len(chunk) > page_size else None
             }
         
         except Exception as e:
             return {"success": False, "message": f"Error fetching stock history: {str(e)}"}
     
-    def update_user_preferences(self, user_id, dark_mode=None, default_timeframe=None, default_chart_type=None):
-        """Update user preferences"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+    def _stock_history_scope(self, symbol, newest_first, start, end):
+        """Identify a stock history query (and its backend) for page tokens"""
+        backend = "columnar" if self.history_backend is not None else "sqlite"
+        return ("stock_price_history", backend, symbol, newest_first, format_timestamp(start), format_timestamp(end))
+    
+    def _stock_history_chunks(self, symbol, chunk_size, after, newest_first, start, end):
+        """Yield lists of (keyset position, row) from the history backend or SQLite"""
+        if self.history_backend is not None:
+            position = after[0] if after else None
+            for chunk in self.history_backend.iter_history_chunks(symbol, chunk_size, position, newest_first,
+                                                                  start, end):
+                yield [((position,), row) for position, row in chunk]
+            return
+        
+        where, params = "symbol = ?", (symbol,)
+        if start is not None:
+            where, params = where + " AND timestamp >= ?", params + (format_timestamp(start),)
+        if end is not None:
+            where, params = where + " AND timestamp < ?", params + (format_timestamp(end),)
+        
+        columns = "open_price, high_price, low_price, close_price, volume"
+        for chunk in self._keyset_chunks("stock_price_history", columns, where, params, chunk_size, after,
+                                         newest_first):
+            yield [
+                (
+                    (row[0], row[1]),
+                    {
+                        "open": row[2],
+                        "high": row[3],
+                        "low": row[4],
+                        "close": row[5],
+                        "volume": row[6],
+                        "timestamp": row[0]
+                    }
+                ) for row in chunk
+            ]
+    
+    def _keyset_chunks(self, table, columns, where, params, chunk_size, after, newest_first):
+        """Yield lists of (timestamp, id, *columns) rows in (timestamp, id) order, seeking past after"""
+        direction, comparison = ("DESC", "<") if newest_first else ("ASC", ">")
+        
+        while True:
+            keyset, keyset_params = "", ()
+            if after is not None:
+                keyset, keyset_params = f"AND (timestamp, id) {comparison} (?, ?)", tuple(after)
             
-            updates = []
-            params = []
+            with self.pool.connection() as conn:
+                rows = conn.execute(f'''
+                    SELECT timestamp, id, {columns}
+                    FROM {table}
+                    WHERE {where} {keyset}
+                    ORDER BY timestamp {direction}, id {direction}
+                    LIMIT ?
+                ''', params + keyset_params + (chunk_size,)).fetchall()
             
-            if dark_mode is not None:
-                updates.append("dark_mode = ?")
-                params.append(dark_mode)
+            if rows:
+                yield rows
+            if len(rows) < chunk_size:
+                return
+            after = rows[-1][:2]
+    
+    def get_indicator(self, symbol, indicator, limit=100, **params):
+        """Get the newest values of a technical indicator, kept up to date bar by bar"""
+        try:
+            if self.indicators is None:
+                self.indicators = IndicatorEngine(self)
             
-            if default_timeframe is not None:
-                updates.append("default_timeframe = ?")
-                params.append(default_timeframe)
+            return {"success": True, **self.indicators.get(symbol, indicator, limit, **params)}
+        
+        except Exception as e:
+            return {"success": False, "message": f"Error computing indicator: {str(e)}"}
+    
+    def compute_indicator(self, symbol, indicator, start=None, end=None, **params):
+        """Compute a technical indicator over the full (or a start/end bounded) price history"""
+        try:
+            columns = {"open": [], "high": [], "low": [], "close": [], "volume": [], "timestamp": []}
+            for chunk in self.iter_stock_history(symbol, chunk_size=10000, newest_first=False,
+                                                 start=start, end=end, chunks=True):
+                for column, values in columns.items():
+                    values.extend(row[column] for row in chunk)
             
-            if default_chart_type is not None:
-                updates.append("default_chart_type = ?")
-                params.append(default_chart_type)
+            result = compute_indicator(indicator, columns, **params)
             
-            if updates:
-                params.append(user_id)
-                cursor.execute(f'''
-                    UPDATE user_preferences 
-                    SET {', '.join(updates)}
-                    WHERE user_id = ?
-                ''', params)
+            return {
+                "success": True,
+                "symbol": symbol,
+                "indicator": indicator,
+                "timestamps": columns["timestamp"],
+                **{output: values.tolist() for output, values in result.items()}
+            }
+        
+        except Exception as e:
+            return {"success": False, "message": f"Error computing indicator: {str(e)}"}
+    
+    def update_user_preferences(self, user_id, dark_mode=None, default_timeframe=None, default_chart_type=None):
+        """Update user preferences"""
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
                 
-                conn.commit()
-            
-            conn.close()
-            
-            return {"success": True, "message": "Preferences updated"}
+                updates = []
+                params = []
+                
+                if dark_mode is not None:
+                    updates.append("dark_mode = ?")
+                    params.append(dark_mode)
+                
+                if default_timeframe is not None:
+                    updates.append("default_timeframe = ?")
+                    params.append(default_timeframe)
+                
+                if default_chart_type is not None:
+                    updates.append("default_chart_type = ?")
+                    params.append(default_chart_type)
+                
+                if updates:
+                    params.append(user_id)
+                    cursor.execute(f'''
+                        UPDATE user_preferences 
+                        SET {', '.join(updates)}
+                        WHERE user_id = ?
+                    ''', params)
+                    
+                    conn.commit()
+                
+                
+                return {"success": True, "message": "Preferences updated"}
         
         except Exception as e:
             return {"success": False, "message": f"Error updating preferences: {str(e)}"}
@@ -467,28 +971,27 @@ class StockDatabase:
     def get_user_preferences(self, user_id):
         """Get user preferences"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT dark_mode, default_timeframe, default_chart_type, notifications_enabled
-                FROM user_preferences
-                WHERE user_id = ?
-            ''', (user_id,))
-            
-            prefs = cursor.fetchone()
-            conn.close()
-            
-            if prefs:
-                return {
-                    "success": True,
-                    "dark_mode": bool(prefs[0]),
-                    "default_timeframe": prefs[1],
-                    "default_chart_type": prefs[2],
-                    "notifications_enabled": bool(prefs[3])
-                }
-            else:
-                return {"success": False, "message": "Preferences not found"}
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    SELECT dark_mode, default_timeframe, default_chart_type, notifications_enabled
+                    FROM user_preferences
+                    WHERE user_id = ?
+                ''', (user_id,))
+                
+                prefs = cursor.fetchone()
+                
+                if prefs:
+                    return {
+                        "success": True,
+                        "dark_mode": bool(prefs[0]),
+                        "default_timeframe": prefs[1],
+                        "default_chart_type": prefs[2],
+                        "notifications_enabled": bool(prefs[3])
+                    }
+                else:
+                    return {"success": False, "message": "Preferences not found"}
         
         except Exception as e:
             return {"success": False, "message": f"Error fetching preferences: {str(e)}"}
@@ -496,54 +999,167 @@ class StockDatabase:
     def get_trading_history(self, user_id, limit=50):
         """Get user's trading history"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT symbol, trade_type, shares, price, total_amount, timestamp
-                FROM trading_history
-                WHERE user_id = ?
-                ORDER BY timestamp DESC
-                LIMIT ?
-            ''', (user_id, limit))
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    SELECT symbol, trade_type, shares, price, total_amount, timestamp
+                    FROM trading_history
+                    WHERE user_id = ?
+                    ORDER BY timestamp DESC, id DESC
+                    LIMIT ?
+                ''', (user_id, limit))
+                
+                history = cursor.fetchall()
+                
+                return {
+                    "success": True,
+                    "history": [
+                        {
+                            "symbol": row[0],
+                            "trade_type": row[1],
+                            "shares": row[2],
+                            "price": row[3],
+                            "total_amount": row[4],
+                            "timestamp": row[5]
+                        } for row in history
+                    ]
+                }
+        
+        except Exception as e:
+            return {"success": False, "message": f"Error fetching trading history: {str(e)}"}
+    
+    def iter_trading_history(self, user_id, chunk_size=500, page_token=None, newest_first=True, chunks=False):
+        """Stream a user's trades lazily, one row (or one list of chunk_size rows) at a time
+        
+        Trades come in (timestamp, id) order, newest first by default.
+        page_token resumes after the last row of a get_trading_history_page call.
+        """
+        scope = ("trading_history", user_id, newest_first)
+        after = decode_page_token(page_token, scope) if page_token else None
+        
+        for chunk in self._trading_history_chunks(user_id, chunk_size, after, newest_first):
+            rows = [row for _, row in chunk]
+            if chunks:
+                yield rows
+            else:
+                yield from rows
+    
+    def get_trading_history_page(self, user_id, page_size=50, page_token=None, newest_first=True):
+        """Get one page of a user's trades and a token for the next page (None on the last page)"""
+        try:
+            scope = ("trading_history", user_id, newest_first)
+            after = decode_page_token(page_token, scope) if page_token else None
             
-            history = cursor.fetchall()
-            conn.close()
+            chunk = next(self._trading_history_chunks(user_id, page_size + 1, after, newest_first), [])
+            page = chunk[:page_size]
             
             return {
                 "success": True,
-                "history": [
-                    {
-                        "symbol": row[0],
-                        "trade_type": row[1],
-                        "shares": row[2],
-                        "price": row[3],
-                        "total_amount": row[4],
-                        "timestamp": row[5]
-                    } for row in history
-                ]
+                "history": [row for _, row in page],
+                "next_page_token": encode_page_token(scope, page[-1][0]) if len(chunk) > page_size else None
             }
         
         except Exception as e:
             return {"success": False, "message": f"Error fetching trading history: {str(e)}"}
     
+    def _trading_history_chunks(self, user_id, chunk_size, after, newest_first):
+        """Yield lists of ((timestamp, id), row) for a user's trades"""
+        columns = "symbol, trade_type, shares, price, total_amount"
+        for chunk in self._keyset_chunks("trading_history", columns, "user_id = ?", (user_id,), chunk_size,
+                                         after, newest_first):
+            yield [
+                (
+                    (row[0], row[1]),
+                    {
+                        "symbol": row[2],
+                        "trade_type": row[3],
+                        "shares": row[4],
+                        "price": row[5],
+                        "total_amount": row[6],
+                        "timestamp": row[0]
+                    }
+                ) for row in chunk
+            ]
+    
     def logout_user(self, session_token):
         """Logout user by removing session"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                DELETE FROM user_sessions WHERE session_token = ?
-            ''', (session_token,))
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    DELETE FROM user_sessions WHERE session_token = ?
+                ''', (session_token,))
+                
+                conn.commit()
+                
+                if self.session_cache is not None:
+                    self.session_cache.invalidate(session_token)
+                
+                return {"success": True, "message": "Logged out successfully"}
+        
+        except Exception as e:
+            return {"success": False, "message": f"Error logging out: {str(e)}"}
+    
+    def set_user_active(self, user_id, is_active):
+        """Activate or deactivate a user account"""
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    UPDATE users SET is_active = ? WHERE id = ?
+                ''', (1 if is_active else 0, user_id))
+                
+                if cursor.rowcount == 0:
+                    return {"success": False, "message": "User not found"}
+                
+                conn.commit()
+                
+                if not is_active and self.session_cache is not None:
+                    self.session_cache.invalidate_user(user_id)
+                
+                return {"success": True, "message": "User activated" if is_active else "User deactivated"}
+        
+        except Exception as e:
+            return {"success": False, "message": f"Error updating user status: {str(e)}"}
+    
+    def get_session_cache_stats(self):
+        """Get session cache hit rate and size"""
+        if self.session_cache is None:
+            return {"success": False, "message": "Session cache is disabled"}
+        return {"success": True, "stats": self.session_cache.stats()}
+    
+    def get_storage_profile(self):
+        """Get the configured storage profile and the PRAGMAs actually in effect"""
+        try:
+            with self.pool.connection() as conn:
+                actual = read_profile(conn)
             
-            conn.commit()
-            conn.close()
+            drift = diff_profile(actual, self.storage_profile)
             
-            return {"success": True, "message": "Logged out successfully"}
+            return {
+                "success": True,
+                "configured": self.storage_profile["name"],
+                "active": match_profile(actual) or "custom",
+                "in_sync": not drift,
+                "settings": actual,
+                "drift": drift
+            }
         
         except Exception as e:
-            return {"success": False, "message": f"Error logging out: {str(e)}"}
+            return {"success": False, "message": f"Error reading storage profile: {str(e)}"}
+    
+    def get_pool_stats(self):
+        """Get connection pool statistics"""
+        return {"success": True, "stats": self.pool.stats()}
+    
+    def close(self):
+        """Release this instance's hold on the shared pool; the last instance closes it"""
+        if not self._pool_released:
+            self._pool_released = True
+            release_pool(self.pool)
 
 # Example usage
 if __name__ == "__main__":
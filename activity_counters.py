@@ -0,0 +1,245 @@
+import argparse
+from typing import Dict, List
+
+# Per-user counters kept current by triggers on the three log tables, so the
+# activity summary is a one-row-per-user join instead of a join of every log
+# row. Counts follow the rows that exist: retention deletes decrement them.
+ACTIVITY_COUNTER_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS user_activity_counters (
+        user_id INTEGER PRIMARY KEY,
+        total_activities INTEGER NOT NULL DEFAULT 0,
+        total_logins INTEGER NOT NULL DEFAULT 0,
+        last_login TIMESTAMP,
+        security_events INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    # Activity logs
+    '''
+    CREATE TRIGGER IF NOT EXISTS activity_counters_activity_insert
+    AFTER INSERT ON user_activity_logs WHEN NEW.user_id IS NOT NULL
+    BEGIN
+        INSERT INTO user_activity_counters (user_id, total_activities) VALUES (NEW.user_id, 1)
+        ON CONFLICT(user_id) DO UPDATE SET total_activities = total_activities + 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS activity_counters_activity_delete
+    AFTER DELETE ON user_activity_logs WHEN OLD.user_id IS NOT NULL
+    BEGIN
+        UPDATE user_activity_counters SET total_activities = total_activities - 1
+        WHERE user_id = OLD.user_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS activity_counters_activity_update
+    AFTER UPDATE OF user_id ON user_activity_logs WHEN OLD.user_id IS NOT NEW.user_id
+    BEGIN
+        UPDATE user_activity_counters SET total_activities = total_activities - 1
+        WHERE user_id = OLD.user_id;
+        INSERT INTO user_activity_counters (user_id, total_activities)
+        SELECT NEW.user_id, 1 WHERE NEW.user_id IS NOT NULL
+        ON CONFLICT(user_id) DO UPDATE SET total_activities = total_activities + 1;
+    END
+    ''',
+    # Security events
+    '''
+    CREATE TRIGGER IF NOT EXISTS activity_counters_security_insert
+    AFTER INSERT ON user_security_events WHEN NEW.user_id IS NOT NULL
+    BEGIN
+        INSERT INTO user_activity_counters (user_id, security_events) VALUES (NEW.user_id, 1)
+        ON CONFLICT(user_id) DO UPDATE SET security_events = security_events + 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS activity_counters_security_delete
+    AFTER DELETE ON user_security_events WHEN OLD.user_id IS NOT NULL
+    BEGIN
+        UPDATE user_activity_counters SET security_events = security_events - 1
+        WHERE user_id = OLD.user_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS activity_counters_security_update
+    AFTER UPDATE OF user_id ON user_security_events WHEN OLD.user_id IS NOT NEW.user_id
+    BEGIN
+        UPDATE user_activity_counters SET security_events = security_events - 1
+        WHERE user_id = OLD.user_id;
+        INSERT INTO user_activity_counters (user_id, security_events)
+        SELECT NEW.user_id, 1 WHERE NEW.user_id IS NOT NULL
+        ON CONFLICT(user_id) DO UPDATE SET security_events = security_events + 1;
+    END
+    ''',
+    # Login history; last_login is only recomputed when the newest login goes away
+    '''
+    CREATE TRIGGER IF NOT EXISTS activity_counters_login_insert
+    AFTER INSERT ON user_login_history WHEN NEW.user_id IS NOT NULL
+    BEGIN
+        INSERT INTO user_activity_counters (user_id, total_logins, last_login)
+        VALUES (NEW.user_id, 1, NEW.login_timestamp)
+        ON CONFLICT(user_id) DO UPDATE SET
+            total_logins = total_logins + 1,
+            last_login = CASE
+                WHEN last_login IS NULL OR excluded.last_login > last_login THEN excluded.last_login
+                ELSE last_login
+            END;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS activity_counters_login_delete
+    AFTER DELETE ON user_login_history WHEN OLD.user_id IS NOT NULL
+    BEGIN
+        UPDATE user_activity_counters SET
+            total_logins = total_logins - 1,
+            last_login = CASE
+                WHEN OLD.login_timestamp >= last_login THEN
+                    (SELECT MAX(login_timestamp) FROM user_login_history WHERE user_id = OLD.user_id)
+                ELSE last_login
+            END
+        WHERE user_id = OLD.user_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS activity_counters_login_update
+    AFTER UPDATE OF user_id, login_timestamp ON user_login_history
+    BEGIN
+        INSERT OR IGNORE INTO user_activity_counters (user_id)
+        SELECT NEW.user_id WHERE NEW.user_id IS NOT NULL;
+        UPDATE user_activity_counters SET
+            total_logins = (SELECT COUNT(*) FROM user_login_history WHERE user_id = user_activity_counters.user_id),
+            last_login = (SELECT MAX(login_timestamp) FROM user_login_history
+                          WHERE user_id = user_activity_counters.user_id)
+        WHERE user_id IN (OLD.user_id, NEW.user_id);
+    END
+    ''',
+    # The summary view reads the counters instead of joining the logs
+    'DROP VIEW IF EXISTS user_activity_summary',
+    '''
+    CREATE VIEW user_activity_summary AS
+    SELECT
+        u.id as user_id,
+        u.username,
+        u.first_name,
+        u.last_name,
+        COALESCE(c.total_activities, 0) as total_activities,
+        COALESCE(c.total_logins, 0) as total_logins,
+        c.last_login,
+        COALESCE(c.security_events, 0) as security_events,
+        u.created_at as account_created
+    FROM users u
+    LEFT JOIN user_activity_counters c ON u.id = c.user_id
+    '''
+)
+
+# Counters recomputed from the log tables
+_EXPECTED_COUNTERS = '''
+    SELECT user_id, SUM(activities), SUM(logins), MAX(last_login), SUM(security_events)
+    FROM (
+        SELECT user_id, COUNT(*) AS activities, 0 AS logins, NULL AS last_login, 0 AS security_events
+        FROM user_activity_logs WHERE user_id IS NOT NULL GROUP BY user_id
+        UNION ALL
+        SELECT user_id, 0, COUNT(*), MAX(login_timestamp), 0
+        FROM user_login_history WHERE user_id IS NOT NULL GROUP BY user_id
+        UNION ALL
+        SELECT user_id, 0, 0, NULL, COUNT(*)
+        FROM user_security_events WHERE user_id IS NOT NULL GROUP BY user_id
+    )
+    GROUP BY user_id
+'''
+
+_STORED_COUNTERS = '''
+    SELECT user_id, total_activities, total_logins, last_login, security_events
+    FROM user_activity_counters
+    WHERE total_activities != 0 OR total_logins != 0 OR security_events != 0 OR last_login IS NOT NULL
+'''
+
+_COUNTER_COLUMNS = ('user_id', 'total_activities', 'total_logins', 'last_login', 'security_events')
+
+
+# True when the counter table is empty although some log row should be counted
+_NEEDS_FILL = '''
+    SELECT NOT EXISTS (SELECT 1 FROM user_activity_counters)
+       AND (EXISTS (SELECT 1 FROM user_activity_logs WHERE user_id IS NOT NULL)
+            OR EXISTS (SELECT 1 FROM user_login_history WHERE user_id IS NOT NULL)
+            OR EXISTS (SELECT 1 FROM user_security_events WHERE user_id IS NOT NULL))
+'''
+
+
+def install_activity_counters(conn) -> bool:
+    """Create the counter table, triggers and view; returns True if the counters were backfilled
+
+    The counters are filled from the existing logs in the same transaction
+    whenever they are empty but the logs are not, e.g. a new table or one
+    created before the logs were imported.
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        for statement in ACTIVITY_COUNTER_SCHEMA:
+            conn.execute(statement)
+        filled = bool(conn.execute(_NEEDS_FILL).fetchone()[0])
+        if filled:
+            _fill(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    return filled
+
+
+def _fill(conn):
+    conn.execute('DELETE FROM user_activity_counters')
+    conn.execute(f'''
+        INSERT INTO user_activity_counters
+        (user_id, total_activities, total_logins, last_login, security_events)
+        {_EXPECTED_COUNTERS}
+    ''')
+
+
+def rebuild_activity_counters(conn) -> int:
+    """Recompute every counter from the log tables; returns the number of users"""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        _fill(conn)
+        count = conn.execute('SELECT COUNT(*) FROM user_activity_counters').fetchone()[0]
+        conn.commit()
+        return count
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def check_activity_counters(conn) -> List[Dict]:
+    """Compare the counters with the log tables; returns one entry per mismatched user"""
+    expected = {row[0]: row for row in conn.execute(_EXPECTED_COUNTERS)}
+    stored = {row[0]: row for row in conn.execute(_STORED_COUNTERS)}
+
+    mismatches = []
+    for user_id in sorted(set(expected) | set(stored)):
+        want = expected.get(user_id)
+        have = stored.get(user_id)
+        if want != have:
+            mismatches.append({
+                'user_id': user_id,
+                'expected': dict(zip(_COUNTER_COLUMNS[1:], want[1:])) if want else None,
+                'stored': dict(zip(_COUNTER_COLUMNS[1:], have[1:])) if have else None
+            })
+    return mismatches
+
+
+if __name__ == "__main__":
+    import sqlite3
+
+    parser = argparse.ArgumentParser(description="Maintain the user_activity_counters table")
+    parser.add_argument("db_path", help="SQLite database")
+    parser.add_argument("command", choices=("install", "rebuild", "check"))
+    args = parser.parse_args()
+
+    connection = sqlite3.connect(args.db_path, isolation_level=None)
+    if args.command == "install":
+        print({"backfilled": install_activity_counters(connection)})
+    elif args.command == "rebuild":
+        print({"users": rebuild_activity_counters(connection)})
+    else:
+        problems = check_activity_counters(connection)
+        print({"consistent": not problems, "mismatches": problems})
@@ -0,0 +1,227 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from Database_for_user import StockDatabase
+from sever_manager import ServerManager
+
+# Methods with these prefixes only read and may run concurrently on the reader threads
+READ_PREFIXES = ('get_', 'check_', 'is_', 'validate_', 'verify_', 'iter_')
+READ_METHODS = frozenset({'compute_indicator'})
+# Read-looking methods that can write (check_activity_counters(repair=True))
+WRITE_METHODS = frozenset({'check_activity_counters'})
+
+_DONE = object()
+
+
+def is_read_method(name: str) -> bool:
+    return name not in WRITE_METHODS and (name in READ_METHODS or name.startswith(READ_PREFIXES))
+
+
+class _Lane:
+    """A thread pool plus a semaphore bounding the calls queued on it"""
+
+    def __init__(self, workers: int, max_pending: int, name: str):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self.slots = asyncio.Semaphore(max_pending)
+        self.submitted = 0
+        self.cancelled = 0
+
+    async def run(self, func: Callable, timeout: Optional[float]):
+        await self.slots.acquire()
+        loop = asyncio.get_running_loop()
+        try:
+            future = self.executor.submit(func)
+        except BaseException:
+            self.slots.release()
+            raise
+        self.submitted += 1
+        # Free the slot when the thread is really done, not when the awaiting task gives up
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self.slots.release))
+
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            # Calls that have not started yet never run; running ones finish in the background
+            if future.cancel():
+                self.cancelled += 1
+            raise
+
+
+class _Lanes:
+    """Reader and writer lanes shared by the facades over one database file"""
+
+    def __init__(self, readers: int, max_pending: int):
+        self.reader = _Lane(readers, max_pending, 'async-db-reader')
+        # One writer thread: SQLite takes one write lock at a time anyway
+        self.writer = _Lane(1, max_pending, 'async-db-writer')
+        self.inflight: Dict[Tuple, asyncio.Future] = {}
+        self.coalesced = 0
+        self.closed = False
+
+    def shutdown(self):
+        self.closed = True
+        self.reader.executor.shutdown(wait=True, cancel_futures=True)
+        self.writer.executor.shutdown(wait=True, cancel_futures=True)
+
+
+class AsyncFacade:
+    """Awaitable versions of every public method of a blocking object
+
+    Reads (see ``is_read_method``) run on a pool of ``readers`` threads and
+    everything else on a single writer thread, so writes never contend
+    for SQLite's write lock. At most ``max_pending`` calls are queued per
+    lane; further callers wait. Awaiting tasks can be cancelled or time
+    out (``timeout`` default, or per call through ``call``): a call that
+    has not started is dropped, one already running finishes in the
+    background and its result is discarded.
+
+    Identical concurrent reads (same method and hashable arguments) are
+    coalesced into one call whose result object is shared by all callers,
+    so treat results as read-only. Coalescing only joins calls already in
+    flight, and any write stops later reads from joining them, so a read
+    issued after a write always sees it. ``iter_*`` methods become async
+    iterators that pull one item per reader hop; pass ``chunks=True`` for
+    large scans.
+    """
+
+    def __init__(self, target, readers: int = 4, max_pending: int = 1000, timeout: float = None,
+                 lanes: _Lanes = None):
+        self._target = target
+        self._lanes = lanes if lanes is not None else _Lanes(readers, max_pending)
+        self.timeout = timeout
+
+    def __getattr__(self, name: str):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        attribute = getattr(self._target, name)
+        if not callable(attribute):
+            return attribute
+
+        if name.startswith('iter_'):
+            @functools.wraps(attribute)
+            def method(*args, **kwargs):
+                return self._iterate(attribute, args, kwargs)
+        else:
+            @functools.wraps(attribute)
+            async def method(*args, **kwargs):
+                return await self.call(name, *args, **kwargs)
+
+        # Cache so later lookups skip __getattr__
+        setattr(self, name, method)
+        return method
+
+    def __dir__(self):
+        return sorted(set(super().__dir__()) | {name for name in dir(self._target) if not name.startswith('_')})
+
+    async def call(self, name: str, *args, timeout: float = None, **kwargs) -> Any:
+        """Await ``name(*args, **kwargs)`` on the right lane, optionally with a per-call timeout"""
+        if self._lanes.closed:
+            raise RuntimeError("Async facade is closed")
+
+        func = functools.partial(getattr(self._target, name), *args, **kwargs)
+        timeout = self.timeout if timeout is None else timeout
+        lanes = self._lanes
+
+        if not is_read_method(name):
+            lanes.inflight.clear()
+            return await lanes.writer.run(func, timeout)
+
+        key = self._coalesce_key(name, args, kwargs)
+        if key is None:
+            return await lanes.reader.run(func, timeout)
+
+        shared = lanes.inflight.get(key)
+        if shared is None:
+            shared = lanes.inflight[key] = asyncio.ensure_future(lanes.reader.run(func, None))
+            shared.add_done_callback(functools.partial(self._read_done, key))
+        else:
+            lanes.coalesced += 1
+
+        # Shielded so one caller giving up does not cancel the call for the others
+        return await asyncio.wait_for(asyncio.shield(shared), timeout)
+
+    def _read_done(self, key: Tuple, shared: asyncio.Future):
+        if self._lanes.inflight.get(key) is shared:
+            del self._lanes.inflight[key]
+        # Retrieve the exception even if every caller has already given up
+        if not shared.cancelled():
+            shared.exception()
+
+    def _coalesce_key(self, name: str, args: Tuple, kwargs: Dict) -> Optional[Tuple]:
+        key = (id(self._target), name, args, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    async def _iterate(self, method: Callable, args: Tuple, kwargs: Dict):
+        iterator = iter(method(*args, **kwargs))
+        finished = False
+        try:
+            while True:
+                item = await self._lanes.reader.run(functools.partial(next, iterator, _DONE), self.timeout)
+                if item is _DONE:
+                    finished = True
+                    return
+                yield item
+        finally:
+            if not finished:
+                try:
+                    iterator.close()
+                except (AttributeError, ValueError):
+                    # Not a generator, or a cancelled hop is still running it
+                    pass
+
+    def stats(self) -> Dict:
+        lanes = self._lanes
+        return {
+            'reads_submitted': lanes.reader.submitted,
+            'writes_submitted': lanes.writer.submitted,
+            'reads_coalesced': lanes.coalesced,
+            'reads_in_flight': len(lanes.inflight),
+            'cancelled_before_start': lanes.reader.cancelled + lanes.writer.cancelled
+        }
+
+    async def close(self):
+        """Close the wrapped object on the writer thread, then stop both lanes"""
+        if self._lanes.closed:
+            return
+        close = getattr(self._target, 'close', None)
+        if close is not None:
+            await self._lanes.writer.run(close, None)
+        await asyncio.get_running_loop().run_in_executor(None, self._lanes.shutdown)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+
+class AsyncStockDatabase(AsyncFacade):
+    """Asyncio facade for StockDatabase; extra keyword arguments create one"""
+
+    def __init__(self, db: StockDatabase = None, readers: int = 4, max_pending: int = 1000,
+                 timeout: float = None, lanes: _Lanes = None, **kwargs):
+        super().__init__(db if db is not None else StockDatabase(**kwargs), readers, max_pending, timeout, lanes)
+
+
+class AsyncServerManager(AsyncFacade):
+    """Asyncio facade for ServerManager; ``db`` is an AsyncStockDatabase on the same threads"""
+
+    def __init__(self, server: ServerManager = None, readers: int = 4, max_pending: int = 1000,
+                 timeout: float = None, **kwargs):
+        super().__init__(server if server is not None else ServerManager(**kwargs), readers, max_pending, timeout)
+        self.db = AsyncStockDatabase(self._target.db, timeout=timeout, lanes=self._lanes)
+
+    async def close(self):
+        """Flush the manager's background writers, close the pool and stop both lanes"""
+        if self._lanes.closed:
+            return
+        await self._lanes.writer.run(self._target.close, None)
+        await self._lanes.writer.run(self._target.db.close, None)
+        await asyncio.get_running_loop().run_in_executor(None, self._lanes.shutdown)
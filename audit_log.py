@@ -0,0 +1,88 @@
+import logging
+import sqlite3
+from typing import Dict, List, Tuple
+
+from batch_writer import BatchWriter
+from Database_for_user import utc_timestamp
+
+logger = logging.getLogger(__name__)
+
+# Columns written by ServerManager's log_* methods; the event time is always last
+AUDIT_COLUMNS = {
+    'server_access_logs': ('user_id', 'session_token', 'ip_address', 'user_agent', 'request_method',
+                           'request_url', 'request_params', 'response_status', 'response_time_ms',
+                           'timestamp'),
+    'server_error_logs': ('user_id', 'session_token', 'ip_address', 'error_type', 'error_message',
+                          'stack_trace', 'request_data', 'timestamp'),
+    'user_activity_logs': ('user_id', 'activity_type', 'activity_description', 'ip_address',
+                           'user_agent', 'metadata', 'timestamp'),
+    'user_security_events': ('user_id', 'event_type', 'event_description', 'ip_address', 'severity',
+                             'timestamp')
+}
+
+_INSERT_SQL = {
+    table: f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    for table, columns in AUDIT_COLUMNS.items()
+}
+
+
+def write_audit_records(conn, records: List[Tuple[str, Tuple]]):
+    """Insert (table, values) records, one executemany per table, in the caller's transaction"""
+    grouped: Dict[str, List[Tuple]] = {}
+    for table, values in records:
+        grouped.setdefault(table, []).append(values)
+
+    for table, rows in grouped.items():
+        conn.executemany(_INSERT_SQL[table], rows)
+
+
+class AuditLogSink(BatchWriter):
+    """Background writer for audit log rows
+
+    Records are stamped when they are queued and written in one
+    transaction per batch, however many tables the batch touches. If a
+    row violates a constraint the batch is retried row by row and only
+    the bad rows are rejected (counted in ``stats()['rejected']``).
+    """
+
+    def __init__(self, pool, max_batch_size: int = 500, flush_interval: float = 0.5,
+                 max_queue_size: int = 10000, overflow: str = 'block', put_timeout: float = None):
+        self.pool = pool
+        self._rejected = 0
+        super().__init__(self._save, max_batch_size=max_batch_size,
+                         flush_interval=flush_interval, max_queue_size=max_queue_size,
+                         overflow=overflow, put_timeout=put_timeout, name='audit-log-writer')
+
+    def log(self, table: str, values: Tuple) -> bool:
+        """Queue one row for ``table`` (values without the timestamp)"""
+        if table not in AUDIT_COLUMNS:
+            raise ValueError(f"Unknown audit table '{table}'")
+        return self.put((table, tuple(values) + (utc_timestamp(),)))
+
+    def _save(self, batch: List[Tuple[str, Tuple]]):
+        with self.pool.connection() as conn:
+            try:
+                write_audit_records(conn, batch)
+            except sqlite3.IntegrityError:
+                # One bad row must not cost the rest of the batch
+                conn.rollback()
+                self._save_rows(conn, batch)
+            conn.commit()
+
+    def _save_rows(self, conn, batch: List[Tuple[str, Tuple]]):
+        rejected = 0
+        for record in batch:
+            try:
+                write_audit_records(conn, [record])
+            except sqlite3.IntegrityError as e:
+                rejected += 1
+                logger.error(f"Rejected {record[0]} row: {str(e)}")
+
+        with self._lock:
+            self._rejected += rejected
+
+    def stats(self) -> Dict:
+        stats = super().stats()
+        with self._lock:
+            stats['rejected'] = self._rejected
+        return stats
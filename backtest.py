@@ -0,0 +1,343 @@
+import argparse
+import itertools
+import json
+import math
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Union
+
+import numpy as np
+
+from indicators import sma
+
+# Same per-trade fee as trading_history.commission's default
+COMMISSION = 9.99
+# Same starting cash as user_balances.cash_balance's default
+INITIAL_CASH = 100000.0
+
+
+class BarSource(NamedTuple):
+    """Where workers read bars from: a SQLite file (read-only) or a columnar store directory"""
+    db_path: Optional[str] = None
+    store_dir: Optional[str] = None
+
+    @classmethod
+    def from_database(cls, db) -> 'BarSource':
+        store_dir = getattr(db.history_backend, 'root_dir', None)
+        return cls(None if store_dir else db.db_path, store_dir)
+
+
+def load_bars(source: BarSource, symbol: str, start=None, end=None) -> Dict[str, np.ndarray]:
+    """OHLCV arrays for ``symbol`` (oldest first) with start <= timestamp < end"""
+    if source.store_dir:
+        from columnar_store import ColumnarPriceStore, from_epoch
+
+        columns = ColumnarPriceStore(source.store_dir).read_range(symbol, start, end)
+        bars = {column: np.array(values, dtype=float) for column, values in columns.items() if column != 'timestamp'}
+        bars['timestamp'] = np.array([from_epoch(value) for value in columns['timestamp']], dtype=object)
+        return bars
+
+    from Database_for_user import format_timestamp
+
+    condition, params = '', [symbol]
+    if start is not None:
+        condition += ' AND timestamp >= ?'
+        params.append(format_timestamp(start))
+    if end is not None:
+        condition += ' AND timestamp < ?'
+        params.append(format_timestamp(end))
+
+    # Read-only connection: a backtest can never write to the live tables
+    conn = sqlite3.connect(Path(source.db_path).resolve().as_uri() + '?mode=ro', uri=True)
+    try:
+        rows = conn.execute(f'''
+            SELECT timestamp, open_price, high_price, low_price, close_price, volume
+            FROM stock_price_history
+            WHERE symbol = ?{condition}
+            ORDER BY timestamp, id
+        ''', params).fetchall()
+    finally:
+        conn.close()
+
+    columns = list(zip(*rows)) if rows else [()] * 6
+    bars = {
+        column: np.array(values, dtype=float)
+        for column, values in zip(('open', 'high', 'low', 'close', 'volume'), columns[1:])
+    }
+    bars['timestamp'] = np.array(columns[0], dtype=object)
+    return bars
+
+
+class _Account:
+    __slots__ = ('cash', 'shares', 'commission', 'fills')
+
+    def __init__(self, cash: float, commission: float):
+        self.cash = cash
+        self.shares = 0
+        self.commission = commission
+        self.fills: List[Dict] = []
+
+    def target_shares(self, weight: float, price: float) -> int:
+        equity = self.cash + self.shares * price
+        return max(int(math.floor(weight * (equity - self.commission) / price)), 0)
+
+    def fill(self, timestamp, shares: int, price: float) -> bool:
+        """Trade ``shares`` (negative to sell) at ``price``; buys are capped by cash, sells by the position"""
+        if shares > 0:
+            shares = min(shares, int(math.floor((self.cash - self.commission) / price)))
+        else:
+            shares = max(shares, -self.shares)
+        if shares == 0:
+            return False
+
+        price = float(price)
+        self.cash -= shares * price + self.commission
+        self.shares += shares
+        self.fills.append({
+            'timestamp': timestamp,
+            'trade_type': 'buy' if shares > 0 else 'sell',
+            'shares': abs(shares),
+            'price': price,
+            'total_amount': abs(shares) * price,
+            'commission': self.commission,
+            'cash_after': self.cash,
+            'position_after': self.shares
+        })
+        return True
+
+
+class Strategy:
+    """Base class for bar-by-bar strategies
+
+    ``on_bar(ctx)`` runs after each bar closes (``ctx.i`` is its index in
+    ``ctx.bars``) and may call ``ctx.order(shares)`` or
+    ``ctx.order_target_weight(weight)``. Orders fill at the next bar's open,
+    like the signals of a vectorized strategy. Subclasses must be defined
+    at module level so worker processes can import them.
+    """
+
+    def __init__(self, **params):
+        self.params = params
+
+    def initialize(self, ctx: 'StrategyContext'):
+        pass
+
+    def on_bar(self, ctx: 'StrategyContext'):
+        raise NotImplementedError
+
+
+class StrategyContext:
+    def __init__(self, bars: Dict[str, np.ndarray], account: _Account):
+        self.bars = bars
+        self.i = -1
+        self._account = account
+        self._pending: Optional[tuple] = None
+
+    @property
+    def cash(self) -> float:
+        return self._account.cash
+
+    @property
+    def position(self) -> int:
+        return self._account.shares
+
+    def order(self, shares: int):
+        self._pending = ('shares', int(shares))
+
+    def order_target_weight(self, weight: float):
+        self._pending = ('weight', min(max(float(weight), 0.0), 1.0))
+
+
+def _metrics(equity: np.ndarray, initial_cash: float, periods_per_year: Optional[float]):
+    if not len(equity):
+        return {'final_equity': initial_cash, 'total_return': 0.0, 'max_drawdown': 0.0, 'sharpe': None}, equity
+
+    drawdown = equity / np.maximum.accumulate(equity) - 1.0
+    returns = np.diff(equity) / equity[:-1]
+    sharpe = None
+    if len(returns) > 1 and returns.std() > 0:
+        sharpe = float(returns.mean() / returns.std() * math.sqrt(periods_per_year or 1))
+    return {
+        'final_equity': float(equity[-1]),
+        'total_return': float(equity[-1] / initial_cash - 1.0),
+        'max_drawdown': float(drawdown.min()),
+        'sharpe': sharpe
+    }, drawdown
+
+
+def _run_signals(bars: Dict[str, np.ndarray], signal: np.ndarray, account: _Account):
+    # Weights are decided at a bar's close and traded at the next bar's open, only when they change
+    n = len(bars['close'])
+    initial_cash = account.cash
+    weights = np.clip(np.nan_to_num(np.asarray(signal, dtype=float)[:n]), 0.0, 1.0)
+    previous = np.concatenate(([0.0], weights[:-1]))
+    changes = np.flatnonzero(weights[:-1] != previous[:-1])
+
+    fill_bars, cash, shares = [], [], []
+    opens, timestamps = bars['open'], bars['timestamp']
+    for i in changes.tolist():
+        price = opens[i + 1]
+        delta = account.target_shares(weights[i], price) - account.shares
+        if account.fill(timestamps[i + 1], delta, price):
+            fill_bars.append(i + 1)
+            cash.append(account.cash)
+            shares.append(account.shares)
+
+    # Cash and position are constant between fills
+    last_fill = np.searchsorted(np.array(fill_bars, dtype=np.int64), np.arange(n), side='right') - 1
+    cash = np.append(np.array(cash), 0.0)
+    shares = np.append(np.array(shares, dtype=float), 0.0)
+    held = last_fill >= 0
+    cash_curve = np.where(held, cash[last_fill], initial_cash)
+    shares_curve = np.where(held, shares[last_fill], 0.0)
+    return cash_curve, shares_curve
+
+
+def _run_callbacks(bars: Dict[str, np.ndarray], strategy: Strategy, account: _Account):
+    n = len(bars['close'])
+    cash_curve = np.empty(n)
+    shares_curve = np.empty(n)
+    ctx = StrategyContext(bars, account)
+    strategy.initialize(ctx)
+    opens, timestamps = bars['open'], bars['timestamp']
+
+    for i in range(n):
+        if ctx._pending is not None:
+            kind, amount = ctx._pending
+            ctx._pending = None
+            price = opens[i]
+            delta = amount if kind == 'shares' else account.target_shares(amount, price) - account.shares
+            account.fill(timestamps[i], delta, price)
+        ctx.i = i
+        cash_curve[i] = account.cash
+        shares_curve[i] = account.shares
+        strategy.on_bar(ctx)
+    return cash_curve, shares_curve
+
+
+def run_backtest(bars: Dict[str, np.ndarray], strategy: Union[Callable, type], params: Dict = None,
+                 initial_cash: float = INITIAL_CASH, commission: float = COMMISSION,
+                 periods_per_year: float = None, keep_curves: bool = True) -> Dict:
+    """Backtest one strategy/parameter set over in-memory bars
+
+    ``strategy`` is either a vectorized signal function
+    ``f(bars, **params) -> target weights`` (0 = flat, 1 = all equity long,
+    one per bar) or a ``Strategy`` subclass. Fills happen at the next bar's
+    open with ``commission`` per fill; the position is long-only and never
+    borrows cash, like accounts in ``user_balances``.
+    """
+    params = params or {}
+    account = _Account(initial_cash, commission)
+
+    if isinstance(strategy, type) and issubclass(strategy, Strategy):
+        cash_curve, shares_curve = _run_callbacks(bars, strategy(**params), account)
+    else:
+        cash_curve, shares_curve = _run_signals(bars, strategy(bars, **params), account)
+
+    equity = cash_curve + shares_curve * bars['close']
+    metrics, drawdown = _metrics(equity, initial_cash, periods_per_year)
+
+    result = {
+        'params': params,
+        'bars': len(equity),
+        'trades': len(account.fills),
+        'commission_paid': len(account.fills) * commission,
+        **metrics
+    }
+    if keep_curves:
+        result.update({
+            'timestamps': bars['timestamp'].tolist(),
+            'equity': equity.tolist(),
+            'drawdown': drawdown.tolist(),
+            'fills': account.fills
+        })
+    return result
+
+
+def _run_task(source: BarSource, symbol: str, start, end, strategy, param_sets: List[Dict], options: Dict):
+    bars = load_bars(source, symbol, start, end)
+    results = []
+    for params in param_sets:
+        try:
+            result = run_backtest(bars, strategy, params, **options)
+        except Exception as e:
+            result = {'params': params, 'error': f"{type(e).__name__}: {str(e)}"}
+        result['symbol'] = symbol
+        results.append(result)
+    return results
+
+
+def expand_grid(param_grid: Union[Dict[str, Iterable], List[Dict], None]) -> List[Dict]:
+    """{'fast': [5, 10], 'slow': [20]} -> [{'fast': 5, 'slow': 20}, {'fast': 10, 'slow': 20}]"""
+    if param_grid is None:
+        return [{}]
+    if isinstance(param_grid, dict):
+        keys = list(param_grid)
+        return [dict(zip(keys, values)) for values in itertools.product(*(param_grid[key] for key in keys))]
+    return list(param_grid)
+
+
+def run_sweep(source: BarSource, symbols: List[str], strategy, param_grid=None, start=None, end=None,
+              workers: int = None, chunk_size: int = None, initial_cash: float = INITIAL_CASH,
+              commission: float = COMMISSION, periods_per_year: float = None,
+              keep_curves: bool = False) -> List[Dict]:
+    """Backtest every symbol x parameter set, fanned out over a process pool
+
+    Each task loads one symbol's bars once and runs ``chunk_size``
+    parameter sets over them. ``strategy`` must be importable from a
+    module (not a lambda) when ``workers`` > 1; ``workers=1`` runs inline.
+    Results come back in symbol, then parameter order; a failing run
+    reports ``error`` instead of metrics.
+    """
+    param_sets = expand_grid(param_grid)
+    workers = workers or os.cpu_count() or 1
+    if chunk_size is None:
+        # About four tasks per worker, each loading one symbol's bars once
+        chunk_size = max(1, math.ceil(len(param_sets) * len(symbols) / (workers * 4)))
+    options = {'initial_cash': initial_cash, 'commission': commission,
+               'periods_per_year': periods_per_year, 'keep_curves': keep_curves}
+
+    tasks = [
+        (source, symbol, start, end, strategy, param_sets[i:i + chunk_size], options)
+        for symbol in symbols
+        for i in range(0, len(param_sets), chunk_size)
+    ]
+
+    if workers == 1 or len(tasks) == 1:
+        chunks = [_run_task(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+            chunks = list(pool.map(_run_task, *zip(*tasks)))
+
+    return [result for chunk in chunks for result in chunk]
+
+
+def sma_crossover(bars: Dict[str, np.ndarray], fast: int = 10, slow: int = 30) -> np.ndarray:
+    """Long while the fast SMA of closes is above the slow SMA"""
+    fast_line, slow_line = sma(bars['close'], fast), sma(bars['close'], slow)
+    with np.errstate(invalid='ignore'):
+        return (fast_line > slow_line).astype(float)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SMA crossover parameter sweep over stored price history")
+    parser.add_argument("db_path", help="SQLite database with stock_price_history")
+    parser.add_argument("--symbol", action="append", dest="symbols", required=True)
+    parser.add_argument("--fast", default="5,10,20", help="comma-separated fast periods")
+    parser.add_argument("--slow", default="30,50,100", help="comma-separated slow periods")
+    parser.add_argument("--store-dir", help="read bars from this columnar store instead")
+    parser.add_argument("--workers", type=int)
+    args = parser.parse_args()
+
+    grid = [
+        {'fast': fast, 'slow': slow}
+        for fast in map(int, args.fast.split(','))
+        for slow in map(int, args.slow.split(','))
+        if fast < slow
+    ]
+    results = run_sweep(BarSource(args.db_path, args.store_dir), args.symbols, sma_crossover, grid,
+                        workers=args.workers)
+    results.sort(key=lambda result: result.get('total_return', -math.inf), reverse=True)
+    print(json.dumps(results, indent=2))
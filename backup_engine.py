@@ -0,0 +1,359 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from Database_for_user import TIMESTAMP_FORMAT
+
+BACKUP_FORMATS = {
+    'full': 'gzip',
+    'incremental': 'chunks'
+}
+
+_COPY_BUFFER = 1024 * 1024
+
+
+class _BackupRestarted(Exception):
+    """Raised from the progress callback to abandon a stepped copy"""
+
+
+def _sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(_COPY_BUFFER), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_atomic(path: str, data: bytes):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class BackupEngine:
+    """Online SQLite backups built on ``sqlite3.Connection.backup``
+
+    The live database is first copied into a private snapshot
+    ``pages_per_step`` pages at a time, sleeping ``step_sleep`` seconds
+    between steps so writers are never locked out for long. The snapshot is
+    then stored as either
+
+    * ``full``: one gzip-compressed copy of the database, or
+    * ``incremental``: the database split into ``chunk_pages``-page chunks,
+      each stored once under its SHA-256 in ``objects/``, so a snapshot
+      only writes the chunks that changed since any earlier one.
+
+    Every backup has a JSON manifest (``backup_*.json``) recording its
+    format, size, page size and whole-file SHA-256, which restores are
+    checked against.
+    """
+
+    def __init__(self, pool, backup_dir: str = 'backups', pages_per_step: int = 1024,
+                 step_sleep: float = 0.005, chunk_pages: int = 16, compress_level: int = 6,
+                 max_restarts: int = 3):
+        self.pool = pool
+        self.backup_dir = backup_dir
+        self.pages_per_step = pages_per_step
+        self.step_sleep = step_sleep
+        self.chunk_pages = chunk_pages
+        self.compress_level = compress_level
+        self.max_restarts = max_restarts
+        self.objects_dir = os.path.join(backup_dir, 'objects')
+        # Retention must not sweep chunks of a backup still being written
+        self._lock = threading.Lock()
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def snapshot(self, target_path: str) -> Dict:
+        """Copy the live database into ``target_path`` in small steps
+
+        A write through another connection restarts a stepped copy. After
+        ``max_restarts`` restarts the copy is finished in a single step; in
+        WAL mode that only holds a read snapshot, so writers still proceed.
+        """
+        progress_state = {'steps': 0, 'restarts': 0, 'remaining': None}
+
+        def progress(status, remaining, total):
+            previous = progress_state['remaining']
+            if previous is not None and remaining > previous:
+                progress_state['restarts'] += 1
+                if progress_state['restarts'] > self.max_restarts:
+                    raise _BackupRestarted()
+            progress_state['remaining'] = remaining
+            progress_state['steps'] += 1
+
+        target = sqlite3.connect(target_path)
+        try:
+            with self.pool.connection() as source:
+                single_step = False
+                try:
+                    source.backup(target, pages=self.pages_per_step, progress=progress, sleep=self.step_sleep)
+                except _BackupRestarted:
+                    single_step = True
+                    source.backup(target, pages=-1)
+            page_size = target.execute('PRAGMA page_size').fetchone()[0]
+            page_count = target.execute('PRAGMA page_count').fetchone()[0]
+        finally:
+            target.close()
+
+        return {
+            'page_size': page_size,
+            'page_count': page_count,
+            'steps': progress_state['steps'],
+            'restarts': progress_state['restarts'],
+            'single_step': single_step
+        }
+
+    def create_backup(self, backup_type: str = 'full') -> Dict:
+        """Snapshot the database and store it; returns the manifest plus timings"""
+        if backup_type not in BACKUP_FORMATS:
+            raise ValueError(f"backup_type must be one of {sorted(BACKUP_FORMATS)}")
+
+        with self._lock:
+            return self._create_backup(backup_type)
+
+    def _create_backup(self, backup_type: str) -> Dict:
+        os.makedirs(self.backup_dir, exist_ok=True)
+        started = time.perf_counter()
+        now = datetime.now(timezone.utc)
+        name = f"backup_{backup_type}_{now.strftime('%Y%m%d_%H%M%S_%f')}"
+
+        fd, snapshot_path = tempfile.mkstemp(suffix='.db', dir=self.backup_dir)
+        os.close(fd)
+        try:
+            snapshot = self.snapshot(snapshot_path)
+            copied = time.perf_counter()
+
+            manifest = {
+                'name': name,
+                'backup_type': backup_type,
+                'format': BACKUP_FORMATS[backup_type],
+                'created_at': now.strftime(TIMESTAMP_FORMAT),
+                'created_epoch': now.timestamp(),
+                'database_size_bytes': os.path.getsize(snapshot_path),
+                'page_size': snapshot['page_size'],
+                'page_count': snapshot['page_count'],
+                'sha256': _sha256_file(snapshot_path)
+            }
+
+            if backup_type == 'full':
+                stored = self._store_gzip(snapshot_path, name, manifest)
+            else:
+                stored = self._store_chunks(snapshot_path, manifest)
+        finally:
+            os.remove(snapshot_path)
+
+        manifest_path = os.path.join(self.backup_dir, f"{name}.json")
+        _write_atomic(manifest_path, json.dumps(manifest, indent=2).encode())
+
+        duration = time.perf_counter() - started
+        return {
+            'manifest_path': manifest_path,
+            'manifest': manifest,
+            'bytes_written': stored,
+            'snapshot_steps': snapshot['steps'],
+            'snapshot_restarts': snapshot['restarts'],
+            'snapshot_seconds': round(copied - started, 6),
+            'duration_seconds': round(duration, 6),
+            'throughput_bytes_per_second': manifest['database_size_bytes'] / duration if duration else None
+        }
+
+    def _store_gzip(self, snapshot_path: str, name: str, manifest: Dict) -> int:
+        data_path = os.path.join(self.backup_dir, f"{name}.db.gz")
+        tmp_path = f"{data_path}.tmp"
+        with open(snapshot_path, 'rb') as source, \
+                gzip.open(tmp_path, 'wb', compresslevel=self.compress_level) as target:
+            shutil.copyfileobj(source, target, _COPY_BUFFER)
+        os.replace(tmp_path, data_path)
+
+        manifest['file'] = os.path.basename(data_path)
+        return os.path.getsize(data_path)
+
+    def _store_chunks(self, snapshot_path: str, manifest: Dict) -> int:
+        chunk_size = manifest['page_size'] * self.chunk_pages
+        chunks = []
+        written = 0
+        new_chunks = 0
+
+        with open(snapshot_path, 'rb') as source:
+            for chunk in iter(lambda: source.read(chunk_size), b''):
+                digest = hashlib.sha256(chunk).hexdigest()
+                chunks.append(digest)
+
+                path = self._object_path(digest)
+                if not os.path.exists(path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    data = zlib.compress(chunk, self.compress_level)
+                    _write_atomic(path, data)
+                    written += len(data)
+                    new_chunks += 1
+
+        manifest['chunk_size'] = chunk_size
+        manifest['chunks'] = chunks
+        manifest['new_chunks'] = new_chunks
+        return written
+
+    def list_backups(self) -> List[Dict]:
+        """Manifests of every backup, oldest first"""
+        if not os.path.isdir(self.backup_dir):
+            return []
+
+        manifests = []
+        for entry in os.listdir(self.backup_dir):
+            if entry.startswith('backup_') and entry.endswith('.json'):
+                with open(os.path.join(self.backup_dir, entry)) as f:
+                    manifest = json.load(f)
+                manifest['manifest_path'] = os.path.join(self.backup_dir, entry)
+                manifests.append(manifest)
+
+        return sorted(manifests, key=lambda manifest: manifest['created_epoch'])
+
+    def _load_manifest(self, manifest_path: str) -> Dict:
+        with open(manifest_path) as f:
+            return json.load(f)
+
+    def _materialize(self, manifest: Dict, target_path: str):
+        """Rebuild the database file described by ``manifest``, checking every hash"""
+        digest = hashlib.sha256()
+
+        with open(target_path, 'wb') as target:
+            if manifest['format'] == 'gzip':
+                with gzip.open(os.path.join(self.backup_dir, manifest['file']), 'rb') as source:
+                    for block in iter(lambda: source.read(_COPY_BUFFER), b''):
+                        digest.update(block)
+                        target.write(block)
+            else:
+                for chunk_digest in manifest['chunks']:
+                    with open(self._object_path(chunk_digest), 'rb') as f:
+                        chunk = zlib.decompress(f.read())
+                    if hashlib.sha256(chunk).hexdigest() != chunk_digest:
+                        raise ValueError(f"Chunk {chunk_digest} is corrupt")
+                    digest.update(chunk)
+                    target.write(chunk)
+
+        if digest.hexdigest() != manifest['sha256']:
+            raise ValueError(f"Restored database does not match the checksum of {manifest['name']}")
+
+    @staticmethod
+    def _integrity_check(path: str) -> str:
+        conn = sqlite3.connect(path)
+        try:
+            return conn.execute('PRAGMA integrity_check').fetchone()[0]
+        finally:
+            conn.close()
+
+    def verify(self, manifest_path: str) -> Dict:
+        """Restore into a scratch file and run the checksum and integrity checks"""
+        manifest = self._load_manifest(manifest_path)
+        fd, scratch_path = tempfile.mkstemp(suffix='.db', dir=self.backup_dir)
+        os.close(fd)
+        try:
+            self._materialize(manifest, scratch_path)
+            integrity = self._integrity_check(scratch_path)
+        finally:
+            os.remove(scratch_path)
+
+        return {'name': manifest['name'], 'checksum_ok': True, 'integrity': integrity, 'ok': integrity == 'ok'}
+
+    def restore(self, manifest_path: str, target_path: str) -> Dict:
+        """Rebuild a backup into ``target_path`` after verifying it
+
+        The target is only replaced once the restored copy passed the
+        checksum and integrity checks. It must not be open elsewhere.
+        """
+        manifest = self._load_manifest(manifest_path)
+        restoring_path = f"{target_path}.restoring"
+        try:
+            self._materialize(manifest, restoring_path)
+            integrity = self._integrity_check(restoring_path)
+            if integrity != 'ok':
+                raise ValueError(f"Integrity check failed: {integrity}")
+
+            for suffix in ('-wal', '-shm', '-journal'):
+                if os.path.exists(target_path + suffix):
+                    os.remove(target_path + suffix)
+            os.replace(restoring_path, target_path)
+        finally:
+            if os.path.exists(restoring_path):
+                os.remove(restoring_path)
+
+        return {'name': manifest['name'], 'target_path': target_path, 'size_bytes': os.path.getsize(target_path)}
+
+    def apply_retention(self, keep_last: int = 7, max_age_days: Optional[float] = None) -> Dict:
+        """Delete old backups and any chunk no remaining backup refers to
+
+        The newest ``keep_last`` backups are kept unless older than
+        ``max_age_days``; the newest backup is always kept.
+        """
+        with self._lock:
+            return self._apply_retention(keep_last, max_age_days)
+
+    def _apply_retention(self, keep_last: int, max_age_days: Optional[float]) -> Dict:
+        backups = self.list_backups()
+        cutoff = None
+        if max_age_days is not None:
+            cutoff = (datetime.now(timezone.utc) - timedelta(days=max_age_days)).strftime(TIMESTAMP_FORMAT)
+
+        kept, removed = [], []
+        for position, manifest in enumerate(reversed(backups)):
+            expired = cutoff is not None and manifest['created_at'] < cutoff
+            if position == 0 or (position < keep_last and not expired):
+                kept.append(manifest)
+            else:
+                removed.append(manifest)
+
+        for manifest in removed:
+            if manifest['format'] == 'gzip':
+                data_path = os.path.join(self.backup_dir, manifest['file'])
+                if os.path.exists(data_path):
+                    os.remove(data_path)
+            os.remove(manifest['manifest_path'])
+
+        removed_chunks = self._collect_garbage(kept)
+        return {
+            'kept': [manifest['name'] for manifest in reversed(kept)],
+            'removed': [manifest['name'] for manifest in removed],
+            'removed_chunks': removed_chunks
+        }
+
+    def _collect_garbage(self, manifests: List[Dict]) -> int:
+        if not os.path.isdir(self.objects_dir):
+            return 0
+
+        referenced = {digest for manifest in manifests for digest in manifest.get('chunks', ())}
+        removed = 0
+        for prefix in os.listdir(self.objects_dir):
+            prefix_dir = os.path.join(self.objects_dir, prefix)
+            for digest in os.listdir(prefix_dir):
+                if digest not in referenced:
+                    os.remove(os.path.join(prefix_dir, digest))
+                    removed += 1
+        return removed
+
+
+# Columns added to backup_logs by ensure_backup_schema
+_BACKUP_LOG_COLUMNS = (
+    ('database_size_bytes', 'INTEGER'),
+    ('throughput_bytes_per_second', 'REAL'),
+    ('verified', 'INTEGER')
+)
+
+
+def ensure_backup_schema(conn):
+    """Add the size/throughput/verification columns to backup_logs"""
+    existing = {row[1] for row in conn.execute('PRAGMA table_info(backup_logs)')}
+    for column, column_type in _BACKUP_LOG_COLUMNS:
+        if column not in existing:
+            conn.execute(f'ALTER TABLE backup_logs ADD COLUMN {column} {column_type}')
+    conn.commit()
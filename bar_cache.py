@@ -0,0 +1,143 @@
+import threading
+from collections import deque
+from typing import Dict, List, Optional
+
+
+class _SymbolBuffer:
+    """Fixed-capacity ring of the newest bars for one symbol, oldest first"""
+
+    __slots__ = ('bars', 'warm', 'generation')
+
+    def __init__(self, capacity: int):
+        self.bars = deque(maxlen=capacity)
+        self.warm = False
+        self.generation = 0
+
+
+class RecentBarCache:
+    """Per-symbol ring buffers holding the most recent price bars
+
+    A symbol is *warm* once its buffer is known to hold the newest
+    ``min(total rows, capacity)`` bars. Reads of up to ``capacity`` bars
+    for a warm symbol are served from memory; anything else is a miss and
+    the caller falls back to storage. Writes append to warm buffers; an
+    out-of-order write drops the symbol back to cold so the next read
+    reloads it. Cached bar dicts are shared between callers and must be
+    treated as read-only.
+
+    Only writes made through this process are seen, so use one cache per
+    writer process.
+    """
+
+    def __init__(self, capacity: int = 100):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+
+        self.capacity = capacity
+        self._buffers: Dict[str, _SymbolBuffer] = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+        self._appends = 0
+
+    def _buffer(self, symbol: str) -> _SymbolBuffer:
+        buffer = self._buffers.get(symbol)
+        if buffer is None:
+            buffer = self._buffers[symbol] = _SymbolBuffer(self.capacity)
+        return buffer
+
+    def get(self, symbol: str, limit: int) -> Optional[List[Dict]]:
+        """Newest-first bars, or None on a miss"""
+        with self._lock:
+            buffer = self._buffers.get(symbol)
+            if buffer is None or not buffer.warm or limit > self.capacity:
+                self._misses += 1
+                return None
+
+            self._hits += 1
+            bars = buffer.bars
+            count = min(limit, len(bars))
+            return [bars[-1 - i] for i in range(count)]
+
+    def generation(self, symbol: str) -> int:
+        """Token to pass to ``load`` so a concurrent write invalidates the load"""
+        with self._lock:
+            return self._buffer(symbol).generation
+
+    def load(self, symbol: str, history: List[Dict], requested: int, generation: int) -> bool:
+        """Install newest-first ``history`` read from storage
+
+        ``requested`` is the limit the storage read used; the buffer is only
+        warm if the read returned everything (fewer rows than requested) or
+        at least ``capacity`` rows.
+        """
+        if len(history) >= requested and len(history) < self.capacity:
+            return False
+
+        with self._lock:
+            buffer = self._buffer(symbol)
+            if buffer.generation != generation:
+                return False
+
+            buffer.bars.clear()
+            buffer.bars.extend(reversed(history[:self.capacity]))
+            buffer.warm = True
+            return True
+
+    def append(self, symbol: str, bar: Dict):
+        """Record a newly written bar"""
+        with self._lock:
+            self._append(symbol, bar)
+
+    def extend(self, bars_by_symbol: Dict[str, List[Dict]]):
+        """Record many newly written bars, oldest first per symbol"""
+        with self._lock:
+            for symbol, bars in bars_by_symbol.items():
+                for bar in bars:
+                    self._append(symbol, bar)
+
+    def _append(self, symbol: str, bar: Dict):
+        buffer = self._buffer(symbol)
+        buffer.generation += 1
+        if not buffer.warm:
+            return
+
+        bars = buffer.bars
+        if bars and bar["timestamp"] < bars[-1]["timestamp"]:
+            buffer.warm = False
+            bars.clear()
+            self._invalidations += 1
+            return
+
+        bars.append(bar)
+        self._appends += 1
+
+    def invalidate(self, symbol: str = None):
+        """Drop one symbol, or everything"""
+        with self._lock:
+            symbols = [symbol] if symbol is not None else list(self._buffers)
+            for name in symbols:
+                buffer = self._buffers.get(name)
+                if buffer is not None:
+                    buffer.generation += 1
+                    buffer.warm = False
+                    buffer.bars.clear()
+                    self._invalidations += 1
+
+    def stats(self) -> Dict:
+        """Hit/miss counters and buffer occupancy"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            warm = [buffer for buffer in self._buffers.values() if buffer.warm]
+            return {
+                "capacity": self.capacity,
+                "symbols": len(self._buffers),
+                "warm_symbols": len(warm),
+                "cached_bars": sum(len(buffer.bars) for buffer in warm),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else None,
+                "appends": self._appends,
+                "invalidations": self._invalidations
+            }
@@ -0,0 +1,358 @@
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from Database_for_user import TIMESTAMP_FORMAT, format_timestamp
+
+# Materialized resolutions, finest first: name -> bucket width in seconds
+ROLLUP_RESOLUTIONS = {
+    '1m': 60,
+    '5m': 300,
+    '1h': 3600,
+    '1d': 86400
+}
+
+# UI timeframe -> (range covered, bar resolution)
+TIMEFRAMES = {
+    '1D': (timedelta(days=1), '5m'),
+    '1W': (timedelta(weeks=1), '1h'),
+    '1M': (timedelta(days=30), '4h'),
+    '3M': (timedelta(days=90), '1d')
+}
+
+_UNIT_SECONDS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+# Bar fields while aggregating:
+# [open, high, low, close, volume, tick_count, first_key, last_key]
+# where first_key/last_key are (epoch, tick_id) and decide open/close.
+_OPEN, _HIGH, _LOW, _CLOSE, _VOLUME, _COUNT, _FIRST, _LAST = range(8)
+
+
+def resolution_seconds(resolution) -> int:
+    """Parse '1m', '15m', '4h', '1d', '1w' (or a number of seconds)"""
+    if isinstance(resolution, (int, float)):
+        return int(resolution)
+
+    match = re.fullmatch(r'(\d+)([smhdw])', resolution.strip())
+    if not match:
+        raise ValueError(f"Invalid resolution '{resolution}'")
+    return int(match.group(1)) * _UNIT_SECONDS[match.group(2)]
+
+
+def _bucket_timestamp(epoch: int) -> str:
+    return datetime.fromtimestamp(epoch, tz=timezone.utc).strftime(TIMESTAMP_FORMAT)
+
+
+def _merge(bars: Dict, key, bar: List):
+    """Fold one partial bar into ``bars[key]``"""
+    existing = bars.get(key)
+    if existing is None:
+        bars[key] = list(bar)
+        return
+
+    if bar[_HIGH] > existing[_HIGH]:
+        existing[_HIGH] = bar[_HIGH]
+    if bar[_LOW] < existing[_LOW]:
+        existing[_LOW] = bar[_LOW]
+    existing[_VOLUME] += bar[_VOLUME]
+    existing[_COUNT] += bar[_COUNT]
+    if bar[_FIRST] < existing[_FIRST]:
+        existing[_OPEN] = bar[_OPEN]
+        existing[_FIRST] = bar[_FIRST]
+    if bar[_LAST] > existing[_LAST]:
+        existing[_CLOSE] = bar[_CLOSE]
+        existing[_LAST] = bar[_LAST]
+
+
+class BarRollup:
+    """Incrementally maintained OHLCV bar tables built from stock_price_history
+
+    ``update()`` reads only ticks with an id above the stored watermark,
+    aggregates them into 1m bars, folds those into 5m/1h/1d bars and
+    upserts every touched bucket in one transaction. Buckets are merged,
+    not overwritten, so late ticks for an existing bucket keep
+    open/high/low/close/volume correct. Ticks with a missing or
+    unparsable timestamp or price are skipped, but the watermark still
+    moves past them.
+
+    ``StockDatabase(bar_rollup=True)`` owns one and calls ``update()``
+    after every committed ``save_stock_price(s)``; schedule ``update()``
+    for rows inserted into stock_price_history any other way.
+    """
+
+    def __init__(self, db, batch_size: int = 50000):
+        self.db = db
+        self.pool = db.pool
+        self.batch_size = batch_size
+        self.init_tables()
+
+    @staticmethod
+    def table_name(resolution: str) -> str:
+        return f"stock_bars_{resolution}"
+
+    def init_tables(self):
+        """Create the bar tables and the watermark table"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+
+            for resolution in ROLLUP_RESOLUTIONS:
+                cursor.execute(f'''
+                    CREATE TABLE IF NOT EXISTS {self.table_name(resolution)} (
+                        symbol TEXT NOT NULL,
+                        bucket_start TIMESTAMP NOT NULL,
+                        open_price REAL NOT NULL,
+                        high_price REAL NOT NULL,
+                        low_price REAL NOT NULL,
+                        close_price REAL NOT NULL,
+                        volume INTEGER NOT NULL,
+                        tick_count INTEGER NOT NULL,
+                        first_epoch INTEGER NOT NULL,
+                        first_tick_id INTEGER NOT NULL,
+                        last_epoch INTEGER NOT NULL,
+                        last_tick_id INTEGER NOT NULL,
+                        PRIMARY KEY (symbol, bucket_start)
+                    ) WITHOUT ROWID
+                ''')
+
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS stock_bar_rollup_state (
+                    name TEXT PRIMARY KEY,
+                    last_tick_id INTEGER NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            cursor.execute('''
+                INSERT OR IGNORE INTO stock_bar_rollup_state (name, last_tick_id) VALUES ('bars', 0)
+            ''')
+
+            conn.commit()
+
+    def get_watermark(self) -> int:
+        """Id of the last stock_price_history row folded into the bars"""
+        with self.pool.connection() as conn:
+            row = conn.execute(
+                "SELECT last_tick_id FROM stock_bar_rollup_state WHERE name = 'bars'"
+            ).fetchone()
+            return row[0] if row else 0
+
+    def update(self, max_ticks: Optional[int] = None) -> Dict:
+        """Fold new ticks into the bar tables; safe to call after every flush"""
+        try:
+            ticks_processed = 0
+            ticks_skipped = 0
+            buckets_written = 0
+
+            while max_ticks is None or ticks_processed < max_ticks:
+                limit = self.batch_size
+                if max_ticks is not None:
+                    limit = min(limit, max_ticks - ticks_processed)
+
+                processed, skipped, written = self._update_batch(limit)
+                ticks_processed += processed
+                ticks_skipped += skipped
+                buckets_written += written
+                if processed < limit:
+                    break
+
+            return {
+                "success": True,
+                "ticks_processed": ticks_processed,
+                "ticks_skipped": ticks_skipped,
+                "buckets_written": buckets_written
+            }
+
+        except Exception as e:
+            return {"success": False, "message": f"Error updating bar rollups: {str(e)}"}
+
+    def on_ticks(self, batch=None):
+        """TickWriter on_flush callback"""
+        return self.update()
+
+    def _update_batch(self, limit: int):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+
+            watermark = cursor.execute(
+                "SELECT last_tick_id FROM stock_bar_rollup_state WHERE name = 'bars'"
+            ).fetchone()[0]
+
+            cursor.execute('''
+                SELECT id, symbol, CAST(strftime('%s', timestamp) AS INTEGER),
+                       open_price, high_price, low_price, close_price, volume
+                FROM stock_price_history
+                WHERE id > ?
+                ORDER BY id
+                LIMIT ?
+            ''', (watermark, limit))
+            ticks = cursor.fetchall()
+
+            if not ticks:
+                conn.rollback()
+                return 0, 0, 0
+
+            minute_bars = {}
+            skipped = 0
+            for tick_id, symbol, epoch, open_price, high_price, low_price, close_price, volume in ticks:
+                if None in (epoch, open_price, high_price, low_price, close_price, volume):
+                    # Cannot be bucketed; skip it so the watermark does not stall here
+                    skipped += 1
+                    continue
+                key = (symbol, epoch - epoch % 60)
+                order = (epoch, tick_id)
+                _merge(minute_bars, key, [open_price, high_price, low_price, close_price,
+                                          volume, 1, order, order])
+
+            written = 0
+            for resolution, width in ROLLUP_RESOLUTIONS.items():
+                if width == 60:
+                    bars = minute_bars
+                else:
+                    bars = {}
+                    for (symbol, start), bar in minute_bars.items():
+                        _merge(bars, (symbol, start - start % width), bar)
+
+                cursor.executemany(f'''
+                    INSERT INTO {self.table_name(resolution)}
+                    (symbol, bucket_start, open_price, high_price, low_price, close_price, volume,
+                     tick_count, first_epoch, first_tick_id, last_epoch, last_tick_id)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (symbol, bucket_start) DO UPDATE SET
+                        open_price = CASE WHEN (excluded.first_epoch, excluded.first_tick_id) < (first_epoch, first_tick_id)
+                                          THEN excluded.open_price ELSE open_price END,
+                        first_tick_id = CASE WHEN (excluded.first_epoch, excluded.first_tick_id) < (first_epoch, first_tick_id)
+                                             THEN excluded.first_tick_id ELSE first_tick_id END,
+                        first_epoch = MIN(first_epoch, excluded.first_epoch),
+                        close_price = CASE WHEN (excluded.last_epoch, excluded.last_tick_id) > (last_epoch, last_tick_id)
+                                           THEN excluded.close_price ELSE close_price END,
+                        last_tick_id = CASE WHEN (excluded.last_epoch, excluded.last_tick_id) > (last_epoch, last_tick_id)
+                                            THEN excluded.last_tick_id ELSE last_tick_id END,
+                        last_epoch = MAX(last_epoch, excluded.last_epoch),
+                        high_price = MAX(high_price, excluded.high_price),
+                        low_price = MIN(low_price, excluded.low_price),
+                        volume = volume + excluded.volume,
+                        tick_count = tick_count + excluded.tick_count
+                ''', [
+                    (symbol, _bucket_timestamp(start), bar[_OPEN], bar[_HIGH], bar[_LOW], bar[_CLOSE],
+                     bar[_VOLUME], bar[_COUNT], bar[_FIRST][0], bar[_FIRST][1], bar[_LAST][0], bar[_LAST][1])
+                    for (symbol, start), bar in bars.items()
+                ])
+                written += len(bars)
+
+            cursor.execute('''
+                UPDATE stock_bar_rollup_state
+                SET last_tick_id = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE name = 'bars'
+            ''', (ticks[-1][0],))
+
+            conn.commit()
+            return len(ticks), skipped, written
+
+    def rebuild(self) -> Dict:
+        """Drop all materialized bars and rebuild them from stock_price_history"""
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                for resolution in ROLLUP_RESOLUTIONS:
+                    cursor.execute(f"DELETE FROM {self.table_name(resolution)}")
+                cursor.execute("UPDATE stock_bar_rollup_state SET last_tick_id = 0 WHERE name = 'bars'")
+                conn.commit()
+
+            return self.update()
+
+        except Exception as e:
+            return {"success": False, "message": f"Error rebuilding bar rollups: {str(e)}"}
+
+    def choose_table(self, resolution) -> str:
+        """Coarsest materialized resolution whose buckets tile ``resolution``"""
+        seconds = resolution_seconds(resolution)
+        best = None
+        for name, width in ROLLUP_RESOLUTIONS.items():
+            if width <= seconds and seconds % width == 0:
+                best = name
+        if best is None:
+            raise ValueError(f"Resolution '{resolution}' is finer than the 1m bars")
+        return best
+
+    def get_bars(self, symbol, resolution='1m', start=None, end=None, limit=None) -> Dict:
+        """Get OHLCV bars for ``symbol`` at ``resolution`` between ``start`` and ``end``
+
+        Reads from the coarsest bar table that can answer the request and
+        aggregates further in memory when the resolution is not materialized
+        (for example 15m from 5m, or 1w from 1d). Bars are oldest first;
+        ``limit`` keeps the most recent ones.
+        """
+        try:
+            source = self.choose_table(resolution)
+            width = resolution_seconds(resolution)
+            source_width = ROLLUP_RESOLUTIONS[source]
+
+            conditions = ["symbol = ?"]
+            params = [symbol]
+            if start is not None:
+                conditions.append("bucket_start >= ?")
+                params.append(format_timestamp(start))
+            if end is not None:
+                conditions.append("bucket_start < ?")
+                params.append(format_timestamp(end))
+
+            query = f'''
+                SELECT CAST(strftime('%s', bucket_start) AS INTEGER), open_price, high_price, low_price,
+                       close_price, volume, tick_count
+                FROM {self.table_name(source)}
+                WHERE {' AND '.join(conditions)}
+                ORDER BY bucket_start DESC
+            '''
+            if limit is not None and width == source_width:
+                query += " LIMIT ?"
+                params.append(limit)
+
+            with self.pool.connection() as conn:
+                rows = conn.execute(query, params).fetchall()
+            rows.reverse()
+
+            if width != source_width:
+                bars = {}
+                for epoch, open_price, high_price, low_price, close_price, volume, count in rows:
+                    _merge(bars, epoch - epoch % width, [open_price, high_price, low_price, close_price,
+                                                         volume, count, epoch, epoch])
+                rows = [
+                    (bucket, bar[_OPEN], bar[_HIGH], bar[_LOW], bar[_CLOSE], bar[_VOLUME], bar[_COUNT])
+                    for bucket, bar in sorted(bars.items())
+                ]
+                if limit is not None:
+                    rows = rows[-limit:]
+
+            return {
+                "success": True,
+                "symbol": symbol,
+                "resolution": resolution,
+                "source_table": self.table_name(source),
+                "bars": [
+                    {
+                        "open": row[1],
+                        "high": row[2],
+                        "low": row[3],
+                        "close": row[4],
+                        "volume": row[5],
+                        "ticks": row[6],
+                        "timestamp": _bucket_timestamp(row[0])
+                    } for row in rows
+                ]
+            }
+
+        except Exception as e:
+            return {"success": False, "message": f"Error fetching bars: {str(e)}"}
+
+    def get_timeframe_bars(self, symbol, timeframe='1D', end=None) -> Dict:
+        """Get bars for one of the UI timeframes (1D/1W/1M/3M)"""
+        if timeframe not in TIMEFRAMES:
+            return {"success": False, "message": f"Unknown timeframe '{timeframe}'"}
+
+        span, resolution = TIMEFRAMES[timeframe]
+        if end is None:
+            end = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(seconds=1)
+        elif isinstance(end, str):
+            end = datetime.strptime(end, TIMESTAMP_FORMAT)
+
+        return self.get_bars(symbol, resolution, start=end - span, end=end)
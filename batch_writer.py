@@ -0,0 +1,233 @@
+import logging
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from Database_for_user import utc_timestamp
+
+logger = logging.getLogger(__name__)
+
+
+class _Control:
+    """Flush/stop marker passed through the queue"""
+
+    def __init__(self, stop: bool = False):
+        self.stop = stop
+        self.done = threading.Event()
+
+
+class BatchWriter:
+    """Background writer that groups queued records into batches
+
+    Records are handed to ``flush_func`` (one call per batch) when
+    ``max_batch_size`` records are pending or ``flush_interval`` seconds
+    have passed since the first pending record. The queue is bounded by
+    ``max_queue_size``; when it is full ``overflow="block"`` makes the
+    producer wait (back-pressure, optionally up to ``put_timeout`` seconds)
+    and ``overflow="drop"`` discards the record and counts it.
+    """
+
+    def __init__(self, flush_func: Callable[[List], object], max_batch_size: int = 500,
+                 flush_interval: float = 1.0, max_queue_size: int = 10000,
+                 overflow: str = 'block', put_timeout: float = None,
+                 name: str = 'batch-writer'):
+        if overflow not in ('block', 'drop'):
+            raise ValueError("overflow must be 'block' or 'drop'")
+
+        self.flush_func = flush_func
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.put_timeout = put_timeout
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._queued = 0
+        self._written = 0
+        self._dropped = 0
+        self._failed = 0
+        self._flushes = 0
+        self._blocked = 0
+        self._last_flush_seconds = None
+
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def put(self, record) -> bool:
+        """Queue a record; returns False if it was dropped"""
+        if self._closed:
+            raise RuntimeError("BatchWriter is closed")
+
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            if self.overflow == 'drop':
+                with self._lock:
+                    self._dropped += 1
+                return False
+
+            with self._lock:
+                self._blocked += 1
+            try:
+                self._queue.put(record, timeout=self.put_timeout)
+            except queue.Full:
+                with self._lock:
+                    self._dropped += 1
+                raise
+
+        with self._lock:
+            self._queued += 1
+        return True
+
+    def flush(self, timeout: float = None) -> bool:
+        """Write everything queued so far; returns False on timeout"""
+        if self._closed or not self._thread.is_alive():
+            return False
+        control = _Control()
+        self._queue.put(control)
+        return control.done.wait(timeout)
+
+    def close(self, timeout: float = None):
+        """Flush pending records and stop the writer thread"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_Control(stop=True))
+        self._thread.join(timeout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def stats(self) -> Dict:
+        """Return queued/written/dropped counters and flush timing"""
+        with self._lock:
+            return {
+                'queued': self._queued,
+                'written': self._written,
+                'dropped': self._dropped,
+                'failed': self._failed,
+                'pending': self._queue.qsize(),
+                'flushes': self._flushes,
+                'producer_blocks': self._blocked,
+                'last_flush_seconds': self._last_flush_seconds,
+                'running': self._thread.is_alive()
+            }
+
+    def _write(self, batch: List):
+        if not batch:
+            return
+
+        started = time.perf_counter()
+        try:
+            result = self.flush_func(batch)
+            if isinstance(result, dict) and not result.get('success', True):
+                raise RuntimeError(result.get('message', 'flush failed'))
+        except Exception as e:
+            logger.error(f"Batch flush of {len(batch)} records failed: {str(e)}")
+            with self._lock:
+                self._failed += len(batch)
+        else:
+            with self._lock:
+                self._written += len(batch)
+        finally:
+            with self._lock:
+                self._flushes += 1
+                self._last_flush_seconds = round(time.perf_counter() - started, 6)
+
+    def _run(self):
+        batch = []
+        deadline = None
+
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                self._write(batch)
+                batch, deadline = [], None
+                continue
+
+            if isinstance(item, _Control):
+                self._write(batch)
+                batch, deadline = [], None
+                if item.stop:
+                    self._drain()
+                    item.done.set()
+                    return
+                item.done.set()
+                continue
+
+            batch.append(item)
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+            if len(batch) >= self.max_batch_size:
+                self._write(batch)
+                batch, deadline = [], None
+
+    def _drain(self):
+        batch = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, _Control):
+                item.done.set()
+                continue
+            batch.append(item)
+            if len(batch) >= self.max_batch_size:
+                self._write(batch)
+                batch = []
+        self._write(batch)
+
+
+class TickWriter(BatchWriter):
+    """Buffered writer for stock_price_history ticks
+
+    Ticks are stamped when they are queued, not when they are flushed, and
+    written with ``StockDatabase.save_stock_prices`` in one transaction per
+    batch.
+    """
+
+    def __init__(self, db, max_batch_size: int = 1000, flush_interval: float = 1.0,
+                 max_queue_size: int = 50000, overflow: str = 'block',
+                 put_timeout: float = None, on_flush: Optional[Callable[[List], None]] = None):
+        self.db = db
+        self.on_flush = on_flush
+        super().__init__(self._save, max_batch_size=max_batch_size,
+                         flush_interval=flush_interval, max_queue_size=max_queue_size,
+                         overflow=overflow, put_timeout=put_timeout, name='tick-writer')
+
+    def add_tick(self, symbol, open_price, high_price, low_price, close_price, volume,
+                 timestamp=None) -> bool:
+        """Queue one OHLCV tick"""
+        if timestamp is None:
+            timestamp = utc_timestamp()
+        return self.put((symbol, open_price, high_price, low_price, close_price, volume, timestamp))
+
+    def add_ticks(self, rows) -> int:
+        """Queue many (symbol, open, high, low, close, volume[, timestamp]) rows or dicts"""
+        accepted = 0
+        now = utc_timestamp()
+        for row in rows:
+            if isinstance(row, dict):
+                row = (row['symbol'], row['open'], row['high'], row['low'], row['close'],
+                       row['volume'], row.get('timestamp'))
+            if len(row) < 7 or row[6] is None:
+                row = tuple(row[:6]) + (now,)
+            accepted += self.put(row)
+        return accepted
+
+    def _save(self, batch: List):
+        result = self.db.save_stock_prices(batch)
+        if result.get('success') and self.on_flush is not None:
+            try:
+                self.on_flush(batch)
+            except Exception as e:
+                logger.error(f"Tick on_flush callback failed: {str(e)}")
+        return result
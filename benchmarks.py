@@ -0,0 +1,445 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+import platform
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from Database_for_user import StockDatabase, TIMESTAMP_FORMAT
+from price_simulator import DEFAULT_STOCKS, PriceSimulator
+
+SERVER_SCHEMA = Path(__file__).with_name('user_sever.sql')
+
+# (users, trades, ticks) per named data size
+SIZES = {
+    'small': (1000, 10000, 10000),
+    'medium': (10000, 100000, 100000),
+    'large': (100000, 1000000, 1000000)
+}
+DEFAULT_CONCURRENCY = (1, 4, 16)
+# Seconds between generated ticks; even 'large' then spans a few months of history
+TICK_INTERVAL_SECONDS = 60.0
+
+# Roles from user_sever.sql handed out to synthetic users, with their weights
+USER_ROLES = (('standard_user', 0.7), ('premium_user', 0.2), ('demo_user', 0.09), ('moderator', 0.01))
+PERMISSIONS = ('trade.execute', 'trade.view', 'trade.advanced', 'portfolio.view', 'portfolio.export', 'system.logs')
+FEATURE_FLAGS = ('dark_mode_v2', 'advanced_charts', 'options_trading', 'beta_dashboard')
+
+
+# ==================== Server Schema ====================
+
+def load_server_schema(db_path: str, schema_path: Path = SERVER_SCHEMA) -> Dict:
+    """Apply user_sever.sql to a SQLite file, one statement at a time
+
+    ENUM(...) columns become TEXT; statements SQLite cannot run (the
+    MySQL-style IF ... END IF trigger) are skipped and reported.
+    """
+    script = re.sub(r'ENUM\([^)]*\)', 'TEXT', schema_path.read_text())
+
+    applied, skipped, statement = 0, [], ''
+    conn = sqlite3.connect(db_path)
+    try:
+        for line in script.splitlines(keepends=True):
+            statement += line
+            if not sqlite3.complete_statement(statement):
+                continue
+            try:
+                conn.execute(statement)
+                applied += 1
+            except sqlite3.Error as e:
+                skipped.append({'statement': statement.strip().splitlines()[0], 'error': str(e)})
+            statement = ''
+        conn.commit()
+    finally:
+        conn.close()
+
+    return {'applied': applied, 'skipped': skipped}
+
+
+# ==================== Synthetic Data ====================
+
+def _password(user_number: int) -> str:
+    return f'password{user_number}'
+
+
+def _session_token(user_number: int) -> str:
+    return hashlib.sha256(f'bench-session-{user_number}'.encode()).hexdigest()
+
+
+def generate_dataset(db_path: str, users: int, trades: int, ticks: int, logs: int = None,
+                     seed: int = 0) -> Dict:
+    """Create a database with ``users`` accounts, ``trades`` trades and ``ticks`` price rows
+
+    Every user gets a balance, preferences, a live session and one role
+    from user_sever.sql; ``logs`` server access rows (default: one per
+    trade) are spread over the last 60 days. The same arguments always
+    produce the same data.
+    """
+    started = time.perf_counter()
+    rng = random.Random(seed)
+    logs = trades if logs is None else logs
+    symbols = list(DEFAULT_STOCKS)
+
+    db = StockDatabase(db_path)
+    schema = load_server_schema(db_path)
+
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.executemany('''
+            INSERT INTO users (id, username, email, password_hash, first_name, last_name)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (
+            (n, f'user{n}', f'user{n}@example.com', hashlib.sha256(_password(n).encode()).hexdigest(),
+             'Bench', f'User{n}')
+            for n in range(1, users + 1)
+        ))
+        conn.executemany('INSERT INTO user_balances (user_id) VALUES (?)', ((n,) for n in range(1, users + 1)))
+        conn.executemany('INSERT INTO user_preferences (user_id) VALUES (?)', ((n,) for n in range(1, users + 1)))
+        conn.executemany('''
+            INSERT INTO user_sessions (user_id, session_token, expires_at)
+            VALUES (?, ?, datetime('now', '+30 days'))
+        ''', ((n, _session_token(n)) for n in range(1, users + 1)))
+
+        role_ids = dict(conn.execute('SELECT role_name, id FROM user_roles'))
+        names, weights = zip(*USER_ROLES)
+        conn.executemany('INSERT INTO user_role_assignments (user_id, role_id) VALUES (?, ?)', (
+            (n, role_ids[role]) for n, role in zip(range(1, users + 1), rng.choices(names, weights, k=users))
+        ))
+
+        conn.executemany('''
+            INSERT OR REPLACE INTO feature_flags (feature_name, is_enabled, enabled_for_all, enabled_for_roles,
+                                                  enabled_for_users)
+            VALUES (?, 1, ?, ?, ?)
+        ''', [
+            (FEATURE_FLAGS[0], 1, None, None),
+            (FEATURE_FLAGS[1], 0, json.dumps([role_ids['premium_user']]), None),
+            (FEATURE_FLAGS[2], 0, None, json.dumps(rng.sample(range(1, users + 1), min(users, 100)))),
+            (FEATURE_FLAGS[3], 0, json.dumps([role_ids['moderator']]), json.dumps([1]))
+        ])
+
+        now = time.time()
+        conn.executemany('''
+            INSERT INTO trading_history (user_id, symbol, trade_type, shares, price, total_amount, timestamp)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            (user, symbol, trade_type, shares, price, shares * price,
+             _timestamp(now - rng.uniform(0, 365 * 86400)))
+            for user, symbol, trade_type, shares, price in (
+                (rng.randint(1, users), rng.choice(symbols), rng.choice(('buy', 'sell')), rng.randint(1, 100),
+                 round(rng.uniform(5, 5000), 2))
+                for _ in range(trades)
+            )
+        ))
+        conn.executemany('''
+            INSERT INTO server_access_logs (user_id, request_method, request_url, response_status,
+                                            response_time_ms, timestamp)
+            VALUES (?, 'GET', '/api/portfolio', 200, ?, ?)
+        ''', (
+            (rng.randint(1, users), rng.randint(1, 500), _timestamp(now - rng.uniform(0, 60 * 86400)))
+            for _ in range(logs)
+        ))
+        conn.commit()
+    finally:
+        conn.close()
+
+    history = PriceSimulator(seed=seed, interval_seconds=TICK_INTERVAL_SECONDS).write_history(
+        db, math.ceil(ticks / len(symbols)))
+    if not history['success']:
+        db.close()
+        raise RuntimeError(f"Price history generation failed: {history['message']}")
+    db.close()
+
+    return {
+        'users': users,
+        'trades': trades,
+        'ticks': history['rows_written'],
+        'logs': logs,
+        'schema_skipped': len(schema['skipped']),
+        'seconds': time.perf_counter() - started
+    }
+
+
+def _timestamp(epoch: float) -> str:
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime(TIMESTAMP_FORMAT)
+
+
+# ==================== Scenarios ====================
+
+class BenchmarkContext(NamedTuple):
+    db: StockDatabase
+    server: Any
+    users: int
+    symbols: List[str]
+
+
+class Scenario(NamedTuple):
+    name: str
+    layer: str
+    op: Callable[[BenchmarkContext, random.Random], Any]
+    # Untimed work before each call, e.g. recreating rows the call consumes
+    prepare: Optional[Callable[[BenchmarkContext, random.Random], None]] = None
+    concurrent: bool = True
+
+
+def _authenticate_user(ctx: BenchmarkContext, rng: random.Random):
+    user = rng.randint(1, ctx.users)
+    return ctx.db.authenticate_user(f'user{user}', _password(user))
+
+
+def _validate_session(ctx: BenchmarkContext, rng: random.Random):
+    return ctx.db.validate_session(_session_token(rng.randint(1, ctx.users)))
+
+
+def _execute_trade(ctx: BenchmarkContext, rng: random.Random):
+    return ctx.db.execute_trade(rng.randint(1, ctx.users), rng.choice(ctx.symbols), 'buy', 1, 1.0, 1.0)
+
+
+def _save_stock_price(ctx: BenchmarkContext, rng: random.Random):
+    price = rng.uniform(10, 1000)
+    return ctx.db.save_stock_price(rng.choice(ctx.symbols), price, price * 1.01, price * 0.99, price,
+                                   rng.randint(100000, 1100000))
+
+
+def _get_stock_history(ctx: BenchmarkContext, rng: random.Random):
+    return ctx.db.get_stock_history(rng.choice(ctx.symbols), 100)
+
+
+def _check_user_permission(ctx: BenchmarkContext, rng: random.Random):
+    return ctx.server.check_user_permission(rng.randint(1, ctx.users), rng.choice(PERMISSIONS))
+
+
+def _is_feature_enabled(ctx: BenchmarkContext, rng: random.Random):
+    return ctx.server.is_feature_enabled(rng.choice(FEATURE_FLAGS), rng.randint(1, ctx.users))
+
+
+def _log_server_access(ctx: BenchmarkContext, rng: random.Random):
+    return ctx.server.log_server_access(user_id=rng.randint(1, ctx.users), ip_address='127.0.0.1',
+                                        request_method='GET', request_url='/api/portfolio',
+                                        response_status=200, response_time_ms=rng.randint(1, 500))
+
+
+def _insert_expired_logs(ctx: BenchmarkContext, rng: random.Random, count: int = 1000):
+    with ctx.db.pool.connection() as conn:
+        conn.executemany('''
+            INSERT INTO server_access_logs (user_id, request_method, request_url, response_status, timestamp)
+            VALUES (?, 'GET', '/api/portfolio', 200, datetime('now', '-60 days'))
+        ''', ((rng.randint(1, ctx.users),) for _ in range(count)))
+        conn.commit()
+
+
+def _cleanup_old_logs(ctx: BenchmarkContext, rng: random.Random):
+    return ctx.server.cleanup_old_logs(30)
+
+
+SCENARIOS = {
+    scenario.name: scenario for scenario in (
+        Scenario('authenticate_user', 'database', _authenticate_user),
+        Scenario('validate_session', 'database', _validate_session),
+        Scenario('execute_trade', 'database', _execute_trade),
+        Scenario('save_stock_price', 'database', _save_stock_price),
+        Scenario('get_stock_history', 'database', _get_stock_history),
+        Scenario('check_user_permission', 'server', _check_user_permission),
+        Scenario('is_feature_enabled', 'server', _is_feature_enabled),
+        Scenario('log_server_access', 'server', _log_server_access),
+        # Retention deletes in batches under one lock; parallel runs would only queue
+        Scenario('cleanup_old_logs', 'server', _cleanup_old_logs, _insert_expired_logs, concurrent=False)
+    )
+}
+
+
+# ==================== Runner ====================
+
+def _failed(result) -> bool:
+    return isinstance(result, dict) and result.get('success') is False
+
+
+def run_scenario(ctx: BenchmarkContext, scenario: Scenario, ops: int, concurrency: int = 1,
+                 warmup: int = 50, seed: int = 0) -> Dict:
+    """Run ``ops`` calls of ``scenario`` split over ``concurrency`` threads
+
+    Each thread has its own seeded random stream and records the latency
+    of every call; prepare() work is not timed. Throughput is the total
+    number of calls over the wall time from the common start to the last
+    thread finishing.
+    """
+    warmup_rng = random.Random(seed - 1)
+    for _ in range(warmup):
+        if scenario.prepare is not None:
+            scenario.prepare(ctx, warmup_rng)
+        scenario.op(ctx, warmup_rng)
+
+    latencies: List[List[float]] = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    start = threading.Barrier(concurrency + 1)
+
+    def worker(index: int, count: int):
+        rng = random.Random(seed * 1000 + index)
+        timings = latencies[index]
+        start.wait()
+        for _ in range(count):
+            if scenario.prepare is not None:
+                scenario.prepare(ctx, rng)
+            began = time.perf_counter()
+            try:
+                failed = _failed(scenario.op(ctx, rng))
+            except Exception:
+                failed = True
+            timings.append(time.perf_counter() - began)
+            errors[index] += failed
+
+    threads = [
+        threading.Thread(target=worker, args=(index, ops // concurrency + (index < ops % concurrency)))
+        for index in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    start.wait()
+    began = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - began
+
+    timings = np.concatenate([np.array(values) for values in latencies]) * 1000
+    if scenario.prepare is not None:
+        # The wall time includes untimed prepare() work, so use the time spent in the calls
+        elapsed = float(timings.sum()) / 1000 / concurrency
+    return {
+        'scenario': scenario.name,
+        'layer': scenario.layer,
+        'concurrency': concurrency,
+        'ops': len(timings),
+        'errors': sum(errors),
+        'seconds': elapsed,
+        'ops_per_sec': len(timings) / elapsed,
+        'mean_ms': float(timings.mean()),
+        'p50_ms': float(np.percentile(timings, 50)),
+        'p99_ms': float(np.percentile(timings, 99)),
+        'max_ms': float(timings.max())
+    }
+
+
+def run_benchmarks(sizes: Dict[str, Tuple[int, int, int]], scenarios: Sequence[str] = None,
+                   concurrency: Sequence[int] = DEFAULT_CONCURRENCY, ops: int = 2000, warmup: int = 50,
+                   seed: int = 0, pool_size: int = 5, data_dir: str = None, progress: Callable = None) -> Dict:
+    """Generate each data size, run every scenario at every concurrency level and collect the results"""
+    from sever_manager import ServerManager
+
+    scenarios = [SCENARIOS[name] for name in (scenarios or SCENARIOS)]
+    report = {'meta': _environment(), 'config': {
+        'ops': ops, 'warmup': warmup, 'seed': seed, 'pool_size': pool_size,
+        'concurrency': list(concurrency), 'sizes': {name: list(size) for name, size in sizes.items()}
+    }, 'datasets': {}, 'results': []}
+
+    with tempfile.TemporaryDirectory(dir=data_dir) as workdir:
+        for size_name, (users, trades, ticks) in sizes.items():
+            db_path = os.path.join(workdir, f'bench_{size_name}.db')
+            report['datasets'][size_name] = generate_dataset(db_path, users, trades, ticks, seed=seed)
+
+            server = ServerManager(db_path, pool_size=pool_size, backup_dir=os.path.join(workdir, 'backups'))
+            ctx = BenchmarkContext(server.db, server, users, list(DEFAULT_STOCKS))
+            try:
+                for scenario in scenarios:
+                    for threads in (concurrency if scenario.concurrent else concurrency[:1]):
+                        result = run_scenario(ctx, scenario, ops, threads, warmup, seed)
+                        result['size'] = size_name
+                        report['results'].append(result)
+                        if progress is not None:
+                            progress(result)
+            finally:
+                server.close()
+                server.db.close()
+
+    return report
+
+
+def _environment() -> Dict:
+    return {
+        'timestamp': datetime.now(timezone.utc).strftime(TIMESTAMP_FORMAT),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+
+
+def compare_reports(baseline: Dict, current: Dict, threshold: float = 0.1) -> List[Dict]:
+    """Rows whose throughput fell or p99 latency rose by more than ``threshold`` versus ``baseline``"""
+    previous = {(row['scenario'], row['size'], row['concurrency']): row for row in baseline['results']}
+
+    regressions = []
+    for row in current['results']:
+        before = previous.get((row['scenario'], row['size'], row['concurrency']))
+        if before is None:
+            continue
+        throughput = row['ops_per_sec'] / before['ops_per_sec'] - 1
+        p99 = row['p99_ms'] / before['p99_ms'] - 1 if before['p99_ms'] else 0.0
+        if throughput < -threshold or p99 > threshold:
+            regressions.append({
+                'scenario': row['scenario'],
+                'size': row['size'],
+                'concurrency': row['concurrency'],
+                'ops_per_sec_change': throughput,
+                'p99_change': p99
+            })
+    return regressions
+
+
+def _parse_size(value: str) -> Tuple[str, Tuple[int, int, int]]:
+    if value in SIZES:
+        return value, SIZES[value]
+    users, trades, ticks = (int(part) for part in value.split(','))
+    return f'{users}u_{trades}t_{ticks}k', (users, trades, ticks)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Database and server-manager benchmark suite")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help="run the scenarios and write a JSON report")
+    run.add_argument('--size', action='append', dest='sizes',
+                     help="small/medium/large or USERS,TRADES,TICKS (repeatable; default small and medium)")
+    run.add_argument('--scenario', action='append', dest='scenarios', choices=sorted(SCENARIOS))
+    run.add_argument('--concurrency', default=','.join(map(str, DEFAULT_CONCURRENCY)),
+                     help="comma-separated thread counts")
+    run.add_argument('--ops', type=int, default=2000, help="timed calls per scenario run")
+    run.add_argument('--warmup', type=int, default=50)
+    run.add_argument('--seed', type=int, default=0)
+    run.add_argument('--pool-size', type=int, default=5)
+    run.add_argument('--data-dir', help="where the temporary databases are created")
+    run.add_argument('--output', default='benchmark_results.json')
+
+    compare = commands.add_parser('compare', help="report regressions between two JSON reports")
+    compare.add_argument('baseline')
+    compare.add_argument('current')
+    compare.add_argument('--threshold', type=float, default=0.1, help="allowed relative change")
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        report = run_benchmarks(
+            dict(_parse_size(size) for size in (args.sizes or ['small', 'medium'])), args.scenarios,
+            [int(value) for value in args.concurrency.split(',')], args.ops, args.warmup, args.seed,
+            args.pool_size, args.data_dir,
+            progress=lambda row: print(f"{row['size']:>8} {row['scenario']:<22} x{row['concurrency']:<3} "
+                                       f"{row['ops_per_sec']:>10.0f} ops/s  p50 {row['p50_ms']:.3f} ms  "
+                                       f"p99 {row['p99_ms']:.3f} ms  errors {row['errors']}")
+        )
+        Path(args.output).write_text(json.dumps(report, indent=2))
+        print(f"Wrote {args.output}")
+    else:
+        regressions = compare_reports(json.loads(Path(args.baseline).read_text()),
+                                      json.loads(Path(args.current).read_text()), args.threshold)
+        print(json.dumps(regressions, indent=2))
+        sys.exit(1 if regressions else 0)
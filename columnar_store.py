@@ -0,0 +1,355 @@
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+from calendar import timegm
+from contextlib import ExitStack
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from Database_for_user import TIMESTAMP_FORMAT, format_timestamp, utc_timestamp
+
+# Fixed-width column files kept per symbol, in append order
+COLUMNS = (
+    ('timestamp', np.dtype('<i8')),
+    ('open', np.dtype('<f8')),
+    ('high', np.dtype('<f8')),
+    ('low', np.dtype('<f8')),
+    ('close', np.dtype('<f8')),
+    ('volume', np.dtype('<i8'))
+)
+
+# Per-symbol file recording the last (epoch, id) copied by migrate_from_sqlite
+MIGRATION_WATERMARK_FILE = 'sqlite_watermark.json'
+
+_SYMBOL_PATTERN = re.compile(r'^[A-Za-z0-9._\-]+$')
+
+
+def to_epoch(value) -> int:
+    """Convert a stored-format timestamp, datetime or epoch to epoch seconds (UTC)"""
+    if value is None:
+        value = utc_timestamp()
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, float):
+        return int(value)
+    parsed = datetime.fromisoformat(format_timestamp(value)[:19])
+    return timegm(parsed.timetuple())
+
+
+def from_epoch(epoch: int) -> str:
+    return datetime.fromtimestamp(int(epoch), tz=timezone.utc).strftime(TIMESTAMP_FORMAT)
+
+
+class ColumnarPriceStore:
+    """Append-only, memory-mapped columnar history backend
+
+    Each symbol is a directory of fixed-width column files
+    (``timestamp.i8``, ``open.f8``, ... ``volume.i8``). Writes append to
+    every column; readers get read-only ``numpy.memmap`` views, so range
+    reads are zero-copy. Timestamps must be non-decreasing per symbol,
+    which makes the timestamp column its own index: range lookups are a
+    binary search (``numpy.searchsorted``).
+
+    Implements the same ``save_stock_price`` / ``save_stock_prices`` /
+    ``get_stock_history`` interface as StockDatabase, so it can be passed
+    as ``StockDatabase(history_backend=...)``.
+    """
+
+    def __init__(self, root_dir: str):
+        self.root_dir = root_dir
+        os.makedirs(root_dir, exist_ok=True)
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+        self._maps: Dict[str, tuple] = {}
+
+    def _symbol_dir(self, symbol: str) -> str:
+        if not _SYMBOL_PATTERN.match(symbol):
+            raise ValueError(f"Invalid symbol '{symbol}'")
+        return os.path.join(self.root_dir, symbol)
+
+    def _column_path(self, symbol: str, column: str, dtype: np.dtype) -> str:
+        return os.path.join(self._symbol_dir(symbol), f"{column}.{dtype.kind}{dtype.itemsize}")
+
+    def _lock(self, symbol: str) -> threading.Lock:
+        with self._locks_guard:
+            lock = self._locks.get(symbol)
+            if lock is None:
+                lock = self._locks[symbol] = threading.Lock()
+            return lock
+
+    def symbols(self):
+        """List stored symbols"""
+        return sorted(
+            name for name in os.listdir(self.root_dir)
+            if os.path.isdir(os.path.join(self.root_dir, name))
+        )
+
+    def row_count(self, symbol: str) -> int:
+        """Number of complete rows (a torn append is ignored)"""
+        counts = []
+        for column, dtype in COLUMNS:
+            path = self._column_path(symbol, column, dtype)
+            if not os.path.exists(path):
+                return 0
+            counts.append(os.path.getsize(path) // dtype.itemsize)
+        return min(counts)
+
+    def read_columns(self, symbol: str) -> Dict[str, np.ndarray]:
+        """Return read-only memory-mapped arrays for every column of ``symbol``"""
+        count = self.row_count(symbol)
+        cached = self._maps.get(symbol)
+        if cached is not None and cached[0] == count:
+            return cached[1]
+
+        if count == 0:
+            arrays = {column: np.empty(0, dtype=dtype) for column, dtype in COLUMNS}
+        else:
+            arrays = {
+                column: np.memmap(self._column_path(symbol, column, dtype), dtype=dtype,
+                                  mode='r', shape=(count,))
+                for column, dtype in COLUMNS
+            }
+
+        self._maps[symbol] = (count, arrays)
+        return arrays
+
+    def read_range(self, symbol: str, start=None, end=None) -> Dict[str, np.ndarray]:
+        """Zero-copy column slices with start <= timestamp < end"""
+        arrays = self.read_columns(symbol)
+        timestamps = arrays['timestamp']
+
+        lo = 0 if start is None else int(np.searchsorted(timestamps, to_epoch(start), side='left'))
+        hi = len(timestamps) if end is None else int(np.searchsorted(timestamps, to_epoch(end), side='left'))
+
+        return {column: values[lo:hi] for column, values in arrays.items()}
+
+    def last_timestamp(self, symbol: str) -> Optional[int]:
+        timestamps = self.read_columns(symbol)['timestamp']
+        return int(timestamps[-1]) if len(timestamps) else None
+
+    def _append(self, batches: Dict[str, Dict[str, np.ndarray]]):
+        """Append each symbol's columns, or nothing if any symbol's batch is out of order"""
+        for symbol, columns in batches.items():
+            order = np.argsort(columns['timestamp'], kind='stable')
+            batches[symbol] = {name: values[order] for name, values in columns.items()}
+
+        with ExitStack() as stack:
+            # Sorted so concurrent multi-symbol appends take the locks in the same order
+            for symbol in sorted(batches):
+                stack.enter_context(self._lock(symbol))
+
+            for symbol, columns in batches.items():
+                last = self.last_timestamp(symbol)
+                if last is not None and columns['timestamp'][0] < last:
+                    raise ValueError(
+                        f"Out-of-order append for {symbol}: "
+                        f"{from_epoch(columns['timestamp'][0])} < {from_epoch(last)}"
+                    )
+
+            for symbol, columns in batches.items():
+                self._write(symbol, columns)
+
+    def _write(self, symbol: str, columns: Dict[str, np.ndarray]):
+        # Caller holds the symbol's lock
+        os.makedirs(self._symbol_dir(symbol), exist_ok=True)
+
+        # Trim a torn append so every column has the same length again
+        count = self.row_count(symbol)
+        for column, dtype in COLUMNS:
+            path = self._column_path(symbol, column, dtype)
+            if os.path.exists(path) and os.path.getsize(path) != count * dtype.itemsize:
+                os.truncate(path, count * dtype.itemsize)
+
+        # timestamp is written last, so a partial append is never visible
+        for column, dtype in COLUMNS[1:] + COLUMNS[:1]:
+            with open(self._column_path(symbol, column, dtype), 'ab') as f:
+                f.write(np.ascontiguousarray(columns[column], dtype=dtype).tobytes())
+
+    def save_stock_price(self, symbol, open_price, high_price, low_price, close_price, volume, timestamp=None):
+        """Append one row"""
+        return self.save_stock_prices([(symbol, open_price, high_price, low_price, close_price, volume, timestamp)])
+
+    def save_stock_prices(self, rows):
+        """Append many (symbol, open, high, low, close, volume[, timestamp]) rows or dicts"""
+        try:
+            grouped = {}
+            count = 0
+            now = utc_timestamp()
+            for row in rows:
+                if isinstance(row, dict):
+                    row = (row['symbol'], row['open'], row['high'], row['low'], row['close'],
+                           row['volume'], row.get('timestamp'))
+                timestamp = row[6] if len(row) > 6 and row[6] is not None else now
+                grouped.setdefault(row[0], []).append((to_epoch(timestamp),) + tuple(row[1:6]))
+                count += 1
+
+            batches = {}
+            for symbol, values in grouped.items():
+                table = list(zip(*values))
+                batches[symbol] = {
+                    column: np.asarray(table[i], dtype=dtype)
+                    for i, (column, dtype) in enumerate(COLUMNS)
+                }
+            self._append(batches)
+
+            return {"success": True, "count": count}
+
+        except Exception as e:
+            return {"success": False, "message": f"Error saving price data: {str(e)}"}
+
+    def get_stock_history(self, symbol, limit=100):
+        """Most recent ``limit`` rows, newest first, in StockDatabase's format"""
+        try:
+            arrays = self.read_columns(symbol)
+            count = len(arrays['timestamp'])
+            start = max(0, count - limit)
+            window = {column: values[start:][::-1].tolist() for column, values in arrays.items()}
+
+            return {
+                "success": True,
+                "history": [
+                    {
+                        "open": window['open'][i],
+                        "high": window['high'][i],
+                        "low": window['low'][i],
+                        "close": window['close'][i],
+                        "volume": window['volume'][i],
+                        "timestamp": from_epoch(window['timestamp'][i])
+                    } for i in range(count - start)
+                ]
+            }
+
+        except Exception as e:
+            return {"success": False, "message": f"Error fetching stock history: {str(e)}"}
+
+    def iter_history_chunks(self, symbol, chunk_size=1000, after=None, newest_first=True, start=None, end=None):
+        """Yield lists of (position, row) in StockDatabase's format, ``chunk_size`` rows at a time
+
+        Rows are addressed by their position in the append-only columns, so
+        ``after`` (the last position already seen) is a stable keyset
+        cursor. Rows appended after iteration starts are not included.
+        """
+        arrays = self.read_columns(symbol)
+        timestamps = arrays['timestamp']
+        lo = 0 if start is None else int(np.searchsorted(timestamps, to_epoch(start), side='left'))
+        hi = len(timestamps) if end is None else int(np.searchsorted(timestamps, to_epoch(end), side='left'))
+        if after is not None:
+            if newest_first:
+                hi = min(hi, after)
+            else:
+                lo = max(lo, after + 1)
+
+        while lo < hi:
+            if newest_first:
+                first, last = max(lo, hi - chunk_size), hi
+                hi = first
+                positions = range(last - 1, first - 1, -1)
+                window = {column: values[first:last][::-1].tolist() for column, values in arrays.items()}
+            else:
+                first, last = lo, min(hi, lo + chunk_size)
+                lo = last
+                positions = range(first, last)
+                window = {column: values[first:last].tolist() for column, values in arrays.items()}
+
+            yield [
+                (position, {
+                    "open": window['open'][i],
+                    "high": window['high'][i],
+                    "low": window['low'][i],
+                    "close": window['close'][i],
+                    "volume": window['volume'][i],
+                    "timestamp": from_epoch(window['timestamp'][i])
+                }) for i, position in enumerate(positions)
+            ]
+
+
+def _migration_watermark_path(store: ColumnarPriceStore, symbol: str) -> str:
+    return os.path.join(store._symbol_dir(symbol), MIGRATION_WATERMARK_FILE)
+
+
+def _read_migration_watermark(store: ColumnarPriceStore, symbol: str) -> Optional[Tuple[int, int]]:
+    path = _migration_watermark_path(store, symbol)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        state = json.load(f)
+    return state['epoch'], state['id']
+
+
+def _write_migration_watermark(store: ColumnarPriceStore, symbol: str, epoch: int, row_id: int):
+    path = _migration_watermark_path(store, symbol)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'epoch': epoch, 'id': row_id}, f)
+    os.replace(path + '.tmp', path)
+
+
+def migrate_from_sqlite(db, store: ColumnarPriceStore, symbols=None, chunk_size: int = 100000) -> Dict:
+    """Copy stock_price_history rows from a StockDatabase into ``store``
+
+    Rows are copied in (epoch, id) order and the last copied pair is kept
+    per symbol in the store, so the migration can be re-run to catch up,
+    including rows added later within an already copied second. Stores
+    migrated without a watermark resume after their last timestamp.
+    """
+    try:
+        migrated = {}
+        with db.pool.connection() as conn:
+            if symbols is None:
+                symbols = [row[0] for row in conn.execute(
+                    "SELECT DISTINCT symbol FROM stock_price_history ORDER BY symbol"
+                )]
+
+            for symbol in symbols:
+                watermark = _read_migration_watermark(store, symbol)
+                if watermark is None:
+                    last = store.last_timestamp(symbol)
+                    watermark = (-sys.maxsize, 0) if last is None else (last, sys.maxsize)
+                copied = 0
+
+                while True:
+                    # Compared as epochs, not text, so any timestamp format SQLite parses works
+                    rows = conn.execute('''
+                        SELECT id, open_price, high_price, low_price, close_price, volume, epoch
+                        FROM (
+                            SELECT id, open_price, high_price, low_price, close_price, volume,
+                                   CAST(strftime('%s', timestamp) AS INTEGER) AS epoch
+                            FROM stock_price_history
+                            WHERE symbol = ?
+                        )
+                        WHERE (epoch, id) > (?, ?)
+                        ORDER BY epoch, id
+                        LIMIT ?
+                    ''', (symbol,) + watermark + (chunk_size,)).fetchall()
+                    if not rows:
+                        break
+
+                    result = store.save_stock_prices([(symbol,) + tuple(row[1:7]) for row in rows])
+                    if not result['success']:
+                        return result
+                    copied += len(rows)
+                    watermark = (rows[-1][6], rows[-1][0])
+                    _write_migration_watermark(store, symbol, *watermark)
+
+                migrated[symbol] = copied
+
+        return {"success": True, "rows_migrated": sum(migrated.values()), "symbols": migrated}
+
+    except Exception as e:
+        return {"success": False, "message": f"Error migrating price history: {str(e)}"}
+
+
+if __name__ == "__main__":
+    from Database_for_user import StockDatabase
+
+    parser = argparse.ArgumentParser(description="Migrate stock_price_history into a columnar store")
+    parser.add_argument("db_path", help="SQLite database to read")
+    parser.add_argument("store_dir", help="Directory of the columnar store")
+    parser.add_argument("--symbol", action="append", dest="symbols", help="Only migrate this symbol")
+    args = parser.parse_args()
+
+    print(migrate_from_sqlite(StockDatabase(args.db_path), ColumnarPriceStore(args.store_dir), args.symbols))
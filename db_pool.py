@@ -0,0 +1,303 @@
+import sqlite3
+import threading
+import time
+import os
+from contextlib import contextmanager
+from typing import Callable, Dict, List
+
+
+class PoolTimeoutError(sqlite3.OperationalError):
+    """Raised when no pooled connection becomes available in time"""
+
+
+class _PooledConnection:
+    """Bookkeeping for a single pooled sqlite3 connection"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.checkouts = 0
+        self.owner = None
+        self.depth = 0
+
+
+class ConnectionPool:
+    """Checkout-based pool of persistent SQLite connections
+
+    Connections are opened lazily up to ``pool_size`` and reused across
+    calls. Each connection keeps its own prepared statement cache
+    (``statement_cache_size``), so repeated queries are not re-parsed.
+    A thread that already holds a connection gets the same one back on a
+    nested checkout, which keeps helpers that call each other from
+    exhausting the pool.
+    """
+
+    def __init__(self, db_path: str, pool_size: int = 5, timeout: float = 30.0,
+                 statement_cache_size: int = 128, max_lifetime: float = None):
+        if pool_size < 1:
+            raise ValueError("pool_size must be at least 1")
+
+        self.db_path = db_path
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.statement_cache_size = statement_cache_size
+        self.max_lifetime = max_lifetime
+
+        self._idle: List[_PooledConnection] = []
+        self._all: List[_PooledConnection] = []
+        self._cond = threading.Condition(threading.Lock())
+        self._local = threading.local()
+        self._on_connect: Dict[str, Callable[[sqlite3.Connection], None]] = {}
+        self._factory = sqlite3.Connection
+        self._closed = False
+        # get_pool references not yet given back through release_pool
+        self._refs = 0
+        self._settings: Dict[str, object] = {}
+
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._timeouts = 0
+        self._opened = 0
+        self._retired = 0
+        self._retired_lifetime = 0.0
+
+    def set_connect_hook(self, name: str, hook: Callable[[sqlite3.Connection], None]):
+        """Register (or replace) a named callable run on every new connection
+
+        The hook is also applied to connections that are currently idle.
+        """
+        with self._cond:
+            self._on_connect[name] = hook
+            for record in self._idle:
+                hook(record.conn)
+
+    def claim_setting(self, name: str, value):
+        """Store a pool-wide setting unless one is already stored; returns the stored value"""
+        with self._cond:
+            return self._settings.setdefault(name, value)
+
+    def set_connection_factory(self, factory=sqlite3.Connection):
+        """Open new connections as ``factory`` (a sqlite3.Connection subclass)
+
+        Idle connections of another class are closed now and in-use ones
+        when they are returned, so every later checkout gets the new class.
+        """
+        with self._cond:
+            self._factory = factory
+            for record in [record for record in self._idle if type(record.conn) is not factory]:
+                self._idle.remove(record)
+                self._all.remove(record)
+                self._retire(record)
+            self._cond.notify_all()
+
+    def _open(self) -> _PooledConnection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.timeout,
+            check_same_thread=False,
+            cached_statements=self.statement_cache_size,
+            factory=self._factory
+        )
+        for hook in list(self._on_connect.values()):
+            hook(conn)
+        return _PooledConnection(conn)
+
+    def _retire(self, record: _PooledConnection):
+        try:
+            record.conn.close()
+        finally:
+            self._retired += 1
+            self._retired_lifetime += time.monotonic() - record.created_at
+
+    def _acquire(self) -> _PooledConnection:
+        deadline = time.monotonic() + self.timeout
+        waited = False
+        wait_started = None
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise sqlite3.ProgrammingError("Connection pool is closed")
+
+                if self._idle:
+                    record = self._idle.pop()
+                    break
+
+                if len(self._all) < self.pool_size:
+                    record = None
+                    # Reserve the slot before releasing the lock to open
+                    self._all.append(None)
+                    break
+
+                if not waited:
+                    waited = True
+                    wait_started = time.monotonic()
+                    self._waits += 1
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    self._wait_time += time.monotonic() - wait_started
+                    raise PoolTimeoutError(
+                        f"Timed out after {self.timeout}s waiting for a connection to {self.db_path}"
+                    )
+                self._cond.wait(remaining)
+
+            if waited:
+                self._wait_time += time.monotonic() - wait_started
+
+        if record is None:
+            try:
+                record = self._open()
+            except Exception:
+                with self._cond:
+                    self._all.remove(None)
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._all[self._all.index(None)] = record
+                self._opened += 1
+
+        return record
+
+    def _release(self, record: _PooledConnection):
+        # Never hand a connection with an open transaction to the next caller
+        if record.conn.in_transaction:
+            try:
+                record.conn.rollback()
+            except sqlite3.Error:
+                pass
+
+        expired = (
+            self.max_lifetime is not None
+            and time.monotonic() - record.created_at > self.max_lifetime
+        ) or type(record.conn) is not self._factory
+
+        with self._cond:
+            if self._closed or expired:
+                self._all.remove(record)
+                self._retire(record)
+            else:
+                self._idle.append(record)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection for the duration of a ``with`` block"""
+        record = getattr(self._local, "record", None)
+
+        if record is not None:
+            record.depth += 1
+            try:
+                yield record.conn
+            finally:
+                record.depth -= 1
+            return
+
+        record = self._acquire()
+        record.owner = threading.get_ident()
+        record.depth = 1
+        record.checkouts += 1
+        with self._cond:
+            self._checkouts += 1
+        self._local.record = record
+
+        try:
+            yield record.conn
+        finally:
+            self._local.record = None
+            record.owner = None
+            record.depth = 0
+            self._release(record)
+
+    def stats(self) -> Dict:
+        """Return pool counters and per-connection lifetimes"""
+        now = time.monotonic()
+        with self._cond:
+            live = [record for record in self._all if record is not None]
+            return {
+                "db_path": self.db_path,
+                "pool_size": self.pool_size,
+                "open_connections": len(live),
+                "idle_connections": len(self._idle),
+                "in_use_connections": len(live) - len(self._idle),
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "total_wait_seconds": round(self._wait_time, 6),
+                "timeouts": self._timeouts,
+                "connections_opened": self._opened,
+                "connections_retired": self._retired,
+                "avg_retired_lifetime_seconds": (
+                    round(self._retired_lifetime / self._retired, 3) if self._retired else None
+                ),
+                "connections": [
+                    {
+                        "age_seconds": round(now - record.created_at, 3),
+                        "checkouts": record.checkouts,
+                        "in_use": record.owner is not None
+                    }
+                    for record in live
+                ]
+            }
+
+    def close(self):
+        """Close idle connections; in-use ones are closed when returned"""
+        with self._cond:
+            self._closed = True
+            for record in self._idle:
+                self._all.remove(record)
+                self._retire(record)
+            self._idle = []
+            self._cond.notify_all()
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def _pool_key(db_path: str) -> str:
+    return db_path if db_path == ":memory:" else os.path.abspath(db_path)
+
+
+def get_pool(db_path: str, pool_size: int = 5, **kwargs) -> ConnectionPool:
+    """Return the shared pool for ``db_path``, creating it on first use
+
+    ``StockDatabase`` and ``ServerManager`` pointed at the same file share one
+    pool. ``pool_size`` and the other options only apply when the pool is
+    created. Each call takes a reference that must be given back with
+    ``release_pool``.
+    """
+    key = _pool_key(db_path)
+
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None or pool._closed:
+            pool = ConnectionPool(db_path, pool_size=pool_size, **kwargs)
+            _pools[key] = pool
+        pool._refs += 1
+        return pool
+
+
+def release_pool(pool: ConnectionPool):
+    """Give back a ``get_pool`` reference; the last one closes the pool"""
+    with _pools_lock:
+        pool._refs -= 1
+        if pool._refs > 0:
+            return
+        key = _pool_key(pool.db_path)
+        if _pools.get(key) is pool:
+            del _pools[key]
+
+    pool.close()
+
+
+def close_pool(db_path: str):
+    """Close and forget the shared pool for ``db_path``, whoever still holds it"""
+    key = _pool_key(db_path)
+
+    with _pools_lock:
+        pool = _pools.pop(key, None)
+
+    if pool is not None:
+        pool.close()
@@ -0,0 +1,122 @@
+import json
+import threading
+import time
+from typing import Callable, Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Tuple
+
+# system_config key bumped by the feature_flags triggers on every change
+FEATURE_FLAGS_VERSION_KEY = 'feature_flags_version'
+
+
+class CompiledFlag(NamedTuple):
+    name: str
+    is_enabled: bool
+    enabled_for_all: bool
+    role_ids: FrozenSet[int]
+    user_ids: FrozenSet[int]
+
+
+def _id_set(value) -> FrozenSet[int]:
+    if not value:
+        return frozenset()
+    return frozenset(json.loads(value))
+
+
+def compile_flag(row: Tuple) -> CompiledFlag:
+    """Compile a (feature_name, is_enabled, enabled_for_all, enabled_for_roles, enabled_for_users) row"""
+    name, is_enabled, enabled_for_all, enabled_for_roles, enabled_for_users = row
+    return CompiledFlag(name, bool(is_enabled), bool(enabled_for_all),
+                        _id_set(enabled_for_roles), _id_set(enabled_for_users))
+
+
+class FeatureFlagEngine:
+    """In-memory feature flag evaluator
+
+    All flags are loaded at once and compiled into sets of user and role
+    ids, so evaluation never touches the database. At most once every
+    ``poll_interval`` seconds a check reads the flag version through
+    ``version_func`` and reloads everything through ``load_func`` if it
+    changed (or if no version is available). ``role_resolver`` maps a user
+    id to role ids and is only called for flags restricted to roles.
+    """
+
+    def __init__(self, load_func: Callable[[], Iterable[Tuple]],
+                 version_func: Callable[[], Optional[str]],
+                 role_resolver: Callable[[int], FrozenSet[int]],
+                 poll_interval: float = 5.0):
+        self.load_func = load_func
+        self.version_func = version_func
+        self.role_resolver = role_resolver
+        self.poll_interval = poll_interval
+        self._flags: Dict[str, CompiledFlag] = {}
+        self._version = None
+        self._loaded = False
+        self._next_poll = 0.0
+        self._lock = threading.Lock()
+        self._polls = 0
+        self._reloads = 0
+        self._evaluations = 0
+
+    def refresh(self, force: bool = False):
+        """Reload flags if the poll interval elapsed and the version changed"""
+        if not force and time.monotonic() < self._next_poll:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            if not force and now < self._next_poll:
+                return
+            self._next_poll = now + self.poll_interval
+            self._polls += 1
+
+            version = self.version_func()
+            if self._loaded and not force and version is not None and version == self._version:
+                return
+
+            self._flags = {flag.name: flag for flag in map(compile_flag, self.load_func())}
+            self._version = version
+            self._loaded = True
+            self._reloads += 1
+
+    def invalidate(self):
+        """Reload on the next evaluation (after a local change)"""
+        self._next_poll = 0.0
+        self._loaded = False
+
+    def _evaluate(self, flag: CompiledFlag, user_id: Optional[int], roles: List) -> bool:
+        if not flag.is_enabled:
+            return False
+        if flag.enabled_for_all:
+            return True
+        if not user_id:
+            return False
+        if user_id in flag.user_ids:
+            return True
+        if flag.role_ids:
+            if not roles:
+                roles.append(self.role_resolver(user_id))
+            return not flag.role_ids.isdisjoint(roles[0])
+        return False
+
+    def is_enabled(self, feature_name: str, user_id: int = None) -> bool:
+        self.refresh()
+        self._evaluations += 1
+        flag = self._flags.get(feature_name)
+        return flag is not None and self._evaluate(flag, user_id, [])
+
+    def enabled_features(self, user_id: int = None) -> List[str]:
+        """Names of every flag enabled for ``user_id``, resolving roles at most once"""
+        self.refresh()
+        self._evaluations += 1
+        flags = self._flags
+        roles = []
+        return sorted(name for name, flag in flags.items() if self._evaluate(flag, user_id, roles))
+
+    def stats(self) -> Dict:
+        return {
+            'flags': len(self._flags),
+            'version': self._version,
+            'poll_interval_seconds': self.poll_interval,
+            'polls': self._polls,
+            'reloads': self._reloads,
+            'evaluations': self._evaluations
+        }
@@ -0,0 +1,454 @@
+import math
+import threading
+from collections import OrderedDict, deque
+from typing import Callable, Dict, List, NamedTuple, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Indicator values are NaN until enough bars have been seen (the warm-up),
+# in both the batch functions and the incremental classes.
+
+
+def _ewm(values: np.ndarray, alpha: float, start: int) -> np.ndarray:
+    """y[start] = values[start], then y[i] = y[i-1] + alpha * (values[i] - y[i-1]); NaN before start
+
+    The recurrence is solved in closed form over blocks short enough that
+    the (1 - alpha) ** -j scaling stays below 1e8, so each block is a
+    handful of NumPy operations.
+    """
+    n = len(values)
+    out = np.full(n, np.nan)
+    if start >= n:
+        return out
+
+    decay = 1.0 - alpha
+    if decay <= 0.0:
+        out[start:] = values[start:]
+        return out
+
+    block = 1 + int(8 * math.log(10) / -math.log(decay))
+    powers = decay ** np.arange(block)
+    previous = values[start]
+    out[start] = previous
+    i = start + 1
+    while i < n:
+        chunk = values[i:i + block]
+        scale = powers[:len(chunk)]
+        smoothed = decay * scale * previous + alpha * scale * np.cumsum(chunk / scale)
+        out[i:i + len(chunk)] = smoothed
+        previous = smoothed[-1]
+        i += len(chunk)
+    return out
+
+
+def _wilder(values: np.ndarray, period: int, first: int) -> np.ndarray:
+    """Wilder smoothing seeded with the mean of values[first:first + period]"""
+    seed_at = first + period - 1
+    if seed_at >= len(values):
+        return np.full(len(values), np.nan)
+    seeded = values.astype(float, copy=True)
+    seeded[seed_at] = values[first:first + period].mean()
+    return _ewm(seeded, 1.0 / period, seed_at)
+
+
+# ==================== BATCH ====================
+
+def sma(close: np.ndarray, period: int = 20) -> np.ndarray:
+    close = np.asarray(close, dtype=float)
+    out = np.full(len(close), np.nan)
+    if len(close) >= period:
+        sums = np.cumsum(np.concatenate(([0.0], close)))
+        out[period - 1:] = (sums[period:] - sums[:-period]) / period
+    return out
+
+
+def ema(close: np.ndarray, period: int = 20) -> np.ndarray:
+    """EMA with alpha = 2 / (period + 1), seeded with the SMA of the first ``period`` closes"""
+    close = np.asarray(close, dtype=float)
+    if len(close) < period:
+        return np.full(len(close), np.nan)
+    seeded = close.copy()
+    seeded[period - 1] = close[:period].mean()
+    return _ewm(seeded, 2.0 / (period + 1), period - 1)
+
+
+def rsi(close: np.ndarray, period: int = 14) -> np.ndarray:
+    """Wilder's RSI; 100 when there were no losses, 50 when the price did not move"""
+    close = np.asarray(close, dtype=float)
+    delta = np.diff(close, prepend=np.nan)
+    average_gain = _wilder(np.where(delta > 0, delta, 0.0), period, 1)
+    average_loss = _wilder(np.where(delta < 0, -delta, 0.0), period, 1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        value = 100.0 - 100.0 / (1.0 + average_gain / average_loss)
+    value = np.where(average_loss == 0, np.where(average_gain == 0, 50.0, 100.0), value)
+    value[np.isnan(average_gain)] = np.nan
+    return value
+
+
+def macd(close: np.ndarray, fast: int = 12, slow: int = 26, signal: int = 9) -> Tuple[np.ndarray, ...]:
+    """MACD line, signal line (EMA of the line) and histogram"""
+    close = np.asarray(close, dtype=float)
+    line = ema(close, fast) - ema(close, slow)
+    signal_line = np.full(len(close), np.nan)
+    if len(close) >= slow:
+        signal_line[slow - 1:] = ema(line[slow - 1:], signal)
+    return line, signal_line, line - signal_line
+
+
+def bollinger_bands(close: np.ndarray, period: int = 20, num_std: float = 2.0) -> Tuple[np.ndarray, ...]:
+    """Middle (SMA), upper and lower bands at ``num_std`` population standard deviations"""
+    close = np.asarray(close, dtype=float)
+    middle = sma(close, period)
+    deviation = np.full(len(close), np.nan)
+    if len(close) >= period:
+        deviation[period - 1:] = sliding_window_view(close, period).std(axis=1)
+    return middle, middle + num_std * deviation, middle - num_std * deviation
+
+
+def true_range(high: np.ndarray, low: np.ndarray, close: np.ndarray) -> np.ndarray:
+    high, low, close = (np.asarray(values, dtype=float) for values in (high, low, close))
+    previous = np.concatenate(([np.nan], close[:-1]))
+    return np.fmax(high - low, np.fmax(np.abs(high - previous), np.abs(low - previous)))
+
+
+def atr(high: np.ndarray, low: np.ndarray, close: np.ndarray, period: int = 14) -> np.ndarray:
+    """Wilder's average true range; the first bar's true range is high - low"""
+    return _wilder(true_range(high, low, close), period, 0)
+
+
+def vwap(high: np.ndarray, low: np.ndarray, close: np.ndarray, volume: np.ndarray) -> np.ndarray:
+    """Cumulative volume-weighted typical price from the first bar"""
+    high, low, close, volume = (np.asarray(values, dtype=float) for values in (high, low, close, volume))
+    cumulative_volume = np.cumsum(volume)
+    cumulative_value = np.cumsum((high + low + close) / 3.0 * volume)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(cumulative_volume > 0, cumulative_value / cumulative_volume, np.nan)
+
+
+# ==================== INCREMENTAL ====================
+
+class SMA:
+    """Incremental simple moving average; O(1) per bar"""
+
+    def __init__(self, period: int = 20):
+        self.period = period
+        self._window = deque()
+        self._sum = 0.0
+
+    def add(self, value: float) -> float:
+        self._window.append(value)
+        self._sum += value
+        if len(self._window) > self.period:
+            self._sum -= self._window.popleft()
+        return self._sum / self.period if len(self._window) == self.period else math.nan
+
+    def update(self, bar: Dict) -> float:
+        return self.add(bar['close'])
+
+
+class EMA:
+    """Incremental EMA, seeded like ``ema`` with the SMA of the first ``period`` values"""
+
+    def __init__(self, period: int = 20, alpha: float = None):
+        self.period = period
+        self.alpha = 2.0 / (period + 1) if alpha is None else alpha
+        self.value = math.nan
+        self._count = 0
+        self._seed = 0.0
+
+    def add(self, value: float) -> float:
+        self._count += 1
+        if self._count < self.period:
+            self._seed += value
+        elif self._count == self.period:
+            self.value = (self._seed + value) / self.period
+        else:
+            self.value += self.alpha * (value - self.value)
+        return self.value
+
+    def update(self, bar: Dict) -> float:
+        return self.add(bar['close'])
+
+
+class RSI:
+    """Incremental Wilder's RSI"""
+
+    def __init__(self, period: int = 14):
+        self.period = period
+        self._previous = None
+        self._gain = EMA(period, alpha=1.0 / period)
+        self._loss = EMA(period, alpha=1.0 / period)
+
+    def update(self, bar: Dict) -> float:
+        close = bar['close']
+        previous, self._previous = self._previous, close
+        if previous is None:
+            return math.nan
+
+        delta = close - previous
+        gain = self._gain.add(delta if delta > 0 else 0.0)
+        loss = self._loss.add(-delta if delta < 0 else 0.0)
+        if math.isnan(gain):
+            return math.nan
+        if loss == 0:
+            return 50.0 if gain == 0 else 100.0
+        return 100.0 - 100.0 / (1.0 + gain / loss)
+
+
+class MACD:
+    """Incremental MACD line, signal line and histogram"""
+
+    def __init__(self, fast: int = 12, slow: int = 26, signal: int = 9):
+        self._fast = EMA(fast)
+        self._slow = EMA(slow)
+        self._signal = EMA(signal)
+
+    def update(self, bar: Dict) -> Tuple[float, float, float]:
+        line = self._fast.update(bar) - self._slow.update(bar)
+        if math.isnan(line):
+            return math.nan, math.nan, math.nan
+        signal = self._signal.add(line)
+        return line, signal, line - signal
+
+
+class BollingerBands:
+    """Incremental Bollinger Bands from a running sum and sum of squares"""
+
+    def __init__(self, period: int = 20, num_std: float = 2.0):
+        self.period = period
+        self.num_std = num_std
+        self._window = deque()
+        self._sum = 0.0
+        self._sum_squares = 0.0
+
+    def update(self, bar: Dict) -> Tuple[float, float, float]:
+        value = bar['close']
+        self._window.append(value)
+        self._sum += value
+        self._sum_squares += value * value
+        if len(self._window) > self.period:
+            dropped = self._window.popleft()
+            self._sum -= dropped
+            self._sum_squares -= dropped * dropped
+        if len(self._window) < self.period:
+            return math.nan, math.nan, math.nan
+
+        middle = self._sum / self.period
+        deviation = math.sqrt(max(self._sum_squares / self.period - middle * middle, 0.0))
+        return middle, middle + self.num_std * deviation, middle - self.num_std * deviation
+
+
+class ATR:
+    """Incremental Wilder's average true range"""
+
+    def __init__(self, period: int = 14):
+        self.period = period
+        self._previous = None
+        self._average = EMA(period, alpha=1.0 / period)
+
+    def update(self, bar: Dict) -> float:
+        high, low = bar['high'], bar['low']
+        if self._previous is None:
+            value = high - low
+        else:
+            value = max(high - low, abs(high - self._previous), abs(low - self._previous))
+        self._previous = bar['close']
+        return self._average.add(value)
+
+
+class VWAP:
+    """Incremental cumulative VWAP"""
+
+    def __init__(self):
+        self._value = 0.0
+        self._volume = 0.0
+
+    def update(self, bar: Dict) -> float:
+        volume = bar['volume']
+        self._value += (bar['high'] + bar['low'] + bar['close']) / 3.0 * volume
+        self._volume += volume
+        return self._value / self._volume if self._volume > 0 else math.nan
+
+
+class IndicatorSpec(NamedTuple):
+    batch: Callable
+    incremental: type
+    inputs: Tuple[str, ...]
+    outputs: Tuple[str, ...]
+    defaults: Dict
+
+
+INDICATORS: Dict[str, IndicatorSpec] = {
+    'sma': IndicatorSpec(sma, SMA, ('close',), ('sma',), {'period': 20}),
+    'ema': IndicatorSpec(ema, EMA, ('close',), ('ema',), {'period': 20}),
+    'rsi': IndicatorSpec(rsi, RSI, ('close',), ('rsi',), {'period': 14}),
+    'macd': IndicatorSpec(macd, MACD, ('close',), ('macd', 'signal', 'histogram'),
+                          {'fast': 12, 'slow': 26, 'signal': 9}),
+    'bollinger': IndicatorSpec(bollinger_bands, BollingerBands, ('close',), ('middle', 'upper', 'lower'),
+                               {'period': 20, 'num_std': 2.0}),
+    'atr': IndicatorSpec(atr, ATR, ('high', 'low', 'close'), ('atr',), {'period': 14}),
+    'vwap': IndicatorSpec(vwap, VWAP, ('high', 'low', 'close', 'volume'), ('vwap',), {})
+}
+
+
+def resolve_indicator(name: str, params: Dict) -> Tuple[IndicatorSpec, Dict]:
+    """Look up an indicator and merge ``params`` over its defaults"""
+    spec = INDICATORS.get(name)
+    if spec is None:
+        raise ValueError(f"Unknown indicator '{name}' (expected one of {', '.join(INDICATORS)})")
+    unknown = set(params) - set(spec.defaults)
+    if unknown:
+        raise ValueError(f"Unknown parameters for {name}: {', '.join(sorted(unknown))}")
+    return spec, {**spec.defaults, **params}
+
+
+def compute_indicator(name: str, columns: Dict[str, np.ndarray], **params) -> Dict[str, np.ndarray]:
+    """Batch-compute an indicator over OHLCV arrays (oldest first); returns one array per output"""
+    spec, params = resolve_indicator(name, params)
+    result = spec.batch(*(columns[column] for column in spec.inputs), **params)
+    if len(spec.outputs) == 1:
+        result = (result,)
+    return dict(zip(spec.outputs, result))
+
+
+def _warmup(params: Dict) -> int:
+    # EMA-based indicators need a few periods of history to converge
+    periods = [value for key, value in params.items() if key in ('period', 'fast', 'slow', 'signal')]
+    return 4 * sum(periods)
+
+
+class _Series:
+    __slots__ = ('state', 'timestamps', 'outputs', 'last_timestamp', 'seen_at_last')
+
+    def __init__(self, state, outputs: Tuple[str, ...], capacity: int):
+        self.state = state
+        self.timestamps = deque(maxlen=capacity)
+        self.outputs = {output: deque(maxlen=capacity) for output in outputs}
+        self.last_timestamp = None
+        self.seen_at_last = 0
+
+    def add(self, bar: Dict):
+        value = self.state.update(bar)
+        values = value if isinstance(value, tuple) else (value,)
+        for series, item in zip(self.outputs.values(), values):
+            series.append(item)
+
+        timestamp = bar.get('timestamp')
+        self.timestamps.append(timestamp)
+        if timestamp is not None and timestamp == self.last_timestamp:
+            self.seen_at_last += 1
+        else:
+            self.last_timestamp, self.seen_at_last = timestamp, 1
+
+
+class IndicatorEngine:
+    """Indicator series per (symbol, indicator, params), kept current bar by bar
+
+    The first request for a key replays the newest ``capacity`` bars (plus a
+    warm-up) through the incremental indicator. After that, bars pushed
+    with ``update`` or found newer in price history on the next ``get`` are
+    applied in O(1) each, and the last ``capacity`` values are kept in
+    memory. At most ``max_entries`` series are kept (LRU).
+    """
+
+    def __init__(self, db, capacity: int = 500, max_entries: int = 1000):
+        self.db = db
+        self.capacity = capacity
+        self.max_entries = max_entries
+
+        self._series: 'OrderedDict[Tuple, _Series]' = OrderedDict()
+        self._by_symbol: Dict[str, set] = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._bars_applied = 0
+
+    def get(self, symbol: str, name: str, limit: int = 100, refresh: bool = True, **params) -> Dict:
+        """Newest ``limit`` values (oldest first) of one indicator; ``refresh`` pulls newer stored bars"""
+        spec, params = resolve_indicator(name, params)
+        key = (symbol, name, tuple(sorted(params.items())))
+
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                self._misses += 1
+                series = self._load(symbol, spec, params)
+                self._store(key, series)
+            else:
+                self._hits += 1
+                self._series.move_to_end(key)
+                if refresh:
+                    self._catch_up(symbol, series)
+
+            limit = min(limit, len(series.timestamps))
+            return {
+                'symbol': symbol,
+                'indicator': name,
+                'params': params,
+                'timestamps': list(series.timestamps)[-limit:] if limit else [],
+                **{output: list(values)[-limit:] if limit else [] for output, values in series.outputs.items()}
+            }
+
+    def update(self, symbol: str, bars: List[Dict]):
+        """Apply new bars (oldest first, with timestamps) to every cached series of ``symbol``"""
+        with self._lock:
+            for key in self._by_symbol.get(symbol, ()):
+                series = self._series[key]
+                for bar in bars:
+                    series.add(bar)
+                self._bars_applied += len(bars)
+
+    def invalidate(self, symbol: str = None):
+        with self._lock:
+            keys = list(self._series) if symbol is None else list(self._by_symbol.get(symbol, ()))
+            for key in keys:
+                self._drop(key)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                'series': len(self._series),
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / total, 4) if total else None,
+                'bars_applied': self._bars_applied
+            }
+
+    def _load(self, symbol: str, spec: IndicatorSpec, params: Dict) -> _Series:
+        result = self.db.get_stock_history(symbol, self.capacity + _warmup(params))
+        if not result["success"]:
+            raise RuntimeError(result["message"])
+
+        series = _Series(spec.incremental(**params), spec.outputs, self.capacity)
+        for bar in reversed(result["history"]):
+            series.add(bar)
+        return series
+
+    def _catch_up(self, symbol: str, series: _Series):
+        # Rows at the last timestamp come first in (timestamp, id) order; skip the ones already applied
+        skip = series.seen_at_last
+        applied = 0
+        for bar in self.db.iter_stock_history(symbol, newest_first=False, start=series.last_timestamp):
+            if skip and bar['timestamp'] == series.last_timestamp:
+                skip -= 1
+                continue
+            series.add(bar)
+            applied += 1
+        self._bars_applied += applied
+
+    def _store(self, key: Tuple, series: _Series):
+        self._series[key] = series
+        self._by_symbol.setdefault(key[0], set()).add(key)
+        while len(self._series) > self.max_entries:
+            self._drop(next(iter(self._series)))
+
+    def _drop(self, key: Tuple):
+        self._series.pop(key, None)
+        keys = self._by_symbol.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_symbol[key[0]]
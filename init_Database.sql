@@ -83,6 +83,81 @@ CREATE TABLE IF NOT EXISTS stock_price_history (
     timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Create 1m OHLCV bar rollup table (maintained by bar_rollup.BarRollup)
+CREATE TABLE IF NOT EXISTS stock_bars_1m (
+    symbol TEXT NOT NULL,
+    bucket_start TIMESTAMP NOT NULL,
+    open_price REAL NOT NULL,
+    high_price REAL NOT NULL,
+    low_price REAL NOT NULL,
+    close_price REAL NOT NULL,
+    volume INTEGER NOT NULL,
+    tick_count INTEGER NOT NULL,
+    first_epoch INTEGER NOT NULL,
+    first_tick_id INTEGER NOT NULL,
+    last_epoch INTEGER NOT NULL,
+    last_tick_id INTEGER NOT NULL,
+    PRIMARY KEY (symbol, bucket_start)
+) WITHOUT ROWID;
+
+-- Create 5m OHLCV bar rollup table (maintained by bar_rollup.BarRollup)
+CREATE TABLE IF NOT EXISTS stock_bars_5m (
+    symbol TEXT NOT NULL,
+    bucket_start TIMESTAMP NOT NULL,
+    open_price REAL NOT NULL,
+    high_price REAL NOT NULL,
+    low_price REAL NOT NULL,
+    close_price REAL NOT NULL,
+    volume INTEGER NOT NULL,
+    tick_count INTEGER NOT NULL,
+    first_epoch INTEGER NOT NULL,
+    first_tick_id INTEGER NOT NULL,
+    last_epoch INTEGER NOT NULL,
+    last_tick_id INTEGER NOT NULL,
+    PRIMARY KEY (symbol, bucket_start)
+) WITHOUT ROWID;
+
+-- Create 1h OHLCV bar rollup table (maintained by bar_rollup.BarRollup)
+CREATE TABLE IF NOT EXISTS stock_bars_1h (
+    symbol TEXT NOT NULL,
+    bucket_start TIMESTAMP NOT NULL,
+    open_price REAL NOT NULL,
+    high_price REAL NOT NULL,
+    low_price REAL NOT NULL,
+    close_price REAL NOT NULL,
+    volume INTEGER NOT NULL,
+    tick_count INTEGER NOT NULL,
+    first_epoch INTEGER NOT NULL,
+    first_tick_id INTEGER NOT NULL,
+    last_epoch INTEGER NOT NULL,
+    last_tick_id INTEGER NOT NULL,
+    PRIMARY KEY (symbol, bucket_start)
+) WITHOUT ROWID;
+
+-- Create 1d OHLCV bar rollup table (maintained by bar_rollup.BarRollup)
+CREATE TABLE IF NOT EXISTS stock_bars_1d (
+    symbol TEXT NOT NULL,
+    bucket_start TIMESTAMP NOT NULL,
+    open_price REAL NOT NULL,
+    high_price REAL NOT NULL,
+    low_price REAL NOT NULL,
+    close_price REAL NOT NULL,
+    volume INTEGER NOT NULL,
+    tick_count INTEGER NOT NULL,
+    first_epoch INTEGER NOT NULL,
+    first_tick_id INTEGER NOT NULL,
+    last_epoch INTEGER NOT NULL,
+    last_tick_id INTEGER NOT NULL,
+    PRIMARY KEY (symbol, bucket_start)
+) WITHOUT ROWID;
+
+-- Create bar rollup watermark table (last stock_price_history id folded into the bars)
+CREATE TABLE IF NOT EXISTS stock_bar_rollup_state (
+    name TEXT PRIMARY KEY,
+    last_tick_id INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
 -- Insert demo user
 INSERT OR IGNORE INTO users (username, email, password_hash, first_name, last_name) VALUES 
 ('demo', 'demo@example.com', '5e884898da28047151d0e56f8dc6292773603d0d6aabbdd62a11ef721d1542d8', 'Demo', 'User');
@@ -0,0 +1,303 @@
+import functools
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from Database_for_user import TIMESTAMP_FORMAT
+from latency_stats import OTHER_ENDPOINT, LatencyHistogram, ensure_latency_schema, write_performance_rows
+
+logger = logging.getLogger(__name__)
+
+# server_performance_logs.method values for exported series
+METHOD_CALL = 'CALL'
+METHOD_SQL = 'SQL'
+# Statements EXPLAIN QUERY PLAN can describe
+_EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'WITH')
+
+
+def normalize_sql(sql: str, max_length: int = 500) -> str:
+    """Collapse whitespace so the same statement always gets the same label"""
+    text = ' '.join(sql.split())
+    return text if len(text) <= max_length else text[:max_length - 3] + '...'
+
+
+def is_full_scan(plan: List[str]) -> bool:
+    """True if a query plan reads a whole table rather than seeking an index"""
+    return any(
+        detail.startswith('SCAN ') and ' USING ' not in detail and 'CONSTANT ROW' not in detail
+        for detail in plan
+    )
+
+
+class _Series:
+    __slots__ = ('label', 'histogram', 'errors')
+
+    def __init__(self, label: str, relative_accuracy: float):
+        self.label = label
+        self.histogram = LatencyHistogram(relative_accuracy)
+        self.errors = 0
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that reports the time spent in execute/executemany to its connection's Instrumentation"""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.connection.instrumentation.record_query(self.connection, sql, parameters,
+                                                         time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self.connection.instrumentation.record_query(self.connection, sql, seq_of_parameters,
+                                                         time.perf_counter() - started, many=True)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """sqlite3 connection whose statements are timed; subclassed per Instrumentation"""
+
+    instrumentation: 'Instrumentation' = None
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    # sqlite3.Connection.execute* build a plain cursor internally, so route them through ours
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class Instrumentation:
+    """Opt-in timing of public methods and SQL statements
+
+    ``instrument`` wraps the public methods of an object (a StockDatabase
+    or ServerManager) so each call lands in a per-method latency
+    histogram; ``install`` makes a ConnectionPool open connections whose
+    statements are timed the same way. A statement slower than
+    ``slow_query_ms`` is added to the slow-query log with its parameters,
+    the method it ran under and its ``EXPLAIN QUERY PLAN`` (captured once
+    per statement text), flagging full table scans. The log is kept in
+    memory and appended as JSON lines to ``slow_query_log`` if given.
+    ``export`` writes the histograms into server_performance_logs.
+    """
+
+    def __init__(self, slow_query_ms: float = 50.0, slow_query_log: str = None, max_slow_queries: int = 1000,
+                 max_series: int = 1000, relative_accuracy: float = 0.02, explain: bool = True):
+        self.slow_query_ms = slow_query_ms
+        self.slow_query_log = slow_query_log
+        self.max_series = max_series
+        self.relative_accuracy = relative_accuracy
+        self.explain = explain
+
+        self.connection_factory = type('InstrumentedConnection', (InstrumentedConnection,),
+                                       {'instrumentation': self})
+        self._methods: Dict[str, _Series] = {}
+        self._queries: Dict[str, _Series] = {}
+        self._plans: Dict[str, List[str]] = {}
+        self._slow_queries = deque(maxlen=max_slow_queries)
+        self._lock = threading.Lock()
+        self._log_lock = threading.Lock()
+        self._local = threading.local()
+        self._since = time.time()
+        self._overflowed = 0
+        self._slow_total = 0
+        self._full_scans = 0
+
+    # ==================== Hooks ====================
+
+    def instrument(self, obj, name: str = None):
+        """Time every public method of ``obj`` as ``<name>.<method>`` (name defaults to the class name)"""
+        name = name or type(obj).__name__
+        for attribute in dir(type(obj)):
+            if attribute.startswith('_') or not callable(getattr(type(obj), attribute, None)):
+                continue
+            method = getattr(obj, attribute)
+            if getattr(method, '__instrumented__', False):
+                continue
+            setattr(obj, attribute, self._wrap(method, f'{name}.{attribute}'))
+
+    def install(self, pool):
+        """Make ``pool`` open timed connections; idle connections are replaced on next use"""
+        pool.set_connection_factory(self.connection_factory)
+
+    def uninstall(self, pool):
+        pool.set_connection_factory(sqlite3.Connection)
+
+    def _wrap(self, method, label: str):
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            stack = getattr(self._local, 'stack', None)
+            if stack is None:
+                stack = self._local.stack = []
+            stack.append(label)
+            started = time.perf_counter()
+            failed = True
+            try:
+                result = method(*args, **kwargs)
+                failed = isinstance(result, dict) and result.get('success') is False
+                return result
+            finally:
+                self._record(self._methods, label, label, time.perf_counter() - started, failed)
+                stack.pop()
+
+        timed.__instrumented__ = True
+        return timed
+
+    # ==================== Recording ====================
+
+    def record_query(self, conn, sql: str, parameters, seconds: float, many: bool = False):
+        self._record(self._queries, sql, None, seconds, False)
+        if seconds * 1000 >= self.slow_query_ms:
+            try:
+                self._log_slow_query(conn, sql, parameters, seconds, many)
+            except Exception as e:
+                logger.error(f"Could not log slow query: {str(e)}")
+
+    def _record(self, series_map: Dict[str, _Series], key: str, label: Optional[str], seconds: float,
+                failed: bool):
+        with self._lock:
+            series = series_map.get(key)
+            if series is None:
+                if len(series_map) >= self.max_series:
+                    key = label = OTHER_ENDPOINT
+                    self._overflowed += 1
+                    series = series_map.get(key)
+                if series is None:
+                    series = series_map[key] = _Series(label or normalize_sql(key), self.relative_accuracy)
+            series.histogram.add(seconds * 1000)
+            series.errors += failed
+
+    def _log_slow_query(self, conn, sql: str, parameters, seconds: float, many: bool):
+        stack = getattr(self._local, 'stack', None)
+        plan = self._query_plan(conn, sql, parameters, many)
+        entry = {
+            'timestamp': datetime.now(timezone.utc).strftime(TIMESTAMP_FORMAT),
+            'duration_ms': round(seconds * 1000, 3),
+            'sql': normalize_sql(sql, 2000),
+            'parameters': self._describe_parameters(parameters, many),
+            'method': stack[-1] if stack else None,
+            'plan': plan,
+            'full_scan': is_full_scan(plan or [])
+        }
+
+        with self._lock:
+            self._slow_queries.append(entry)
+            self._slow_total += 1
+            self._full_scans += entry['full_scan']
+
+        logger.warning(f"Slow query ({entry['duration_ms']} ms{', full scan' if entry['full_scan'] else ''})"
+                       f" in {entry['method']}: {entry['sql'][:200]}")
+        if self.slow_query_log:
+            with self._log_lock, open(self.slow_query_log, 'a') as log:
+                log.write(json.dumps(entry, default=repr) + '\n')
+
+    def _query_plan(self, conn, sql: str, parameters, many: bool) -> Optional[List[str]]:
+        if not self.explain or not sql.lstrip().upper().startswith(_EXPLAINABLE):
+            return None
+
+        plan = self._plans.get(sql)
+        if plan is None:
+            if many:
+                # A generator of parameter sets has already been consumed
+                if not isinstance(parameters, (list, tuple)) or not parameters:
+                    return None
+                parameters = parameters[0]
+            # Plain sqlite3 cursor, so the EXPLAIN itself is not timed or logged
+            rows = sqlite3.Connection.execute(conn, f'EXPLAIN QUERY PLAN {sql}', parameters).fetchall()
+            plan = self._plans[sql] = [row[-1] for row in rows]
+        return plan
+
+    @staticmethod
+    def _describe_parameters(parameters, many: bool):
+        if many:
+            if isinstance(parameters, (list, tuple)):
+                return {'rows': len(parameters), 'first': list(parameters[0]) if parameters else None}
+            return {'rows': None}
+        if isinstance(parameters, dict):
+            return parameters
+        return list(parameters)
+
+    # ==================== Reporting ====================
+
+    def method_summary(self) -> List[Dict]:
+        """Per-method call counts, errors and latency percentiles, slowest total time first"""
+        return self._summary(self._methods)
+
+    def query_summary(self) -> List[Dict]:
+        """Per-statement counts and latency percentiles, slowest total time first"""
+        return self._summary(self._queries)
+
+    def slow_queries(self, limit: int = None) -> List[Dict]:
+        """Newest entries of the slow-query log, newest first"""
+        with self._lock:
+            entries = list(reversed(self._slow_queries))
+        return entries[:limit] if limit else entries
+
+    def _summary(self, series_map: Dict[str, _Series]) -> List[Dict]:
+        with self._lock:
+            rows = [
+                {
+                    'name': series.label,
+                    'count': series.histogram.count,
+                    'errors': series.errors,
+                    'total_ms': series.histogram.total,
+                    'mean_ms': series.histogram.mean,
+                    'p50_ms': series.histogram.quantile(0.5),
+                    'p95_ms': series.histogram.quantile(0.95),
+                    'p99_ms': series.histogram.quantile(0.99),
+                    'max_ms': series.histogram.max
+                }
+                for series in series_map.values()
+            ]
+        return sorted(rows, key=lambda row: row['total_ms'], reverse=True)
+
+    def export(self, conn, reset: bool = True) -> int:
+        """Insert the method and statement histograms into server_performance_logs
+
+        Methods are stored with method 'CALL' and statements with 'SQL'
+        under their normalized text, as one window starting at the last
+        export. With ``reset`` the histograms start over so windows never
+        overlap. Commits and returns the number of rows written.
+        """
+        with self._lock:
+            started, now = self._since, time.time()
+            rows = [
+                (datetime.fromtimestamp(started, tz=timezone.utc).strftime(TIMESTAMP_FORMAT),
+                 series.label[:255] if method == METHOD_SQL else series.label, method,
+                 series.histogram, series.errors)
+                for method, series_map in ((METHOD_CALL, self._methods), (METHOD_SQL, self._queries))
+                for series in series_map.values()
+            ]
+            if reset:
+                self._methods, self._queries, self._since = {}, {}, now
+
+        ensure_latency_schema(conn)
+        write_performance_rows(conn, rows, max(1, round(now - started)))
+        conn.commit()
+        return len(rows)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'since': datetime.fromtimestamp(self._since, tz=timezone.utc).strftime(TIMESTAMP_FORMAT),
+                'methods': len(self._methods),
+                'statements': len(self._queries),
+                'method_calls': sum(series.histogram.count for series in self._methods.values()),
+                'statements_executed': sum(series.histogram.count for series in self._queries.values()),
+                'slow_queries': self._slow_total,
+                'full_scans': self._full_scans,
+                'overflowed': self._overflowed,
+                'plans_cached': len(self._plans)
+            }
@@ -0,0 +1,259 @@
+import json
+import logging
+import math
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+from Database_for_user import TIMESTAMP_FORMAT
+
+logger = logging.getLogger(__name__)
+
+# Series beyond max_series are folded into this endpoint so memory stays bounded
+OTHER_ENDPOINT = '__other__'
+
+
+class LatencyHistogram:
+    """Mergeable log-bucketed histogram of latencies in milliseconds
+
+    Bucket ``i`` covers ``(gamma**(i-1), gamma**i]`` with
+    ``gamma = (1 + a) / (1 - a)``, so every quantile is within the relative
+    accuracy ``a`` of the true value. Only occupied buckets are stored;
+    latencies from 1µs to an hour need under 600 buckets at 2%.
+    Histograms with the same accuracy merge by adding bucket counts.
+    """
+
+    __slots__ = ('relative_accuracy', '_log_gamma', 'buckets', 'zeros', 'count', 'total', 'min', 'max')
+
+    def __init__(self, relative_accuracy: float = 0.02):
+        self.relative_accuracy = relative_accuracy
+        self._log_gamma = math.log((1 + relative_accuracy) / (1 - relative_accuracy))
+        self.buckets: Dict[int, int] = {}
+        self.zeros = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value: float, count: int = 1):
+        if value <= 0:
+            self.zeros += count
+        else:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.buckets[index] = self.buckets.get(index, 0) + count
+
+        self.count += count
+        self.total += value * count
+        self.min = value if self.min is None or value < self.min else self.min
+        self.max = value if self.max is None or value > self.max else self.max
+
+    def merge(self, other: 'LatencyHistogram'):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge histograms with different accuracy")
+
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zeros += other.zeros
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimated q-quantile (0 <= q <= 1), clamped to the observed min/max"""
+        if self.count == 0:
+            return None
+
+        rank = q * (self.count - 1)
+        if rank < self.zeros:
+            return 0.0
+
+        seen = self.zeros
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                # Midpoint of the bucket in relative terms
+                value = 2 * math.exp(index * self._log_gamma) / (1 + math.exp(self._log_gamma))
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.total / self.count if self.count else None
+
+    def to_json(self) -> str:
+        return json.dumps({
+            'a': self.relative_accuracy,
+            'z': self.zeros,
+            'n': self.count,
+            's': self.total,
+            'min': self.min,
+            'max': self.max,
+            'b': sorted(self.buckets.items())
+        }, separators=(',', ':'))
+
+    @classmethod
+    def from_json(cls, text: str) -> 'LatencyHistogram':
+        data = json.loads(text)
+        histogram = cls(data['a'])
+        histogram.buckets = {int(index): count for index, count in data['b']}
+        histogram.zeros = data['z']
+        histogram.count = data['n']
+        histogram.total = data['s']
+        histogram.min = data['min']
+        histogram.max = data['max']
+        return histogram
+
+
+class _Series:
+    __slots__ = ('histogram', 'errors')
+
+    def __init__(self, relative_accuracy: float):
+        self.histogram = LatencyHistogram(relative_accuracy)
+        self.errors = 0
+
+
+class LatencyAggregator:
+    """Per-endpoint/method latency histograms, flushed in fixed time windows
+
+    ``record`` is cheap and thread-safe. A background thread hands every
+    closed window to ``flush_func`` as a list of
+    ``(window_start, endpoint, method, histogram, error_count)`` tuples
+    every ``flush_interval`` seconds; ``close`` flushes the open window too.
+    At most ``max_series`` endpoint/method pairs are tracked per window;
+    the rest are counted under ``OTHER_ENDPOINT``.
+    """
+
+    def __init__(self, flush_func: Callable[[List[Tuple]], object], window_seconds: int = 60,
+                 flush_interval: float = 10.0, max_series: int = 1000,
+                 relative_accuracy: float = 0.02):
+        self.flush_func = flush_func
+        self.window_seconds = window_seconds
+        self.flush_interval = flush_interval
+        self.max_series = max_series
+        self.relative_accuracy = relative_accuracy
+
+        self._windows: Dict[int, Dict[Tuple[str, str], _Series]] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._recorded = 0
+        self._overflowed = 0
+        self._rows_flushed = 0
+        self._failed = 0
+
+        self._thread = threading.Thread(target=self._run, name='latency-aggregator', daemon=True)
+        self._thread.start()
+
+    def record(self, endpoint: str, method: str, response_time_ms: float, error: bool = False):
+        window = int(time.time()) // self.window_seconds * self.window_seconds
+
+        with self._lock:
+            series_map = self._windows.get(window)
+            if series_map is None:
+                series_map = self._windows[window] = {}
+
+            key = (endpoint, method)
+            series = series_map.get(key)
+            if series is None:
+                if len(series_map) >= self.max_series:
+                    key = (OTHER_ENDPOINT, method)
+                    self._overflowed += 1
+                    series = series_map.get(key)
+                if series is None:
+                    series = series_map[key] = _Series(self.relative_accuracy)
+
+            series.histogram.add(response_time_ms)
+            if error:
+                series.errors += 1
+            self._recorded += 1
+
+    def flush(self, include_open: bool = False):
+        """Hand closed windows (and the open one if ``include_open``) to ``flush_func``"""
+        with self._flush_lock:
+            current = int(time.time()) // self.window_seconds * self.window_seconds
+            with self._lock:
+                ready = sorted(window for window in self._windows if include_open or window < current)
+                windows = [(window, self._windows.pop(window)) for window in ready]
+
+            rows = [
+                (datetime.fromtimestamp(window, tz=timezone.utc).strftime(TIMESTAMP_FORMAT),
+                 endpoint, method, series.histogram, series.errors)
+                for window, series_map in windows
+                for (endpoint, method), series in series_map.items()
+            ]
+            if not rows:
+                return
+
+            try:
+                self.flush_func(rows)
+                with self._lock:
+                    self._rows_flushed += len(rows)
+            except Exception as e:
+                logger.error(f"Latency flush of {len(rows)} rows failed: {str(e)}")
+                with self._lock:
+                    self._failed += len(rows)
+
+    def close(self):
+        """Stop the flush thread and write everything, including the open window"""
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._thread.join()
+        self.flush(include_open=True)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'recorded': self._recorded,
+                'open_windows': len(self._windows),
+                'open_series': sum(len(series_map) for series_map in self._windows.values()),
+                'overflowed': self._overflowed,
+                'rows_flushed': self._rows_flushed,
+                'rows_failed': self._failed
+            }
+
+
+# Percentile columns added to server_performance_logs by ensure_latency_schema
+_PERFORMANCE_COLUMNS = (
+    ('p50_ms', 'REAL'),
+    ('p95_ms', 'REAL'),
+    ('p99_ms', 'REAL'),
+    ('window_seconds', 'INTEGER'),
+    ('histogram', 'TEXT')
+)
+
+
+def ensure_latency_schema(conn):
+    """Add the percentile columns and trend index to server_performance_logs"""
+    existing = {row[1] for row in conn.execute('PRAGMA table_info(server_performance_logs)')}
+    for column, column_type in _PERFORMANCE_COLUMNS:
+        if column not in existing:
+            conn.execute(f'ALTER TABLE server_performance_logs ADD COLUMN {column} {column_type}')
+
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_performance_logs_endpoint_timestamp
+        ON server_performance_logs(endpoint, method, timestamp)
+    ''')
+    conn.commit()
+
+
+def write_performance_rows(conn, rows: List[Tuple], window_seconds: int):
+    """Insert aggregator rows into server_performance_logs in the caller's transaction"""
+    conn.executemany('''
+        INSERT INTO server_performance_logs
+        (endpoint, method, avg_response_time_ms, min_response_time_ms, max_response_time_ms,
+         request_count, error_count, p50_ms, p95_ms, p99_ms, window_seconds, histogram, timestamp)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [
+        (endpoint, method, histogram.mean, histogram.min, histogram.max, histogram.count, errors,
+         histogram.quantile(0.5), histogram.quantile(0.95), histogram.quantile(0.99),
+         window_seconds, histogram.to_json(), window_start)
+        for window_start, endpoint, method, histogram, errors in rows
+    ])
@@ -0,0 +1,210 @@
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+from Database_for_user import TIMESTAMP_FORMAT
+
+logger = logging.getLogger(__name__)
+
+# (table, extra condition) pairs swept by ServerManager.cleanup_old_logs;
+# error logs are kept until they are resolved
+RETENTION_TABLES: Tuple[Tuple[str, Optional[str]], ...] = (
+    ('server_access_logs', None),
+    ('server_error_logs', 'resolved = 1'),
+    ('user_activity_logs', None)
+)
+
+
+class LogRetention:
+    """Batched log deletion with optional archival to gzip JSON lines
+
+    Each table is swept in ascending rowid order, ``batch_size`` rows per
+    short write transaction that only covers the delete. Between batches
+    the sweep sleeps for ``pause`` seconds or as long as it held the lock,
+    whichever is longer, so other writers are never starved. With
+    ``archive_dir`` set, a batch's rows are appended to
+    ``<archive_dir>/<table>/<YYYY-MM-DD>.jsonl.gz`` (by the row's own
+    timestamp) and flushed to disk before the delete commits, so a crash
+    can duplicate archived rows but never lose them.
+    """
+
+    def __init__(self, pool, archive_dir: str = None, batch_size: int = 5000, pause: float = 0.01):
+        self.pool = pool
+        self.archive_dir = archive_dir
+        self.batch_size = batch_size
+        self.pause = pause
+
+        self._lock = threading.Lock()
+        self._status: Dict = {'running': False, 'last_run': None}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def run(self, days_to_keep: int = 30, tables=RETENTION_TABLES,
+            progress: Callable[[str, int], None] = None) -> Dict:
+        """Delete (and archive) rows older than ``days_to_keep`` days"""
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=days_to_keep)).strftime(TIMESTAMP_FORMAT)
+        started = time.perf_counter()
+        report = {'cutoff': cutoff, 'tables': {}}
+
+        with self._lock:
+            self._status = {'running': True, 'started_at': datetime.now(timezone.utc).strftime(TIMESTAMP_FORMAT),
+                            'cutoff': cutoff, 'current_table': None,
+                            'rows_deleted': 0, 'last_run': self._status.get('last_run')}
+        try:
+            for table, condition in tables:
+                self._status['current_table'] = table
+                report['tables'][table] = self._sweep(table, condition, cutoff, progress)
+        finally:
+            elapsed = time.perf_counter() - started
+            deleted = sum(result['deleted'] for result in report['tables'].values())
+            report.update({
+                'rows_deleted': deleted,
+                'elapsed_seconds': round(elapsed, 3),
+                'rows_per_second': round(deleted / elapsed, 1) if elapsed else None
+            })
+            with self._lock:
+                self._status = {'running': False, 'last_run': report}
+
+        return report
+
+    def _sweep(self, table: str, condition: Optional[str], cutoff: str,
+               progress: Optional[Callable[[str, int], None]]) -> Dict:
+        predicate = 'timestamp < ?' + (f' AND {condition}' if condition else '')
+        select_columns = '*' if self.archive_dir else 'NULL'
+        last_rowid = 0
+        deleted = archived = batches = 0
+        started = time.perf_counter()
+
+        while not self._stop.is_set():
+            with self.pool.connection() as conn:
+                # Read and archive outside the write lock; only the delete holds it
+                cursor = conn.execute(f'''
+                    SELECT rowid, {select_columns} FROM {table}
+                    WHERE rowid > ? AND {predicate}
+                    ORDER BY rowid LIMIT ?
+                ''', (last_rowid, cutoff, self.batch_size))
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+
+                offsets = {}
+                if self.archive_dir:
+                    columns = [column[0] for column in cursor.description[1:]]
+                    offsets = self._archive(table, columns, rows)
+
+                bounds = (rows[0][0], rows[-1][0], cutoff)
+                locked = time.perf_counter()
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    if self.archive_dir:
+                        matching = conn.execute(f'''
+                            SELECT COUNT(*) FROM {table} WHERE rowid BETWEEN ? AND ? AND {predicate}
+                        ''', bounds).fetchone()[0]
+                        if matching != len(rows):
+                            # A row changed since it was archived; drop that copy and archive the batch again
+                            conn.rollback()
+                            self._truncate(offsets)
+                            continue
+
+                    removed = conn.execute(f'''
+                        DELETE FROM {table} WHERE rowid BETWEEN ? AND ? AND {predicate}
+                    ''', bounds).rowcount
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    self._truncate(offsets)
+                    raise
+                held = time.perf_counter() - locked
+
+            last_rowid = rows[-1][0]
+            deleted += removed
+            archived += len(rows) if self.archive_dir else 0
+            batches += 1
+            with self._lock:
+                self._status['rows_deleted'] = self._status.get('rows_deleted', 0) + removed
+            if progress is not None:
+                progress(table, deleted)
+
+            if len(rows) < self.batch_size:
+                break
+            # Give other writers at least as long as the lock was held
+            time.sleep(max(self.pause, held))
+
+        elapsed = time.perf_counter() - started
+        return {
+            'deleted': deleted,
+            'batches': batches,
+            'archived': archived,
+            'elapsed_seconds': round(elapsed, 3),
+            'rows_per_second': round(deleted / elapsed, 1) if elapsed else None
+        }
+
+    def _archive(self, table: str, columns: List[str], rows: List[Tuple]) -> Dict[str, int]:
+        timestamp_index = columns.index('timestamp')
+        partitions: Dict[str, List[str]] = {}
+        for row in rows:
+            values = row[1:]
+            day = str(values[timestamp_index])[:10]
+            partitions.setdefault(day, []).append(json.dumps(dict(zip(columns, values)), default=str))
+
+        table_dir = os.path.join(self.archive_dir, table)
+        os.makedirs(table_dir, exist_ok=True)
+        offsets = {}
+        for day, lines in partitions.items():
+            path = os.path.join(table_dir, f'{day}.jsonl.gz')
+            offsets[path] = os.path.getsize(path) if os.path.exists(path) else 0
+            # Each batch appends its own gzip member; readers see one stream
+            with open(path, 'ab') as f:
+                with gzip.GzipFile(fileobj=f, mode='wb') as archive:
+                    archive.write(('\n'.join(lines) + '\n').encode())
+                f.flush()
+                os.fsync(f.fileno())
+        return offsets
+
+    @staticmethod
+    def _truncate(offsets: Dict[str, int]):
+        # Undo an archived batch that was not deleted
+        for path, size in offsets.items():
+            if size:
+                with open(path, 'r+b') as f:
+                    f.truncate(size)
+            else:
+                os.remove(path)
+
+    def start(self, days_to_keep: int = 30, interval_seconds: float = 3600.0):
+        """Run retention in a background thread every ``interval_seconds``"""
+        if self._thread is not None and self._thread.is_alive():
+            raise RuntimeError("Log retention is already scheduled")
+
+        self._stop.clear()
+
+        def loop():
+            while not self._stop.is_set():
+                try:
+                    self.run(days_to_keep)
+                except Exception as e:
+                    logger.error(f"Scheduled log retention failed: {str(e)}")
+                self._stop.wait(interval_seconds)
+
+        self._thread = threading.Thread(target=loop, name='log-retention', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = None):
+        """Stop the background schedule after the current batch"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self._stop.clear()
+
+    def status(self) -> Dict:
+        """Progress of the running sweep and the report of the last one"""
+        with self._lock:
+            status = dict(self._status)
+        status['scheduled'] = self._thread is not None and self._thread.is_alive()
+        return status
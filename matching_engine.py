@@ -0,0 +1,555 @@
+import argparse
+import functools
+import heapq
+import itertools
+import json
+import logging
+import math
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List, NamedTuple, Optional
+
+from batch_writer import BatchWriter
+
+logger = logging.getLogger(__name__)
+
+ORDER_TYPES = ('limit', 'market', 'stop')
+SIDES = ('buy', 'sell')
+
+
+class Fill(NamedTuple):
+    symbol: str
+    price: float
+    shares: float
+    buy_order_id: int
+    sell_order_id: int
+    buyer_id: int
+    seller_id: int
+    timestamp: float
+
+
+class Order:
+    """One order; ``price`` is the limit (None for market and stop-market orders)"""
+
+    __slots__ = ('order_id', 'user_id', 'symbol', 'side', 'order_type', 'shares', 'remaining',
+                 'price', 'stop_price', 'status', 'reserved', 'created')
+
+    def __init__(self, order_id: int, user_id: int, symbol: str, side: str, order_type: str,
+                 shares: float, price: Optional[float], stop_price: Optional[float]):
+        self.order_id = order_id
+        self.user_id = user_id
+        self.symbol = symbol
+        self.side = side
+        self.order_type = order_type
+        self.shares = shares
+        self.remaining = shares
+        self.price = price
+        self.stop_price = stop_price
+        self.status = 'pending' if order_type == 'stop' else 'open'
+        self.reserved = 0.0
+        self.created = time.time()
+
+    def to_dict(self) -> Dict:
+        return {
+            'order_id': self.order_id,
+            'user_id': self.user_id,
+            'symbol': self.symbol,
+            'side': self.side,
+            'order_type': self.order_type,
+            'shares': self.shares,
+            'filled': self.shares - self.remaining,
+            'remaining': self.remaining,
+            'price': self.price,
+            'stop_price': self.stop_price,
+            'status': self.status
+        }
+
+
+class OrderBook:
+    """Limit order book for one symbol with price-time priority
+
+    Each side keeps a heap of price levels (O(log n) to add a level) and a
+    FIFO queue of orders per level. Cancelled orders are only marked and
+    are dropped when they reach the front of their level, so cancels are
+    O(1). Stop orders wait in their own heaps until the last trade price
+    reaches the stop, then enter as market orders (or as limit orders when
+    they carry a limit price).
+    """
+
+    def __init__(self, symbol: str):
+        self.symbol = symbol
+        self.last_price: Optional[float] = None
+
+        self._bids: List[float] = []  # negated prices
+        self._asks: List[float] = []
+        self._bid_levels: Dict[float, deque] = {}
+        self._ask_levels: Dict[float, deque] = {}
+        self._buy_stops: List = []  # (stop_price, seq, order)
+        self._sell_stops: List = []  # (-stop_price, seq, order)
+        self._seq = itertools.count()
+
+    def best_bid(self) -> Optional[float]:
+        return -self._bids[0] if self._peek(self._bids, self._bid_levels, -1) else None
+
+    def best_ask(self) -> Optional[float]:
+        return self._asks[0] if self._peek(self._asks, self._ask_levels, 1) else None
+
+    def depth(self, levels: int = 10) -> Dict[str, List[List[float]]]:
+        """Aggregated open shares for the best ``levels`` prices on each side"""
+        def side(level_map, reverse):
+            rows = []
+            for price in sorted(level_map, reverse=reverse):
+                shares = sum(order.remaining for order in level_map[price] if order.status == 'open')
+                if shares > 0:
+                    rows.append([price, shares])
+                    if len(rows) == levels:
+                        break
+            return rows
+
+        return {'bids': side(self._bid_levels, True), 'asks': side(self._ask_levels, False)}
+
+    def add_stop(self, order: Order):
+        if order.side == 'buy':
+            heapq.heappush(self._buy_stops, (order.stop_price, next(self._seq), order))
+        else:
+            heapq.heappush(self._sell_stops, (-order.stop_price, next(self._seq), order))
+
+    def triggered_stops(self) -> List[Order]:
+        """Pop the stop orders the last trade price has reached, in trigger order"""
+        if self.last_price is None:
+            return []
+
+        triggered = []
+        while self._buy_stops and self._buy_stops[0][0] <= self.last_price:
+            triggered.append(heapq.heappop(self._buy_stops)[1:])
+        while self._sell_stops and -self._sell_stops[0][0] >= self.last_price:
+            triggered.append(heapq.heappop(self._sell_stops)[1:])
+
+        triggered.sort(key=lambda item: item[0])
+        return [order for _, order in triggered if order.status == 'pending']
+
+    def rest(self, order: Order):
+        """Queue the unfilled part of a limit order at its price level"""
+        if order.side == 'buy':
+            heap, level_map, key = self._bids, self._bid_levels, -order.price
+        else:
+            heap, level_map, key = self._asks, self._ask_levels, order.price
+
+        level = level_map.get(order.price)
+        if level is None:
+            level = level_map[order.price] = deque()
+            heapq.heappush(heap, key)
+        level.append(order)
+
+    def match(self, order: Order, max_shares=None):
+        """Yield (resting order, price, shares) for each fill against the opposite side
+
+        ``max_shares(price)`` may cap how much of a level the taker can take;
+        matching stops when it returns 0.
+        """
+        if order.side == 'buy':
+            heap, level_map, sign = self._asks, self._ask_levels, 1
+        else:
+            heap, level_map, sign = self._bids, self._bid_levels, -1
+
+        while order.remaining > 0 and self._peek(heap, level_map, sign):
+            price = heap[0] * sign
+            if order.price is not None and (price > order.price if sign == 1 else price < order.price):
+                break
+
+            level = level_map[price]
+            resting = level[0]
+            shares = min(order.remaining, resting.remaining)
+            if max_shares is not None:
+                shares = min(shares, max_shares(price))
+                if shares <= 0:
+                    break
+
+            order.remaining -= shares
+            resting.remaining -= shares
+            if resting.remaining <= 0:
+                resting.status = 'filled'
+                level.popleft()
+            self.last_price = price
+            yield resting, price, shares
+
+    @staticmethod
+    def _peek(heap: List[float], level_map: Dict[float, deque], sign: int) -> bool:
+        # Drop cancelled/filled orders and empty levels from the top of the book
+        while heap:
+            level = level_map[heap[0] * sign]
+            while level and level[0].status != 'open':
+                level.popleft()
+            if level:
+                return True
+            del level_map[heapq.heappop(heap) * sign]
+        return False
+
+
+class _Account:
+    __slots__ = ('cash', 'shares')
+
+    def __init__(self, cash: float, shares: Dict[str, float]):
+        self.cash = cash
+        self.shares = shares
+
+
+class MatchingEngine:
+    """Order books for every symbol, with fills settled through StockDatabase
+
+    With a ``db``, each user's cash and shares are loaded from
+    ``user_balances``/``user_portfolios`` on their first order and kept in
+    memory: limit buys reserve ``shares * price`` of cash, sells reserve the
+    shares, and market buys are capped by the cash left, so a fill can
+    always settle. Fills are queued and settled in batches with
+    ``StockDatabase.execute_trades`` (a sell and a buy leg per fill).
+    Market orders never rest; whatever cannot fill is cancelled. All
+    methods are thread-safe.
+
+    ``orders`` holds only live (open or pending) orders; filled and
+    cancelled ones move to a history of the last ``history_size`` orders,
+    so ``get_order`` finds recent orders without memory growing forever.
+    """
+
+    def __init__(self, db=None, settle_batch_size: int = 1000, settle_interval: float = 0.2,
+                 history_size: int = 100000):
+        self.db = db
+        self.books: Dict[str, OrderBook] = {}
+        self.orders: Dict[int, Order] = {}
+        self.history_size = history_size
+        self._history: 'OrderedDict[int, Order]' = OrderedDict()
+
+        self._accounts: Dict[int, _Account] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.RLock()
+        self._submitted = 0
+        self._fills = 0
+        self._rejected = 0
+        self._settle_rejected = 0
+
+        self._settler = None
+        if db is not None:
+            self._settler = BatchWriter(self._settle, max_batch_size=settle_batch_size,
+                                        flush_interval=settle_interval, name='fill-settlement')
+
+    def submit_order(self, user_id: int, symbol: str, side: str, shares: float,
+                     order_type: str = 'limit', price: float = None, stop_price: float = None) -> Dict:
+        """Submit an order and match it; returns the order state and its fills
+
+        ``order_type='stop'`` needs ``stop_price`` and becomes a market order
+        (a limit order if ``price`` is given) once a trade prints at or
+        through the stop.
+        """
+        if side not in SIDES:
+            return {'success': False, 'message': f"Invalid side '{side}'"}
+        if order_type not in ORDER_TYPES:
+            return {'success': False, 'message': f"Invalid order type '{order_type}'"}
+        if not shares or shares <= 0:
+            return {'success': False, 'message': "Shares must be positive"}
+        if order_type == 'limit' and (price is None or price <= 0):
+            return {'success': False, 'message': "Limit orders need a positive price"}
+        if order_type == 'market' and price is not None:
+            return {'success': False, 'message': "Market orders take no price"}
+        if order_type == 'stop' and (stop_price is None or stop_price <= 0):
+            return {'success': False, 'message': "Stop orders need a positive stop_price"}
+
+        with self._lock:
+            self._submitted += 1
+            order = Order(next(self._ids), user_id, symbol, side, order_type, shares, price, stop_price)
+
+            message = self._reserve(order)
+            if message is not None:
+                self._rejected += 1
+                order.status = 'rejected'
+                return {'success': False, 'message': message, 'order': order.to_dict()}
+
+            self.orders[order.order_id] = order
+            book = self.books.get(symbol)
+            if book is None:
+                book = self.books[symbol] = OrderBook(symbol)
+
+            fills: List[Fill] = []
+            if order_type == 'stop':
+                book.add_stop(order)
+            else:
+                self._execute(book, order, fills)
+            self._run_stops(book, fills)
+
+            if fills:
+                self._fills += len(fills)
+                if self._settler is not None:
+                    for fill in fills:
+                        self._settler.put(fill)
+
+            return {'success': True, 'order': order.to_dict(), 'fills': [fill._asdict() for fill in fills]}
+
+    def cancel_order(self, order_id: int, user_id: int = None) -> Dict:
+        """Cancel the open part of an order (only the owner's, if ``user_id`` is given)"""
+        with self._lock:
+            order = self._find(order_id)
+            if order is None or (user_id is not None and order.user_id != user_id):
+                return {'success': False, 'message': "Order not found"}
+            if order.status not in ('open', 'pending'):
+                return {'success': False, 'message': f"Order is already {order.status}"}
+
+            order.status = 'cancelled'
+            self._release(order)
+            self._retire(order)
+            return {'success': True, 'order': order.to_dict()}
+
+    def get_order(self, order_id: int) -> Optional[Dict]:
+        with self._lock:
+            order = self._find(order_id)
+            return order.to_dict() if order is not None else None
+
+    def get_depth(self, symbol: str, levels: int = 10) -> Dict:
+        with self._lock:
+            book = self.books.get(symbol)
+            if book is None:
+                return {'bids': [], 'asks': [], 'last_price': None}
+            depth = book.depth(levels)
+            depth['last_price'] = book.last_price
+            return depth
+
+    def flush(self, timeout: float = None) -> bool:
+        """Settle every fill so far"""
+        return self._settler.flush(timeout) if self._settler is not None else True
+
+    def close(self):
+        if self._settler is not None:
+            self._settler.close()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = {
+                'symbols': len(self.books),
+                'orders_submitted': self._submitted,
+                'orders_rejected': self._rejected,
+                'orders_live': len(self.orders),
+                'fills': self._fills,
+                'accounts_loaded': len(self._accounts),
+                'settlement_rejected': self._settle_rejected
+            }
+        if self._settler is not None:
+            stats['settlement'] = self._settler.stats()
+        return stats
+
+    # ==================== MATCHING ====================
+
+    def _execute(self, book: OrderBook, order: Order, fills: List[Fill]):
+        account = self._account(order.user_id) if self.db is not None else None
+        if account is not None and order.side == 'buy' and order.price is None:
+            # Market buys reserve nothing up front; take only whole shares the cash covers
+            max_shares = functools.partial(self._affordable_shares, account)
+        else:
+            max_shares = None
+
+        for resting, price, shares in book.match(order, max_shares):
+            buy, sell = (order, resting) if order.side == 'buy' else (resting, order)
+            fills.append(Fill(book.symbol, price, shares, buy.order_id, sell.order_id,
+                              buy.user_id, sell.user_id, time.time()))
+            if self.db is not None:
+                self._apply_fill(buy, sell, price, shares)
+            if resting.status == 'filled':
+                self._release(resting)
+                self._retire(resting)
+
+        if order.remaining <= 0:
+            order.status = 'filled'
+            self._release(order)
+            self._retire(order)
+        elif order.price is None:
+            order.status = 'cancelled' if order.remaining == order.shares else 'partially_filled'
+            self._release(order)
+            self._retire(order)
+        else:
+            order.status = 'open'
+            book.rest(order)
+
+    def _run_stops(self, book: OrderBook, fills: List[Fill]):
+        # A stop's own fills can trigger further stops
+        triggered = book.triggered_stops()
+        while triggered:
+            for order in triggered:
+                if order.status == 'pending':
+                    self._execute(book, order, fills)
+            triggered = book.triggered_stops()
+
+    def _find(self, order_id: int) -> Optional[Order]:
+        order = self.orders.get(order_id)
+        return order if order is not None else self._history.get(order_id)
+
+    def _retire(self, order: Order):
+        # Finished orders leave the live map; only the most recent are kept for lookups
+        self.orders.pop(order.order_id, None)
+        if self.history_size <= 0:
+            return
+        self._history[order.order_id] = order
+        if len(self._history) > self.history_size:
+            self._history.popitem(last=False)
+
+    # ==================== ACCOUNTS ====================
+
+    def _account(self, user_id: int) -> Optional[_Account]:
+        account = self._accounts.get(user_id)
+        if account is None:
+            with self.db.pool.connection() as conn:
+                row = conn.execute('SELECT cash_balance FROM user_balances WHERE user_id = ?',
+                                   (user_id,)).fetchone()
+                if row is None:
+                    return None
+                shares = dict(conn.execute('''
+                    SELECT symbol, SUM(shares) FROM user_portfolios WHERE user_id = ? GROUP BY symbol
+                ''', (user_id,)).fetchall())
+            account = self._accounts[user_id] = _Account(row[0], shares)
+        return account
+
+    @staticmethod
+    def _affordable_shares(account: _Account, price: float) -> int:
+        # A non-positive price cannot be paid for in whole shares; stop matching
+        if price <= 0:
+            return 0
+        return math.floor(account.cash / price)
+
+    def _reserve(self, order: Order) -> Optional[str]:
+        if self.db is None:
+            return None
+
+        account = self._account(order.user_id)
+        if account is None:
+            return "Balance not found"
+
+        if order.side == 'sell':
+            if account.shares.get(order.symbol, 0) < order.shares:
+                return "Insufficient shares to sell"
+            account.shares[order.symbol] -= order.shares
+            order.reserved = order.shares
+        elif order.price is not None:
+            cost = order.shares * order.price
+            if account.cash < cost:
+                return "Insufficient cash balance"
+            account.cash -= cost
+            order.reserved = cost
+        elif account.cash <= 0:
+            return "Insufficient cash balance"
+        return None
+
+    def _apply_fill(self, buy: Order, sell: Order, price: float, shares: float):
+        buyer = self._accounts[buy.user_id]
+        seller = self._accounts[sell.user_id]
+
+        if buy.price is None:
+            buyer.cash -= shares * price
+        else:
+            # Reserved at the limit; refund any price improvement
+            buy.reserved -= shares * buy.price
+            buyer.cash += shares * (buy.price - price)
+        buyer.shares[buy.symbol] = buyer.shares.get(buy.symbol, 0) + shares
+
+        sell.reserved -= shares
+        seller.cash += shares * price
+
+    def _release(self, order: Order):
+        if self.db is None or not order.reserved:
+            return
+        account = self._accounts[order.user_id]
+        if order.side == 'buy':
+            account.cash += order.reserved
+        else:
+            account.shares[order.symbol] += order.reserved
+        order.reserved = 0.0
+
+    # ==================== SETTLEMENT ====================
+
+    def _settle(self, fills: List[Fill]) -> Dict:
+        trades = []
+        for fill in fills:
+            total = fill.shares * fill.price
+            trades.append((fill.seller_id, fill.symbol, 'sell', fill.shares, fill.price, total))
+            trades.append((fill.buyer_id, fill.symbol, 'buy', fill.shares, fill.price, total))
+
+        result = self.db.execute_trades(trades, on_error='skip')
+        if result['success'] and result['rejected']:
+            # Only possible if balances changed outside the engine
+            for trade in result['results']:
+                if not trade['success']:
+                    logger.error(f"Settlement of {trades[trade['index']]} rejected: {trade['message']}")
+            with self._lock:
+                self._settle_rejected += result['rejected']
+        return result
+
+
+def run_benchmark(n_orders: int = 200000, n_symbols: int = 10, n_users: int = 1000,
+                  market_ratio: float = 0.1, cancel_ratio: float = 0.2, seed: int = 0,
+                  db=None) -> Dict:
+    """Replay a random order flow and report orders per second and match latency"""
+    rng = random.Random(seed)
+    engine = MatchingEngine(db)
+    symbols = [f'SYM{i:03d}' for i in range(n_symbols)]
+    mid = {symbol: 100.0 for symbol in symbols}
+    latencies = []
+    open_orders = []
+
+    started = time.perf_counter()
+    for _ in range(n_orders):
+        if open_orders and rng.random() < cancel_ratio:
+            order_id = open_orders.pop(rng.randrange(len(open_orders)))
+            began = time.perf_counter_ns()
+            engine.cancel_order(order_id)
+        else:
+            symbol = rng.choice(symbols)
+            side = rng.choice(SIDES)
+            shares = rng.randint(1, 100)
+            began = time.perf_counter_ns()
+            if rng.random() < market_ratio:
+                result = engine.submit_order(rng.randint(1, n_users), symbol, side, shares, 'market')
+            else:
+                offset = rng.gauss(0, 1) + (-0.5 if side == 'buy' else 0.5)
+                price = round(mid[symbol] + offset, 2)
+                result = engine.submit_order(rng.randint(1, n_users), symbol, side, shares, 'limit', price)
+                if result['success'] and result['order']['status'] == 'open':
+                    open_orders.append(result['order']['order_id'])
+        latencies.append(time.perf_counter_ns() - began)
+    elapsed = time.perf_counter() - started
+
+    settle_seconds = None
+    if db is not None:
+        settle_started = time.perf_counter()
+        engine.close()
+        settle_seconds = round(time.perf_counter() - settle_started, 3)
+
+    latencies.sort()
+    stats = engine.stats()
+    return {
+        'orders': n_orders,
+        'symbols': n_symbols,
+        'fills': stats['fills'],
+        'elapsed_seconds': round(elapsed, 3),
+        'orders_per_second': round(n_orders / elapsed, 1),
+        'latency_us': {
+            'p50': round(latencies[len(latencies) // 2] / 1000, 2),
+            'p99': round(latencies[int(len(latencies) * 0.99)] / 1000, 2),
+            'max': round(latencies[-1] / 1000, 2)
+        },
+        'settle_drain_seconds': settle_seconds,
+        'settlement_rejected': stats['settlement_rejected']
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the order matching engine")
+    parser.add_argument("--orders", type=int, default=200000)
+    parser.add_argument("--symbols", type=int, default=10)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--db", help="settle fills into this StockDatabase (users need balances)")
+    args = parser.parse_args()
+
+    database = None
+    if args.db:
+        from Database_for_user import StockDatabase
+        database = StockDatabase(args.db)
+
+    print(json.dumps(run_benchmark(args.orders, args.symbols, args.users, seed=args.seed, db=database), indent=2))
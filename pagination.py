@@ -0,0 +1,32 @@
+import base64
+import hashlib
+import json
+from typing import Tuple
+
+
+def _scope_hash(scope) -> str:
+    return hashlib.sha256(json.dumps(scope, default=str).encode()).hexdigest()[:12]
+
+
+def encode_page_token(scope, key: Tuple) -> str:
+    """Opaque continuation token for the row ``key`` of the query identified by ``scope``
+
+    ``key`` is the keyset position of the last row returned, e.g.
+    ``(timestamp, id)``. The token carries a hash of ``scope`` so it cannot
+    be replayed against a different query (another user, symbol or order).
+    """
+    payload = json.dumps({'s': _scope_hash(scope), 'k': list(key)}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_page_token(token: str, scope) -> Tuple:
+    """Keyset position stored in ``token``; raises ValueError if it is malformed or for another query"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        scope_hash, key = payload['s'], payload['k']
+    except (ValueError, TypeError, KeyError):
+        raise ValueError("Invalid page token")
+
+    if scope_hash != _scope_hash(scope) or not isinstance(key, list):
+        raise ValueError("Page token does not belong to this query")
+    return tuple(key)
@@ -0,0 +1,117 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Iterable, NamedTuple, Optional
+
+
+class UserAccess(NamedTuple):
+    """A user's active role ids and the union of their permission names"""
+    role_ids: FrozenSet[int]
+    permissions: FrozenSet[str]
+
+
+class PermissionCache:
+    """Bounded LRU cache of per-user role and permission sets
+
+    Membership checks against the cached frozensets are O(1). Callers load
+    missing users from the database and ``put`` them back with the
+    ``version()`` token they read before querying; any invalidation in
+    between bumps the version and the stale ``put`` is dropped. Safe to
+    share across threads.
+    """
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._entries: "OrderedDict[int, UserAccess]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    def version(self) -> int:
+        """Token to pass to ``put`` so a concurrent invalidation wins"""
+        with self._lock:
+            return self._version
+
+    def get(self, user_id: int) -> Optional[UserAccess]:
+        with self._lock:
+            access = self._entries.get(user_id)
+            if access is None:
+                self._misses += 1
+                return None
+
+            self._entries.move_to_end(user_id)
+            self._hits += 1
+            return access
+
+    def put(self, user_id: int, access: UserAccess, version: int):
+        with self._lock:
+            if version != self._version:
+                return
+
+            self._entries[user_id] = access
+            self._entries.move_to_end(user_id)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def invalidate_user(self, user_id: int):
+        """Drop one user (role assigned or revoked)"""
+        with self._lock:
+            self._version += 1
+            if self._entries.pop(user_id, None) is not None:
+                self._invalidations += 1
+
+    def invalidate_roles(self, role_ids: Iterable[int]):
+        """Drop every user holding one of ``role_ids`` (role or grant changed)"""
+        role_ids = set(role_ids)
+        with self._lock:
+            self._version += 1
+            stale = [user_id for user_id, access in self._entries.items()
+                     if not role_ids.isdisjoint(access.role_ids)]
+            for user_id in stale:
+                del self._entries[user_id]
+            self._invalidations += len(stale)
+
+    def clear(self):
+        """Drop everything (a permission was enabled or disabled)"""
+        with self._lock:
+            self._version += 1
+            self._invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        """Hit rate and size"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else None,
+                "evictions": self._evictions,
+                "invalidations": self._invalidations
+            }
+
+
+_caches: Dict[str, PermissionCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_permission_cache(db_path: str, max_size: int = 10000) -> PermissionCache:
+    """Return the shared permission cache for ``db_path``
+
+    Every ServerManager on the same file uses the same cache, so a role
+    change made through one instance is seen by all of them.
+    """
+    key = db_path if db_path == ":memory:" else os.path.abspath(db_path)
+
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = _caches[key] = PermissionCache(max_size=max_size)
+        return cache
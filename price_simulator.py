@@ -0,0 +1,181 @@
+import math
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+from Database_for_user import TIMESTAMP_FORMAT
+
+# Mirrors StockAnalyzer.stocks in script.js (see PARAMETER_PERIOD_SECONDS for the units)
+DEFAULT_STOCKS = {
+    'AAPL': {'name': 'Apple Inc.', 'price': 150.00, 'volatility': 0.02, 'trend': 0.001},
+    'AMZN': {'name': 'Amazon.com', 'price': 3200.00, 'volatility': 0.025, 'trend': 0.002},
+    'GOOGL': {'name': 'Alphabet Inc.', 'price': 2800.00, 'volatility': 0.018, 'trend': 0.0015},
+    'TSLA': {'name': 'Tesla Inc.', 'price': 800.00, 'volatility': 0.04, 'trend': 0.003},
+    'MSFT': {'name': 'Microsoft Corp.', 'price': 300.00, 'volatility': 0.015, 'trend': 0.001},
+    'BTC': {'name': 'Bitcoin', 'price': 45000.00, 'volatility': 0.06, 'trend': 0.005},
+    'ETH': {'name': 'Ethereum', 'price': 3000.00, 'volatility': 0.07, 'trend': 0.006},
+    'GOLD': {'name': 'Gold', 'price': 1800.00, 'volatility': 0.01, 'trend': 0.0005},
+    'SILVER': {'name': 'Silver', 'price': 25.00, 'volatility': 0.015, 'trend': 0.001},
+    'OIL': {'name': 'Crude Oil', 'price': 75.00, 'volatility': 0.03, 'trend': 0.002}
+}
+
+# Period the volatility/trend above are quoted for when generating history.
+# The browser applies them every 2s tick, which compounds to absurd prices
+# over long histories; read as daily figures they are realistic (about 2%
+# daily volatility for a large-cap stock). Pass 2.0 to mirror the browser.
+PARAMETER_PERIOD_SECONDS = 86400.0
+
+# Same range as Math.floor(Math.random() * 1000000) + 100000
+VOLUME_LOW = 100000
+VOLUME_HIGH = 1100000
+
+
+def synthetic_stocks(count: int, seed: Optional[int] = None) -> Dict[str, Dict]:
+    """Generate ``count`` symbols with parameters in the range of DEFAULT_STOCKS"""
+    rng = np.random.default_rng(seed)
+    prices = np.round(np.exp(rng.uniform(np.log(5), np.log(50000), count)), 2)
+    volatilities = rng.uniform(0.01, 0.07, count)
+    trends = rng.uniform(0.0, 0.006, count)
+
+    return {
+        f'SYM{i:05d}': {
+            'name': f'Synthetic {i}',
+            'price': float(prices[i]),
+            'volatility': float(volatilities[i]),
+            'trend': float(trends[i])
+        }
+        for i in range(count)
+    }
+
+
+class PriceSimulator:
+    """Vectorized random-walk price simulator for many symbols
+
+    Uses the same model as ``StockAnalyzer.updatePrices``: each tick the
+    price moves by a uniform random change in [-volatility, volatility]
+    plus ``trend``, and the bar is open=previous price, close=new price,
+    high/low=max/min of the two. ``volatility`` and ``trend`` are quoted
+    per ``parameter_period_seconds`` and scaled to ``interval_seconds``
+    (trend linearly, volatility by the square root). All symbols advance
+    together as NumPy arrays. Runs are reproducible for a given ``seed``,
+    and generating in chunks gives the same bars as generating in one call.
+
+    Without ``start_time`` live ticks start now, while ``write_history``
+    on a fresh simulator backfills so that the last tick lands at now.
+    """
+
+    def __init__(self, stocks: Dict[str, Dict] = None, seed: Optional[int] = None,
+                 start_time: datetime = None, interval_seconds: float = 2.0,
+                 trend_scale: float = 1.0, parameter_period_seconds: float = PARAMETER_PERIOD_SECONDS):
+        stocks = stocks if stocks is not None else DEFAULT_STOCKS
+        period_ratio = interval_seconds / parameter_period_seconds
+
+        self.symbols: List[str] = list(stocks)
+        self.volatility = (np.array([stocks[s]['volatility'] for s in self.symbols], dtype=np.float64)
+                           * math.sqrt(period_ratio))
+        self.trend = (np.array([stocks[s]['trend'] for s in self.symbols], dtype=np.float64)
+                      * trend_scale * period_ratio)
+        self.prices = np.array([stocks[s]['price'] for s in self.symbols], dtype=np.float64)
+        self.interval = timedelta(seconds=interval_seconds)
+
+        # A backfill without a start time is shifted to end at now
+        self._end_at_now = start_time is None
+        if start_time is None:
+            start_time = datetime.now(timezone.utc).replace(microsecond=0)
+        if start_time.tzinfo is not None:
+            start_time = start_time.astimezone(timezone.utc).replace(tzinfo=None)
+        self.time = start_time
+
+        # Separate streams so price paths do not depend on how volume is drawn
+        price_seed, volume_seed = np.random.SeedSequence(seed).spawn(2)
+        self._price_rng = np.random.default_rng(price_seed)
+        self._volume_rng = np.random.default_rng(volume_seed)
+
+    def generate(self, n_steps: int) -> Dict[str, np.ndarray]:
+        """Advance ``n_steps`` ticks and return (n_steps, n_symbols) OHLCV arrays"""
+        n_symbols = len(self.symbols)
+        if n_steps <= 0:
+            # Nothing to advance; prices and time stay where they are
+            empty = np.empty((0, n_symbols))
+            return {'timestamp': [], 'open': empty, 'high': empty.copy(), 'low': empty.copy(),
+                    'close': empty.copy(), 'volume': np.empty((0, n_symbols), dtype=np.int64)}
+        self._end_at_now = False
+
+        changes = self._price_rng.random((n_steps, n_symbols))
+        changes -= 0.5
+        changes *= 2 * self.volatility
+        changes += 1.0 + self.trend
+
+        close = np.cumprod(changes, axis=0)
+        close *= self.prices
+
+        open_ = np.empty_like(close)
+        open_[0] = self.prices
+        open_[1:] = close[:-1]
+
+        volume = self._volume_rng.integers(VOLUME_LOW, VOLUME_HIGH, size=(n_steps, n_symbols))
+
+        timestamps = [self.time + self.interval * (i + 1) for i in range(n_steps)]
+
+        self.prices = close[-1].copy()
+        self.time = timestamps[-1]
+
+        return {
+            'timestamp': timestamps,
+            'open': open_,
+            'high': np.maximum(open_, close),
+            'low': np.minimum(open_, close),
+            'close': close,
+            'volume': volume
+        }
+
+    def step(self) -> Dict[str, np.ndarray]:
+        """Advance one tick; returns 1-D arrays with one entry per symbol"""
+        bars = self.generate(1)
+        return {key: value[0] for key, value in bars.items()}
+
+    def generate_chunks(self, n_steps: int, chunk_steps: int = 10000) -> Iterator[Dict[str, np.ndarray]]:
+        """Yield ``generate`` results in chunks to bound memory for long histories"""
+        remaining = n_steps
+        while remaining > 0:
+            size = min(chunk_steps, remaining)
+            remaining -= size
+            yield self.generate(size)
+
+    def to_rows(self, bars: Dict[str, np.ndarray]) -> List[tuple]:
+        """Flatten bars into save_stock_prices rows, time-major"""
+        n_steps, n_symbols = bars['close'].shape
+
+        timestamps = [ts.strftime(TIMESTAMP_FORMAT) for ts in bars['timestamp']]
+
+        return list(zip(
+            self.symbols * n_steps,
+            bars['open'].ravel().tolist(),
+            bars['high'].ravel().tolist(),
+            bars['low'].ravel().tolist(),
+            bars['close'].ravel().tolist(),
+            bars['volume'].ravel().tolist(),
+            np.repeat(np.array(timestamps, dtype=object), n_symbols).tolist()
+        ))
+
+    def write_history(self, db, n_steps: int, chunk_steps: int = 10000) -> Dict:
+        """Generate ``n_steps`` ticks and store them with db.save_stock_prices
+
+        Stops without writing a chunk whose prices are not finite and positive.
+        """
+        if self._end_at_now:
+            self.time = datetime.now(timezone.utc).replace(microsecond=0, tzinfo=None) - self.interval * n_steps
+
+        written = 0
+        for bars in self.generate_chunks(n_steps, chunk_steps):
+            prices = np.stack((bars['open'], bars['close']))
+            if not (np.isfinite(prices).all() and (prices > 0).all()):
+                return {'success': False, 'rows_written': written,
+                        'message': "Simulated prices are not finite and positive; lower trend_scale or interval"}
+            result = db.save_stock_prices(self.to_rows(bars))
+            if not result['success']:
+                return {'success': False, 'rows_written': written, 'message': result['message']}
+            written += result['count']
+
+        return {'success': True, 'rows_written': written, 'last_timestamp': self.time.strftime(TIMESTAMP_FORMAT)}
@@ -0,0 +1,385 @@
+import argparse
+import json
+import math
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Volatility per parameter period (a day) assumed for symbols with neither history nor model parameters
+DEFAULT_VOLATILITY = 0.02
+# Tick spacing assumed when no symbol has enough history to measure it (the browser's tick)
+DEFAULT_TICK_SECONDS = 2.0
+# Upper bound on users x paths loss cells held in memory per chunk
+CHUNK_CELLS = 2_000_000
+# Paths drawn per batch when simulating, to bound temporaries
+SIMULATION_BATCH = 10000
+
+
+# ==================== Estimation ====================
+
+def load_history(db, symbols: Sequence[str],
+                 lookback: int = 500) -> Tuple[Dict[str, np.ndarray], Optional[float]]:
+    """Newest ``lookback`` log returns of each symbol (oldest first) and the median tick spacing in seconds
+
+    The spacing is None when no symbol has two ticks at different times.
+    """
+    returns = {}
+    spacings = []
+    for symbol in symbols:
+        chunk = next(db.iter_stock_history(symbol, chunk_size=lookback + 1, chunks=True), [])
+        chunk.reverse()
+        closes = np.array([row['close'] for row in chunk], dtype=float)
+        returns[symbol] = np.diff(np.log(closes[closes > 0]))
+        epochs = np.array([
+            datetime.fromisoformat(str(row['timestamp'])[:19]).replace(tzinfo=timezone.utc).timestamp()
+            for row in chunk
+        ])
+        spacings.append(np.diff(epochs))
+
+    spacings = np.concatenate(spacings) if spacings else np.empty(0)
+    spacings = spacings[spacings > 0]
+    return returns, float(np.median(spacings)) if len(spacings) else None
+
+
+def load_returns(db, symbols: Sequence[str], lookback: int = 500) -> Dict[str, np.ndarray]:
+    """Newest ``lookback`` log returns of each symbol (oldest first) from price history"""
+    return load_history(db, symbols, lookback)[0]
+
+
+def estimate_covariance(returns: Dict[str, np.ndarray], symbols: Sequence[str], min_observations: int = 30,
+                        stocks: Dict[str, Dict] = None, interval_seconds: float = DEFAULT_TICK_SECONDS,
+                        parameter_period_seconds: float = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Per-tick mean vector and covariance matrix of log returns for ``symbols``
+
+    Symbols with at least ``min_observations`` returns are estimated
+    together from their newest returns, aligned at the latest tick. The
+    rest fall back to the price simulator's model (a uniform change in
+    [-volatility, volatility] plus trend per ``parameter_period_seconds``,
+    scaled down to one ``interval_seconds`` tick) and are treated as
+    uncorrelated.
+    """
+    if stocks is None:
+        from price_simulator import DEFAULT_STOCKS as stocks
+    if parameter_period_seconds is None:
+        from price_simulator import PARAMETER_PERIOD_SECONDS as parameter_period_seconds
+    period_ratio = interval_seconds / parameter_period_seconds
+    n = len(symbols)
+    mean = np.zeros(n)
+    cov = np.zeros((n, n))
+
+    estimated = [i for i, symbol in enumerate(symbols) if len(returns.get(symbol, ())) >= min_observations]
+    if estimated:
+        length = min(len(returns[symbols[i]]) for i in estimated)
+        sample = np.column_stack([returns[symbols[i]][-length:] for i in estimated])
+        mean[estimated] = sample.mean(axis=0)
+        cov[np.ix_(estimated, estimated)] = np.cov(sample, rowvar=False).reshape(len(estimated), len(estimated))
+
+    for i in set(range(n)).difference(estimated):
+        model = stocks.get(symbols[i], {})
+        volatility = model.get('volatility', DEFAULT_VOLATILITY)
+        mean[i] = model.get('trend', 0.0) * period_ratio
+        cov[i, i] = volatility ** 2 / 3 * period_ratio
+
+    return mean, cov
+
+
+def _factor(cov: np.ndarray) -> np.ndarray:
+    """Matrix L with L @ L.T == cov, clipping negative eigenvalues if cov is not positive definite"""
+    try:
+        return np.linalg.cholesky(cov)
+    except np.linalg.LinAlgError:
+        eigenvalues, eigenvectors = np.linalg.eigh(cov)
+        return eigenvectors * np.sqrt(np.clip(eigenvalues, 0.0, None))
+
+
+def simulate_returns(mean: np.ndarray, cov: np.ndarray, n_paths: int, horizon: int = 1,
+                     seed: Optional[int] = None, out: np.ndarray = None) -> np.ndarray:
+    """(n_symbols, n_paths) simple returns over ``horizon`` ticks of correlated log-normal paths
+
+    Tick log returns are i.i.d. normal, so each path's sum over the
+    horizon is drawn directly from N(horizon * mean, horizon * cov).
+    Paths are generated in batches into ``out`` when given.
+    """
+    factor = _factor(cov) * math.sqrt(horizon)
+    drift = mean * horizon
+    if out is None:
+        out = np.empty((len(mean), n_paths))
+
+    rng = np.random.default_rng(seed)
+    for start in range(0, n_paths, SIMULATION_BATCH):
+        stop = min(start + SIMULATION_BATCH, n_paths)
+        shocks = rng.standard_normal((len(mean), stop - start))
+        np.expm1(drift[:, None] + factor @ shocks, out=out[:, start:stop])
+    return out
+
+
+def tail_risk(losses: np.ndarray, confidence: Sequence[float]) -> Tuple[np.ndarray, np.ndarray]:
+    """VaR and CVaR of each row of ``losses`` (..., n_paths) at every confidence level
+
+    VaR is the loss not exceeded on ``confidence`` of the paths; CVaR is
+    the mean loss on the paths at or beyond it. Returns (..., levels)
+    arrays.
+    """
+    n_paths = losses.shape[-1]
+    ranks = [min(n_paths - 1, max(0, math.ceil(level * n_paths) - 1)) for level in confidence]
+    # One selection for the widest tail, then only that tail is sorted
+    lowest = min(ranks)
+    tail = np.sort(np.partition(losses, lowest, axis=-1)[..., lowest:], axis=-1)
+    var = tail[..., [rank - lowest for rank in ranks]]
+    cvar = np.stack([tail[..., rank - lowest:].mean(axis=-1) for rank in ranks], axis=-1)
+    return var, cvar
+
+
+# ==================== Worker Processes ====================
+
+_shared: Dict[str, np.ndarray] = {}
+_shared_memory: Optional[SharedMemory] = None
+
+
+def _share(arrays: Dict[str, np.ndarray]) -> Tuple[SharedMemory, Dict[str, Tuple[int, Tuple, str]]]:
+    """Copy ``arrays`` into one shared memory block; returns it and the layout workers attach with"""
+    layout, offset = {}, 0
+    for name, array in arrays.items():
+        layout[name] = (offset, array.shape, array.dtype.str)
+        offset += -(-array.nbytes // 64) * 64
+    block = SharedMemory(create=True, size=max(offset, 1))
+    for name, array in _attach_arrays(block, layout).items():
+        array[...] = arrays[name]
+    return block, layout
+
+
+def _attach_arrays(block: SharedMemory, layout: Dict[str, Tuple[int, Tuple, str]]) -> Dict[str, np.ndarray]:
+    return {
+        name: np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf, offset=offset)
+        for name, (offset, shape, dtype) in layout.items()
+    }
+
+
+def _attach_worker(name: str, layout: Dict[str, Tuple[int, Tuple, str]]):
+    global _shared_memory
+    _shared_memory = SharedMemory(name=name)
+    _shared.update(_attach_arrays(_shared_memory, layout))
+
+
+def _chunk_risk(arrays: Dict[str, np.ndarray], task: Tuple[int, int, int, int], confidence: Sequence[float]):
+    """Exposure, VaR and CVaR of users [u0, u1) holding positions [p0, p1)"""
+    u0, u1, p0, p1 = task
+    users = arrays['position_users'][p0:p1] - u0
+    symbols = arrays['position_symbols'][p0:p1]
+    values = arrays['position_values'][p0:p1]
+
+    # Only the symbols this chunk holds take part in the product
+    held, columns = np.unique(symbols, return_inverse=True)
+    exposure = np.bincount(users * len(held) + columns, weights=values,
+                           minlength=(u1 - u0) * len(held)).reshape(u1 - u0, len(held))
+    losses = -(exposure @ arrays['scenarios'][held])
+    var, cvar = tail_risk(losses, confidence)
+    return u0, exposure.sum(axis=1), var, cvar
+
+
+def _shared_chunk_risk(task: Tuple[int, int, int, int], confidence: Sequence[float]):
+    return _chunk_risk(_shared, task, confidence)
+
+
+# ==================== Risk Engine ====================
+
+class RiskEngine:
+    """Monte Carlo VaR/CVaR of every account's open positions
+
+    Each run estimates the return covariance of the held symbols from
+    ``stock_price_history``, simulates ``n_paths`` correlated price paths
+    over ``horizon`` ticks and revalues every position under each path.
+    A tick is ``interval_seconds`` long, measured from the history's
+    median spacing when not given.
+    Users are processed in chunks of at most CHUNK_CELLS users x paths;
+    with more than ``parallel_threshold`` users the chunks are spread over
+    worker processes that read the scenario and position matrices from
+    shared memory instead of receiving copies. Cash carries no risk.
+    """
+
+    def __init__(self, db, n_paths: int = 10000, horizon: int = 1, confidence: Sequence[float] = (0.95, 0.99),
+                 lookback: int = 500, min_observations: int = 30, workers: int = None,
+                 parallel_threshold: int = 20000, seed: Optional[int] = None,
+                 interval_seconds: Optional[float] = None):
+        self.db = db
+        self.interval_seconds = interval_seconds
+        self.n_paths = n_paths
+        self.horizon = horizon
+        self.confidence = tuple(confidence)
+        self.lookback = lookback
+        self.min_observations = min_observations
+        self.workers = workers or os.cpu_count() or 1
+        self.parallel_threshold = parallel_threshold
+        self.seed = seed
+
+        self.user_ids = np.empty(0, dtype=np.int64)
+        self.exposure = np.empty(0)
+        self.var = np.empty((0, len(self.confidence)))
+        self.cvar = np.empty((0, len(self.confidence)))
+        self.system: Dict = {}
+        self._lock = threading.Lock()
+        self._runs = 0
+        self._parallel_runs = 0
+        self._last_run: Optional[Dict] = None
+
+    def run(self, prices: Dict[str, float] = None, n_paths: int = None, horizon: int = None,
+            seed: Optional[int] = None, workers: int = None) -> Dict:
+        """Recompute per-user and system-wide risk; ``prices`` overrides the latest closes"""
+        n_paths = n_paths or self.n_paths
+        horizon = horizon or self.horizon
+        seed = self.seed if seed is None else seed
+        workers = workers or self.workers
+
+        with self._lock:
+            started = time.perf_counter()
+            user_ids, symbols, position_users, position_symbols, values = self._load_positions(prices or {})
+            returns, measured_interval = load_history(self.db, symbols, self.lookback)
+            interval = self.interval_seconds or measured_interval or DEFAULT_TICK_SECONDS
+            mean, cov = estimate_covariance(returns, symbols, self.min_observations, interval_seconds=interval)
+            loaded = time.perf_counter()
+
+            scenarios = np.empty((len(symbols), n_paths))
+            simulate_returns(mean, cov, n_paths, horizon, seed, out=scenarios)
+            simulated = time.perf_counter()
+
+            chunk_users = max(1, CHUNK_CELLS // n_paths)
+            bounds = np.searchsorted(position_users, np.arange(0, len(user_ids) + chunk_users, chunk_users))
+            tasks = [
+                (u0, min(u0 + chunk_users, len(user_ids)), int(bounds[i]), int(bounds[i + 1]))
+                for i, u0 in enumerate(range(0, len(user_ids), chunk_users))
+            ]
+            arrays = {'scenarios': scenarios, 'position_users': position_users,
+                      'position_symbols': position_symbols, 'position_values': values}
+
+            parallel = workers > 1 and len(tasks) > 1 and len(user_ids) > self.parallel_threshold
+            if parallel:
+                results = self._run_parallel(arrays, tasks, workers)
+            else:
+                results = [_chunk_risk(arrays, task, self.confidence) for task in tasks]
+
+            self.user_ids = user_ids
+            self.exposure = np.zeros(len(user_ids))
+            self.var = np.zeros((len(user_ids), len(self.confidence)))
+            self.cvar = np.zeros((len(user_ids), len(self.confidence)))
+            for u0, exposure, var, cvar in results:
+                self.exposure[u0:u0 + len(exposure)] = exposure
+                self.var[u0:u0 + len(exposure)] = var
+                self.cvar[u0:u0 + len(exposure)] = cvar
+
+            # System-wide book: all positions netted per symbol before taking the tail
+            book = np.bincount(position_symbols, weights=values, minlength=len(symbols))
+            system_var, system_cvar = tail_risk(-(book @ scenarios), self.confidence)
+            self.system = {
+                'exposure': float(book.sum()),
+                'var': self._levels(system_var),
+                'cvar': self._levels(system_cvar),
+                'undiversified_var': self._levels(self.var.sum(axis=0))
+            }
+            finished = time.perf_counter()
+
+            self._runs += 1
+            self._parallel_runs += parallel
+            self._last_run = {
+                'users': len(user_ids),
+                'positions': len(values),
+                'symbols': len(symbols),
+                'paths': n_paths,
+                'horizon': horizon,
+                'tick_seconds': interval,
+                'parallel': parallel,
+                'load_seconds': loaded - started,
+                'simulate_seconds': simulated - loaded,
+                'compute_seconds': finished - simulated
+            }
+            return {**self._last_run, 'system': self.system}
+
+    def get_user_risk(self, user_id: int) -> Optional[Dict]:
+        """Exposure, VaR and CVaR of one account from the last run (None if it held no positions)"""
+        with self._lock:
+            index = int(np.searchsorted(self.user_ids, user_id))
+            if index >= len(self.user_ids) or self.user_ids[index] != user_id:
+                return None
+            return {
+                'user_id': int(user_id),
+                'exposure': float(self.exposure[index]),
+                'var': self._levels(self.var[index]),
+                'cvar': self._levels(self.cvar[index])
+            }
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'runs': self._runs,
+                'parallel_runs': self._parallel_runs,
+                'users': len(self.user_ids),
+                'last_run': self._last_run
+            }
+
+    def _levels(self, values: np.ndarray) -> Dict[float, float]:
+        return {level: float(value) for level, value in zip(self.confidence, values)}
+
+    def _load_positions(self, prices: Dict[str, float]):
+        with self.db.pool.connection() as conn:
+            rows = conn.execute('''
+                SELECT user_id, symbol, shares, average_price FROM user_portfolios
+                WHERE shares > 0 AND user_id IS NOT NULL
+            ''').fetchall()
+        if rows:
+            position_user_ids, position_symbol_names, shares, average_price = zip(*rows)
+        else:
+            position_user_ids = position_symbol_names = shares = average_price = ()
+
+        user_ids, position_users = np.unique(np.array(position_user_ids, dtype=np.int64), return_inverse=True)
+        symbols, position_symbols = np.unique(np.array(position_symbol_names, dtype=str), return_inverse=True)
+        symbols = symbols.tolist()
+
+        latest = np.array([prices.get(symbol, np.nan) for symbol in symbols], dtype=float)
+        for i in np.flatnonzero(np.isnan(latest)):
+            result = self.db.get_stock_history(symbols[i], 1)
+            if result["success"] and result["history"]:
+                latest[i] = result["history"][0]["close"]
+
+        # Positions without a known price are marked at cost, as in PortfolioValuator
+        position_prices = latest[position_symbols]
+        position_prices = np.where(np.isnan(position_prices), np.array(average_price, dtype=float), position_prices)
+        values = np.array(shares, dtype=float) * position_prices
+
+        order = np.argsort(position_users, kind='stable')
+        return (user_ids, symbols, position_users[order].astype(np.int64),
+                position_symbols[order].astype(np.int64), values[order])
+
+    def _run_parallel(self, arrays: Dict[str, np.ndarray], tasks: List[Tuple[int, int, int, int]], workers: int):
+        block, layout = _share(arrays)
+        try:
+            with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), initializer=_attach_worker,
+                                     initargs=(block.name, layout)) as pool:
+                return list(pool.map(_shared_chunk_risk, tasks, [self.confidence] * len(tasks),
+                                     chunksize=max(1, len(tasks) // (workers * 4))))
+        finally:
+            block.close()
+            block.unlink()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Monte Carlo VaR/CVaR of every account's open positions")
+    parser.add_argument("db_path", help="SQLite database with user_portfolios and stock_price_history")
+    parser.add_argument("--paths", type=int, default=10000)
+    parser.add_argument("--horizon", type=int, default=1, help="ticks ahead")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    from Database_for_user import StockDatabase
+
+    database = StockDatabase(args.db_path)
+    try:
+        engine = RiskEngine(database, n_paths=args.paths, horizon=args.horizon, workers=args.workers, seed=args.seed)
+        print(json.dumps(engine.run(), indent=2))
+    finally:
+        database.close()
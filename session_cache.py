@@ -0,0 +1,164 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+
+def _expires_epoch(expires_at) -> Optional[float]:
+    """Parse user_sessions.expires_at (UTC text) into epoch seconds"""
+    if expires_at is None:
+        return None
+    if isinstance(expires_at, (int, float)):
+        return float(expires_at)
+    parsed = datetime.fromisoformat(str(expires_at)[:19])
+    return parsed.replace(tzinfo=timezone.utc).timestamp()
+
+
+class SessionCache:
+    """Bounded LRU cache of validated sessions with a TTL
+
+    Each entry lives for ``ttl`` seconds, but never past the session's own
+    ``expires_at``. Entries are indexed by user id as well, so deactivating
+    a user evicts all of that user's sessions at once. Safe to share across
+    threads.
+
+    Invalidations are remembered for ``ttl`` seconds: a ``put`` for a
+    lookup that started before the token or user was invalidated is
+    ignored, so a validation racing a logout cannot re-cache the session.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 30.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._by_user: Dict[int, set] = {}
+        self._revoked_tokens: "OrderedDict[str, float]" = OrderedDict()
+        self._revoked_users: "OrderedDict[int, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._expired = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    def get(self, token: str) -> Optional[Dict]:
+        """Cached user dict for ``token``, or None"""
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                self._misses += 1
+                return None
+
+            user, deadline = entry
+            if time.time() >= deadline:
+                self._remove(token)
+                self._expired += 1
+                self._misses += 1
+                return None
+
+            self._entries.move_to_end(token)
+            self._hits += 1
+            return user
+
+    def put(self, token: str, user: Dict, expires_at=None, started: float = None):
+        """Cache a validated session until min(now + ttl, expires_at)
+
+        ``started`` is the ``time.monotonic()`` value taken before the
+        database lookup that produced ``user``.
+        """
+        deadline = time.time() + self.ttl
+        session_deadline = _expires_epoch(expires_at)
+        if session_deadline is not None:
+            deadline = min(deadline, session_deadline)
+
+        with self._lock:
+            if started is not None:
+                revoked = max(self._revoked_tokens.get(token, -1.0),
+                              self._revoked_users.get(user["user_id"], -1.0))
+                if revoked >= started:
+                    return
+
+            if token in self._entries:
+                self._remove(token)
+
+            self._entries[token] = (user, deadline)
+            self._by_user.setdefault(user["user_id"], set()).add(token)
+
+            while len(self._entries) > self.max_size:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._evictions += 1
+
+    def invalidate(self, token: str):
+        """Evict one session (logout)"""
+        with self._lock:
+            self._revoke(self._revoked_tokens, token)
+            if token in self._entries:
+                self._remove(token)
+                self._invalidations += 1
+
+    def invalidate_user(self, user_id: int):
+        """Evict every cached session of a user (deactivation)"""
+        with self._lock:
+            self._revoke(self._revoked_users, user_id)
+            for token in list(self._by_user.get(user_id, ())):
+                self._remove(token)
+                self._invalidations += 1
+
+    def _revoke(self, revoked: OrderedDict, key):
+        now = time.monotonic()
+        revoked.pop(key, None)
+        revoked[key] = now
+        # Only lookups younger than the TTL can still race an invalidation
+        while revoked and next(iter(revoked.values())) < now - self.ttl:
+            revoked.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+
+    def _remove(self, token: str):
+        user, _ = self._entries.pop(token)
+        tokens = self._by_user.get(user["user_id"])
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._by_user[user["user_id"]]
+
+    def stats(self) -> Dict:
+        """Hit rate and size"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else None,
+                "expired": self._expired,
+                "evictions": self._evictions,
+                "invalidations": self._invalidations
+            }
+
+
+_caches: Dict[str, SessionCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_session_cache(db_path: str, max_size: int = 10000, ttl: float = 30.0) -> SessionCache:
+    """Return the shared session cache for ``db_path``
+
+    Every StockDatabase on the same file uses the same cache, so a logout
+    through one instance evicts the session for all of them.
+    """
+    key = db_path if db_path == ":memory:" else os.path.abspath(db_path)
+
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = _caches[key] = SessionCache(max_size=max_size, ttl=ttl)
+        return cache
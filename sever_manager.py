@@ -1,17 +1,62 @@
-import sqlite3
+import atexit
 import hashlib
 import json
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime, timezone
 from typing import Dict, List, Optional, Tuple
 import os
-import shutil
-from database import StockDatabase
+from Database_for_user import StockDatabase, TIMESTAMP_FORMAT, utc_timestamp
+from permission_cache import UserAccess, get_permission_cache
+from feature_flags import FEATURE_FLAGS_VERSION_KEY, FeatureFlagEngine
+from audit_log import AuditLogSink, write_audit_records
+from activity_counters import install_activity_counters, rebuild_activity_counters, check_activity_counters
+from latency_stats import LatencyAggregator, LatencyHistogram, ensure_latency_schema, write_performance_rows
+from backup_engine import BackupEngine, ensure_backup_schema
+from log_retention import LogRetention
+from instrumentation import Instrumentation
 
 class ServerManager:
-    def __init__(self, db_path="stock_trader.db"):
+    def __init__(self, db_path="stock_trader.db", pool_size: int = 5,
+                 storage_profile=None, permission_cache_size: int = 10000,
+                 feature_flag_poll_interval: float = 5.0, async_logging: bool = False,
+                 log_queue_size: int = 10000, log_overflow: str = 'block',
+                 latency_window_seconds: int = 60, backup_dir: str = 'backups',
+                 log_archive_dir: str = None):
         self.db_path = db_path
-        self.db = StockDatabase(db_path)
+        self.db = StockDatabase(db_path, pool_size=pool_size, storage_profile=storage_profile)
+        self.pool = self.db.pool
+        # Per-user role/permission sets, shared by every ServerManager on this file
+        self.permission_cache = (
+            get_permission_cache(db_path, max_size=permission_cache_size)
+            if permission_cache_size else None
+        )
+        self.feature_flags = FeatureFlagEngine(
+            self._load_feature_flags, self._feature_flags_version,
+            lambda user_id: self.get_user_access(user_id).role_ids,
+            poll_interval=feature_flag_poll_interval
+        )
+        # Optional background writer for the log_* methods
+        self.audit_log = (
+            AuditLogSink(self.pool, max_queue_size=log_queue_size, overflow=log_overflow)
+            if async_logging else None
+        )
+        if self.audit_log is not None:
+            # Queued rows are flushed at interpreter exit if close() was never called
+            atexit.register(self.audit_log.close)
+        self.backups = BackupEngine(self.pool, backup_dir)
+        self.log_retention = LogRetention(self.pool, archive_dir=log_archive_dir)
+        # Counter table/triggers are installed on first use
+        self._activity_counters_ready = False
+        # Per-endpoint latency histograms rolled up into server_performance_logs
+        self._latency_schema_ready = False
+        self.latency = (
+            LatencyAggregator(self._save_latency_rows, window_seconds=latency_window_seconds)
+            if latency_window_seconds else None
+        )
+        if self.latency is not None:
+            atexit.register(self.latency.close)
+        # Opt-in method/SQL timing and slow-query log, see enable_instrumentation
+        self.instrumentation: Optional[Instrumentation] = None
         self.setup_logging()
     
     def setup_logging(self):
@@ -61,36 +106,38 @@ class ServerManager:
     def assign_role_to_user(self, user_id: int, role_name: str, assigned_by: int = None) -> Dict:
         """Assign a role to a user"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Get role ID
-            cursor.execute('SELECT id FROM user_roles WHERE role_name = ? AND is_active = 1', (role_name,))
-            role = cursor.fetchone()
-            
-            if not role:
-                return {'success': False, 'message': f'Role {role_name} not found'}
-            
-            role_id = role[0]
-            
-            # Check if user exists
-            cursor.execute('SELECT id FROM users WHERE id = ?', (user_id,))
-            user = cursor.fetchone()
-            
-            if not user:
-                return {'success': False, 'message': 'User not found'}
-            
-            # Assign role
-            cursor.execute('''
-                INSERT OR REPLACE INTO user_role_assignments (user_id, role_id, assigned_by)
-                VALUES (?, ?, ?)
-            ''', (user_id, role_id, assigned_by))
-            
-            conn.commit()
-            conn.close()
-            
-            self.logger.info(f"Role {role_name} assigned to user {user_id}")
-            return {'success': True, 'message': f'Role {role_name} assigned successfully'}
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                # Get role ID
+                cursor.execute('SELECT id FROM user_roles WHERE role_name = ? AND is_active = 1', (role_name,))
+                role = cursor.fetchone()
+                
+                if not role:
+                    return {'success': False, 'message': f'Role {role_name} not found'}
+                
+                role_id = role[0]
+                
+                # Check if user exists
+                cursor.execute('SELECT id FROM users WHERE id = ?', (user_id,))
+                user = cursor.fetchone()
+                
+                if not user:
+                    return {'success': False, 'message': 'User not found'}
+                
+                # Assign role
+                cursor.execute('''
+                    INSERT OR REPLACE INTO user_role_assignments (user_id, role_id, assigned_by)
+                    VALUES (?, ?, ?)
+                ''', (user_id, role_id, assigned_by))
+                
+                conn.commit()
+                
+                if self.permission_cache is not None:
+                    self.permission_cache.invalidate_user(user_id)
+                
+                self.logger.info(f"Role {role_name} assigned to user {user_id}")
+                return {'success': True, 'message': f'Role {role_name} assigned successfully'}
             
         except Exception as e:
             self.logger.error(f"Error assigning role: {str(e)}")
@@ -99,26 +146,25 @@ class ServerManager:
     def get_user_permissions(self, user_id: int) -> Dict:
         """Get all permissions for a user"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT DISTINCT p.permission_name, p.module
-                FROM users u
-                JOIN user_role_assignments ura ON u.id = ura.user_id
-                JOIN user_roles r ON ura.role_id = r.id
-                JOIN role_permissions rp ON r.id = rp.role_id
-                JOIN permissions p ON rp.permission_id = p.id
-                WHERE u.id = ? AND ura.is_active = 1 AND r.is_active = 1 AND p.is_active = 1
-            ''', (user_id,))
-            
-            permissions = cursor.fetchall()
-            conn.close()
-            
-            return {
-                'success': True,
-                'permissions': [{'name': p[0], 'module': p[1]} for p in permissions]
-            }
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    SELECT DISTINCT p.permission_name, p.module
+                    FROM users u
+                    JOIN user_role_assignments ura ON u.id = ura.user_id
+                    JOIN user_roles r ON ura.role_id = r.id
+                    JOIN role_permissions rp ON r.id = rp.role_id
+                    JOIN permissions p ON rp.permission_id = p.id
+                    WHERE u.id = ? AND ura.is_active = 1 AND r.is_active = 1 AND p.is_active = 1
+                ''', (user_id,))
+                
+                permissions = cursor.fetchall()
+                
+                return {
+                    'success': True,
+                    'permissions': [{'name': p[0], 'module': p[1]} for p in permissions]
+                }
             
         except Exception as e:
             self.logger.error(f"Error getting user permissions: {str(e)}")
@@ -127,16 +173,227 @@ class ServerManager:
     def check_user_permission(self, user_id: int, permission_name: str) -> bool:
         """Check if user has a specific permission"""
         try:
-            permissions = self.get_user_permissions(user_id)
-            if not permissions['success']:
-                return False
-            
-            return any(p['name'] == permission_name for p in permissions['permissions'])
-            
+            return permission_name in self.get_user_access(user_id).permissions
+        
         except Exception as e:
             self.logger.error(f"Error checking permission: {str(e)}")
             return False
     
+    def check_user_permissions(self, checks: List[Tuple[int, str]]) -> List[bool]:
+        """Check many (user_id, permission_name) pairs, loading each user at most once"""
+        try:
+            access = self.get_users_access({user_id for user_id, _ in checks})
+            return [permission_name in access[user_id].permissions for user_id, permission_name in checks]
+        
+        except Exception as e:
+            self.logger.error(f"Error checking permissions: {str(e)}")
+            return [False] * len(checks)
+    
+    def get_user_access(self, user_id: int) -> UserAccess:
+        """Get a user's active role ids and permission names as frozensets"""
+        return self.get_users_access([user_id])[user_id]
+    
+    def get_users_access(self, user_ids) -> Dict[int, UserAccess]:
+        """Get role ids and permission names for many users, served from the cache when possible"""
+        cache = self.permission_cache
+        result = {}
+        missing = []
+        
+        for user_id in user_ids:
+            access = cache.get(user_id) if cache is not None else None
+            if access is None:
+                missing.append(user_id)
+            else:
+                result[user_id] = access
+        
+        if not missing:
+            return result
+        
+        version = cache.version() if cache is not None else None
+        loaded = self._load_users_access(missing)
+        
+        for user_id, access in loaded.items():
+            if cache is not None:
+                cache.put(user_id, access, version)
+            result[user_id] = access
+        
+        return result
+    
+    def _load_users_access(self, user_ids: List[int], chunk_size: int = 500) -> Dict[int, UserAccess]:
+        roles = {user_id: set() for user_id in user_ids}
+        permissions = {user_id: set() for user_id in user_ids}
+        
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            
+            for i in range(0, len(user_ids), chunk_size):
+                chunk = user_ids[i:i + chunk_size]
+                cursor.execute(f'''
+                    SELECT ura.user_id, r.id, p.permission_name
+                    FROM user_role_assignments ura
+                    JOIN user_roles r ON ura.role_id = r.id
+                    LEFT JOIN role_permissions rp ON r.id = rp.role_id
+                    LEFT JOIN permissions p ON rp.permission_id = p.id AND p.is_active = 1
+                    WHERE ura.user_id IN ({','.join('?' * len(chunk))})
+                      AND ura.is_active = 1 AND r.is_active = 1
+                ''', chunk)
+                
+                for user_id, role_id, permission_name in cursor.fetchall():
+                    roles[user_id].add(role_id)
+                    if permission_name is not None:
+                        permissions[user_id].add(permission_name)
+        
+        return {
+            user_id: UserAccess(frozenset(roles[user_id]), frozenset(permissions[user_id]))
+            for user_id in user_ids
+        }
+    
+    def revoke_role_from_user(self, user_id: int, role_name: str) -> Dict:
+        """Remove a role from a user"""
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    DELETE FROM user_role_assignments
+                    WHERE user_id = ? AND role_id = (SELECT id FROM user_roles WHERE role_name = ?)
+                ''', (user_id, role_name))
+                
+                if cursor.rowcount == 0:
+                    return {'success': False, 'message': f'User {user_id} does not have role {role_name}'}
+                
+                conn.commit()
+                
+                if self.permission_cache is not None:
+                    self.permission_cache.invalidate_user(user_id)
+                
+                self.logger.info(f"Role {role_name} revoked from user {user_id}")
+                return {'success': True, 'message': f'Role {role_name} revoked successfully'}
+        
+        except Exception as e:
+            self.logger.error(f"Error revoking role: {str(e)}")
+            return {'success': False, 'message': f'Error revoking role: {str(e)}'}
+    
+    def grant_permission_to_role(self, role_name: str, permission_name: str, granted_by: int = None) -> Dict:
+        """Grant a permission to a role"""
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('SELECT id FROM user_roles WHERE role_name = ?', (role_name,))
+                role = cursor.fetchone()
+                
+                if not role:
+                    return {'success': False, 'message': f'Role {role_name} not found'}
+                
+                cursor.execute('SELECT id FROM permissions WHERE permission_name = ?', (permission_name,))
+                permission = cursor.fetchone()
+                
+                if not permission:
+                    return {'success': False, 'message': f'Permission {permission_name} not found'}
+                
+                cursor.execute('''
+                    INSERT OR IGNORE INTO role_permissions (role_id, permission_id, granted_by)
+                    VALUES (?, ?, ?)
+                ''', (role[0], permission[0], granted_by))
+                
+                conn.commit()
+                
+                if self.permission_cache is not None:
+                    self.permission_cache.invalidate_roles([role[0]])
+                
+                self.logger.info(f"Permission {permission_name} granted to role {role_name}")
+                return {'success': True, 'message': f'Permission {permission_name} granted to {role_name}'}
+        
+        except Exception as e:
+            self.logger.error(f"Error granting permission: {str(e)}")
+            return {'success': False, 'message': f'Error granting permission: {str(e)}'}
+    
+    def revoke_permission_from_role(self, role_name: str, permission_name: str) -> Dict:
+        """Revoke a permission from a role"""
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('SELECT id FROM user_roles WHERE role_name = ?', (role_name,))
+                role = cursor.fetchone()
+                
+                if not role:
+                    return {'success': False, 'message': f'Role {role_name} not found'}
+                
+                cursor.execute('''
+                    DELETE FROM role_permissions
+                    WHERE role_id = ? AND permission_id = (SELECT id FROM permissions WHERE permission_name = ?)
+                ''', (role[0], permission_name))
+                
+                if cursor.rowcount == 0:
+                    return {'success': False, 'message': f'Role {role_name} does not have permission {permission_name}'}
+                
+                conn.commit()
+                
+                if self.permission_cache is not None:
+                    self.permission_cache.invalidate_roles([role[0]])
+                
+                self.logger.info(f"Permission {permission_name} revoked from role {role_name}")
+                return {'success': True, 'message': f'Permission {permission_name} revoked from {role_name}'}
+        
+        except Exception as e:
+            self.logger.error(f"Error revoking permission: {str(e)}")
+            return {'success': False, 'message': f'Error revoking permission: {str(e)}'}
+    
+    def set_role_active(self, role_name: str, is_active: bool) -> Dict:
+        """Enable or disable a role"""
+        state = 'enabled' if is_active else 'disabled'
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    UPDATE user_roles SET is_active = ?, updated_at = CURRENT_TIMESTAMP WHERE role_name = ?
+                ''', (1 if is_active else 0, role_name))
+                
+                if cursor.rowcount == 0:
+                    return {'success': False, 'message': f'Role {role_name} not found'}
+                
+                conn.commit()
+                
+                if self.permission_cache is not None:
+                    # Cached holders of an inactive role do not list it, so enabling needs a full flush
+                    self.permission_cache.clear()
+                
+                self.logger.info(f"Role {role_name} {state}")
+                return {'success': True, 'message': f'Role {role_name} {state}'}
+        
+        except Exception as e:
+            self.logger.error(f"Error updating role: {str(e)}")
+            return {'success': False, 'message': f'Error updating role: {str(e)}'}
+    
+    def set_permission_active(self, permission_name: str, is_active: bool) -> Dict:
+        """Enable or disable a permission for every role"""
+        state = 'enabled' if is_active else 'disabled'
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    UPDATE permissions SET is_active = ? WHERE permission_name = ?
+                ''', (1 if is_active else 0, permission_name))
+                
+                if cursor.rowcount == 0:
+                    return {'success': False, 'message': f'Permission {permission_name} not found'}
+                
+                conn.commit()
+                
+                if self.permission_cache is not None:
+                    self.permission_cache.clear()
+                
+                self.logger.info(f"Permission {permission_name} {state}")
+                return {'success': True, 'message': f'Permission {permission_name} {state}'}
+        
+        except Exception as e:
+            self.logger.error(f"Error updating permission: {str(e)}")
+            return {'success': False, 'message': f'Error updating permission: {str(e)}'}
+    
     # =====================================================
     # SERVER MONITORING
     # =====================================================
@@ -147,97 +404,70 @@ class ServerManager:
                          request_params: str = None, response_status: int = None,
                          response_time_ms: int = None) -> bool:
         """Log server access"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT INTO server_access_logs 
-                (user_id, session_token, ip_address, user_agent, request_method, 
-                 request_url, request_params, response_status, response_time_ms)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (user_id, session_token, ip_address, user_agent, request_method,
-                  request_url, request_params, response_status, response_time_ms))
-            
-            conn.commit()
-            conn.close()
-            return True
-            
-        except Exception as e:
-            self.logger.error(f"Error logging server access: {str(e)}")
-            return False
+        if self.latency is not None and response_time_ms is not None:
+            endpoint = (request_url or '').split('?', 1)[0]
+            self.latency.record(endpoint, request_method or '', response_time_ms,
+                                error=(response_status or 0) >= 500)
+        
+        return self._write_audit_log('server_access_logs', 'server access', (
+            user_id, session_token, ip_address, user_agent, request_method,
+            request_url, request_params, response_status, response_time_ms
+        ))
     
     def log_server_error(self, user_id: int = None, session_token: str = None,
                         ip_address: str = None, error_type: str = None,
                         error_message: str = None, stack_trace: str = None,
                         request_data: str = None) -> bool:
         """Log server error"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT INTO server_error_logs 
-                (user_id, session_token, ip_address, error_type, error_message, 
-                 stack_trace, request_data)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (user_id, session_token, ip_address, error_type, error_message,
-                  stack_trace, request_data))
-            
-            conn.commit()
-            conn.close()
-            return True
-            
-        except Exception as e:
-            self.logger.error(f"Error logging server error: {str(e)}")
-            return False
+        return self._write_audit_log('server_error_logs', 'server error', (
+            user_id, session_token, ip_address, error_type, error_message,
+            stack_trace, request_data
+        ))
     
     def log_user_activity(self, user_id: int, activity_type: str, 
                          activity_description: str, ip_address: str = None,
                          user_agent: str = None, metadata: Dict = None) -> bool:
         """Log user activity"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            metadata_json = json.dumps(metadata) if metadata else None
-            
-            cursor.execute('''
-                INSERT INTO user_activity_logs 
-                (user_id, activity_type, activity_description, ip_address, user_agent, metadata)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (user_id, activity_type, activity_description, ip_address, user_agent, metadata_json))
-            
-            conn.commit()
-            conn.close()
-            return True
-            
-        except Exception as e:
-            self.logger.error(f"Error logging user activity: {str(e)}")
-            return False
+        metadata_json = json.dumps(metadata) if metadata else None
+        return self._write_audit_log('user_activity_logs', 'user activity', (
+            user_id, activity_type, activity_description, ip_address, user_agent, metadata_json
+        ))
     
     def log_security_event(self, user_id: int = None, event_type: str = None,
                           event_description: str = None, ip_address: str = None,
                           severity: str = 'medium') -> bool:
         """Log security event"""
+        return self._write_audit_log('user_security_events', 'security event', (
+            user_id, event_type, event_description, ip_address, severity
+        ))
+    
+    def _write_audit_log(self, table: str, label: str, values: Tuple) -> bool:
+        """Queue the row when async logging is on, otherwise insert it now"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            if self.audit_log is not None:
+                return self.audit_log.log(table, values)
             
-            cursor.execute('''
-                INSERT INTO user_security_events 
-                (user_id, event_type, event_description, ip_address, severity)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (user_id, event_type, event_description, ip_address, severity))
-            
-            conn.commit()
-            conn.close()
-            return True
+            with self.pool.connection() as conn:
+                write_audit_records(conn, [(table, values + (utc_timestamp(),))])
+                conn.commit()
+                return True
             
         except Exception as e:
-            self.logger.error(f"Error logging security event: {str(e)}")
+            self.logger.error(f"Error logging {label}: {str(e)}")
             return False
     
+    def flush_logs(self, timeout: float = None) -> bool:
+        """Write every queued audit log row"""
+        if self.audit_log is None:
+            return True
+        return self.audit_log.flush(timeout)
+    
+    def get_audit_log_stats(self) -> Dict:
+        """Get queued/written/dropped counters of the async audit log writer"""
+        if self.audit_log is None:
+            return {'success': False, 'message': 'Async logging is disabled'}
+        return {'success': True, 'stats': self.audit_log.stats()}
+    
     # =====================================================
     # SYSTEM CONFIGURATION
     # =====================================================
@@ -245,14 +475,13 @@ class ServerManager:
     def get_system_config(self, config_key: str) -> Optional[str]:
         """Get system configuration value"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT config_value FROM system_config WHERE config_key = ?', (config_key,))
-            result = cursor.fetchone()
-            conn.close()
-            
-            return result[0] if result else None
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('SELECT config_value FROM system_config WHERE config_key = ?', (config_key,))
+                result = cursor.fetchone()
+                
+                return result[0] if result else None
             
         except Exception as e:
             self.logger.error(f"Error getting system config: {str(e)}")
@@ -262,20 +491,19 @@ class ServerManager:
                          updated_by: int = None) -> bool:
         """Set system configuration value"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT OR REPLACE INTO system_config 
-                (config_key, config_value, updated_at, updated_by)
-                VALUES (?, ?, CURRENT_TIMESTAMP, ?)
-            ''', (config_key, config_value, updated_by))
-            
-            conn.commit()
-            conn.close()
-            
-            self.logger.info(f"System config updated: {config_key} = {config_value}")
-            return True
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    INSERT OR REPLACE INTO system_config 
+                    (config_key, config_value, updated_at, updated_by)
+                    VALUES (?, ?, CURRENT_TIMESTAMP, ?)
+                ''', (config_key, config_value, updated_by))
+                
+                conn.commit()
+                
+                self.logger.info(f"System config updated: {config_key} = {config_value}")
+                return True
             
         except Exception as e:
             self.logger.error(f"Error setting system config: {str(e)}")
@@ -284,45 +512,74 @@ class ServerManager:
     def is_feature_enabled(self, feature_name: str, user_id: int = None) -> bool:
         """Check if a feature is enabled for a user"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            return self.feature_flags.is_enabled(feature_name, user_id)
             
-            cursor.execute('''
-                SELECT is_enabled, enabled_for_all, enabled_for_roles, enabled_for_users
-                FROM feature_flags WHERE feature_name = ?
-            ''', (feature_name,))
-            
-            result = cursor.fetchone()
-            conn.close()
-            
-            if not result:
-                return False
-            
-            is_enabled, enabled_for_all, enabled_for_roles, enabled_for_users = result
-            
-            if not is_enabled:
-                return False
+        except Exception as e:
+            self.logger.error(f"Error checking feature flag: {str(e)}")
+            return False
+    
+    def get_enabled_features(self, user_id: int = None) -> List[str]:
+        """Get the names of every feature enabled for a user"""
+        try:
+            return self.feature_flags.enabled_features(user_id)
             
-            if enabled_for_all:
+        except Exception as e:
+            self.logger.error(f"Error evaluating feature flags: {str(e)}")
+            return []
+    
+    def set_feature_flag(self, feature_name: str, is_enabled: bool = None, enabled_for_all: bool = None,
+                         enabled_for_roles: List[int] = None, enabled_for_users: List[int] = None,
+                         description: str = None, updated_by: int = None) -> bool:
+        """Create or update a feature flag; fields left as None keep their current value"""
+        try:
+            fields = {
+                'is_enabled': None if is_enabled is None else int(is_enabled),
+                'enabled_for_all': None if enabled_for_all is None else int(enabled_for_all),
+                'enabled_for_roles': None if enabled_for_roles is None else json.dumps(sorted(enabled_for_roles)),
+                'enabled_for_users': None if enabled_for_users is None else json.dumps(sorted(enabled_for_users)),
+                'description': description
+            }
+            fields = {column: value for column, value in fields.items() if value is not None}
+            
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('SELECT id FROM feature_flags WHERE feature_name = ?', (feature_name,))
+                
+                if cursor.fetchone():
+                    assignments = ''.join(f'{column} = ?, ' for column in fields)
+                    cursor.execute(f'''
+                        UPDATE feature_flags SET {assignments}updated_at = CURRENT_TIMESTAMP, updated_by = ?
+                        WHERE feature_name = ?
+                    ''', tuple(fields.values()) + (updated_by, feature_name))
+                else:
+                    columns = ['feature_name'] + list(fields) + ['updated_by']
+                    cursor.execute(f'''
+                        INSERT INTO feature_flags ({', '.join(columns)})
+                        VALUES ({', '.join('?' * len(columns))})
+                    ''', (feature_name,) + tuple(fields.values()) + (updated_by,))
+                
+                conn.commit()
+                
+                self.feature_flags.invalidate()
+                
+                self.logger.info(f"Feature flag updated: {feature_name}")
                 return True
             
-            if user_id and enabled_for_users:
-                user_ids = json.loads(enabled_for_users)
-                if user_id in user_ids:
-                    return True
-            
-            if user_id and enabled_for_roles:
-                role_ids = json.loads(enabled_for_roles)
-                user_roles = self.get_user_roles(user_id)
-                if any(role['id'] in role_ids for role in user_roles):
-                    return True
-            
-            return False
-            
         except Exception as e:
-            self.logger.error(f"Error checking feature flag: {str(e)}")
+            self.logger.error(f"Error setting feature flag: {str(e)}")
             return False
     
+    def _load_feature_flags(self) -> List[Tuple]:
+        with self.pool.connection() as conn:
+            return conn.execute('''
+                SELECT feature_name, is_enabled, enabled_for_all, enabled_for_roles, enabled_for_users
+                FROM feature_flags
+            ''').fetchall()
+    
+    def _feature_flags_version(self) -> Optional[str]:
+        return self.get_system_config(FEATURE_FLAGS_VERSION_KEY)
+    
     # =====================================================
     # USER ANALYTICS
     # =====================================================
@@ -330,129 +587,377 @@ class ServerManager:
     def get_user_activity_summary(self, user_id: int = None) -> Dict:
         """Get user activity summary"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            if user_id:
-                cursor.execute('''
-                    SELECT * FROM user_activity_summary WHERE user_id = ?
-                ''', (user_id,))
-            else:
-                cursor.execute('SELECT * FROM user_activity_summary')
+            self._ensure_activity_counters()
+            
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                if user_id:
+                    cursor.execute('''
+                        SELECT * FROM user_activity_summary WHERE user_id = ?
+                    ''', (user_id,))
+                else:
+                    cursor.execute('SELECT * FROM user_activity_summary')
+                
+                results = cursor.fetchall()
+                
+                columns = ['user_id', 'username', 'first_name', 'last_name', 
+                          'total_activities', 'total_logins', 'last_login', 
+                          'security_events', 'account_created']
+                
+                return {
+                    'success': True,
+                    'data': [dict(zip(columns, row)) for row in results]
+                }
             
-            results = cursor.fetchall()
-            conn.close()
+        except Exception as e:
+            self.logger.error(f"Error getting user activity summary: {str(e)}")
+            return {'success': False, 'message': str(e)}
+    
+    def _ensure_activity_counters(self):
+        if not self._activity_counters_ready:
+            with self.pool.connection() as conn:
+                if install_activity_counters(conn):
+                    self.logger.info("Activity counters backfilled from existing logs")
+            self._activity_counters_ready = True
+    
+    def rebuild_activity_counters(self) -> Dict:
+        """Recompute the per-user activity counters from the log tables"""
+        try:
+            self._ensure_activity_counters()
             
-            columns = ['user_id', 'username', 'first_name', 'last_name', 
-                      'total_activities', 'total_logins', 'last_login', 
-                      'security_events', 'account_created']
+            with self.pool.connection() as conn:
+                users = rebuild_activity_counters(conn)
             
-            return {
-                'success': True,
-                'data': [dict(zip(columns, row)) for row in results]
-            }
+            self.logger.info(f"Activity counters rebuilt for {users} users")
+            return {'success': True, 'users': users}
             
         except Exception as e:
-            self.logger.error(f"Error getting user activity summary: {str(e)}")
+            self.logger.error(f"Error rebuilding activity counters: {str(e)}")
             return {'success': False, 'message': str(e)}
     
-    def get_server_performance_summary(self) -> Dict:
-        """Get server performance summary"""
+    def check_activity_counters(self, repair: bool = False) -> Dict:
+        """Compare the activity counters with the log tables, optionally rebuilding them"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            self._ensure_activity_counters()
             
-            cursor.execute('SELECT * FROM server_performance_summary')
-            results = cursor.fetchall()
-            conn.close()
+            with self.pool.connection() as conn:
+                mismatches = check_activity_counters(conn)
             
-            columns = ['endpoint', 'method', 'avg_response_time', 'total_requests',
-                      'total_errors', 'error_rate_percent', 'last_activity']
+            if mismatches:
+                self.logger.warning(f"Activity counters out of step for {len(mismatches)} users")
+                if repair:
+                    rebuilt = self.rebuild_activity_counters()
+                    if not rebuilt['success']:
+                        return rebuilt
             
             return {
                 'success': True,
-                'data': [dict(zip(columns, row)) for row in results]
+                'consistent': not mismatches,
+                'repaired': bool(mismatches) and repair,
+                'mismatches': mismatches
             }
             
+        except Exception as e:
+            self.logger.error(f"Error checking activity counters: {str(e)}")
+            return {'success': False, 'message': str(e)}
+    
+    def get_server_performance_summary(self, since: str = None) -> Dict:
+        """Get server performance summary, weighted by request count, with merged percentiles"""
+        try:
+            self._ensure_latency_schema()
+            
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    SELECT endpoint, method, avg_response_time_ms, min_response_time_ms, max_response_time_ms,
+                           request_count, error_count, histogram, timestamp
+                    FROM server_performance_logs
+                    WHERE timestamp >= COALESCE(?, '')
+                    ORDER BY endpoint, method
+                ''', (since,))
+                
+                series = {}
+                for row in cursor.fetchall():
+                    series.setdefault((row[0], row[1]), []).append(row[2:])
+                
+                return {
+                    'success': True,
+                    'data': [
+                        dict(endpoint=endpoint, method=method, **self._summarize_performance(rows))
+                        for (endpoint, method), rows in series.items()
+                    ]
+                }
+            
         except Exception as e:
             self.logger.error(f"Error getting server performance summary: {str(e)}")
             return {'success': False, 'message': str(e)}
     
+    def get_latency_trend(self, endpoint: str, method: str = None, start: str = None, end: str = None,
+                          resolution_seconds: int = None) -> Dict:
+        """Get per-window request counts and p50/p95/p99 for one endpoint
+        
+        Windows are merged into ``resolution_seconds`` buckets when given.
+        """
+        try:
+            self._ensure_latency_schema()
+            
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    SELECT CAST(strftime('%s', timestamp) AS INTEGER), avg_response_time_ms,
+                           min_response_time_ms, max_response_time_ms, request_count, error_count,
+                           histogram, timestamp
+                    FROM server_performance_logs
+                    WHERE endpoint = ? AND (? IS NULL OR method = ?)
+                      AND timestamp >= COALESCE(?, '') AND (? IS NULL OR timestamp < ?)
+                    ORDER BY timestamp
+                ''', (endpoint, method, method, start, end, end))
+                
+                buckets = {}
+                for row in cursor.fetchall():
+                    epoch = row[0]
+                    if resolution_seconds:
+                        epoch = epoch // resolution_seconds * resolution_seconds
+                    buckets.setdefault(epoch, []).append(row[1:])
+                
+                return {
+                    'success': True,
+                    'endpoint': endpoint,
+                    'method': method,
+                    'trend': [
+                        dict(timestamp=datetime.fromtimestamp(epoch, tz=timezone.utc).strftime(TIMESTAMP_FORMAT),
+                             **self._summarize_performance(rows))
+                        for epoch, rows in sorted(buckets.items())
+                    ]
+                }
+            
+        except Exception as e:
+            self.logger.error(f"Error getting latency trend: {str(e)}")
+            return {'success': False, 'message': str(e)}
+    
+    def _summarize_performance(self, rows: List[Tuple]) -> Dict:
+        """Merge (avg, min, max, count, errors, histogram, timestamp) rows"""
+        histogram = None
+        requests = errors = 0
+        weighted_total = 0.0
+        minimum = maximum = last_activity = None
+        
+        for avg_ms, min_ms, max_ms, count, error_count, histogram_json, timestamp in rows:
+            count = count or 0
+            requests += count
+            errors += error_count or 0
+            weighted_total += (avg_ms or 0.0) * count
+            if min_ms is not None:
+                minimum = min_ms if minimum is None else min(minimum, min_ms)
+            if max_ms is not None:
+                maximum = max_ms if maximum is None else max(maximum, max_ms)
+            last_activity = timestamp if last_activity is None else max(last_activity, timestamp)
+            if histogram_json:
+                window = LatencyHistogram.from_json(histogram_json)
+                if histogram is None:
+                    histogram = window
+                else:
+                    histogram.merge(window)
+        
+        return {
+            'avg_response_time': weighted_total / requests if requests else None,
+            'min_response_time': minimum,
+            'max_response_time': maximum,
+            'p50_response_time': histogram.quantile(0.5) if histogram else None,
+            'p95_response_time': histogram.quantile(0.95) if histogram else None,
+            'p99_response_time': histogram.quantile(0.99) if histogram else None,
+            'total_requests': requests,
+            'total_errors': errors,
+            'error_rate_percent': errors * 100.0 / requests if requests else None,
+            'last_activity': last_activity
+        }
+    
+    def _ensure_latency_schema(self):
+        if not self._latency_schema_ready:
+            with self.pool.connection() as conn:
+                ensure_latency_schema(conn)
+            self._latency_schema_ready = True
+    
+    def _save_latency_rows(self, rows: List[Tuple]):
+        self._ensure_latency_schema()
+        with self.pool.connection() as conn:
+            write_performance_rows(conn, rows, self.latency.window_seconds)
+            conn.commit()
+    
+    def get_latency_stats(self) -> Dict:
+        """Get latency aggregator counters"""
+        if self.latency is None:
+            return {'success': False, 'message': 'Latency aggregation is disabled'}
+        return {'success': True, 'stats': self.latency.stats()}
+    
+    def enable_instrumentation(self, slow_query_ms: float = 50.0, slow_query_log: str = None,
+                               explain: bool = True) -> Dict:
+        """Time every public ServerManager/StockDatabase method and SQL statement
+        
+        Statements slower than ``slow_query_ms`` go to the slow-query log
+        with their parameters and query plan (and to ``slow_query_log`` as
+        JSON lines when given).
+        """
+        try:
+            if self.instrumentation is None:
+                self.instrumentation = Instrumentation(slow_query_ms, slow_query_log, explain=explain)
+                self.instrumentation.instrument(self)
+                self.instrumentation.instrument(self.db)
+            self.instrumentation.install(self.pool)
+            return {'success': True, 'stats': self.instrumentation.stats()}
+            
+        except Exception as e:
+            self.logger.error(f"Error enabling instrumentation: {str(e)}")
+            return {'success': False, 'message': str(e)}
+    
+    def disable_instrumentation(self) -> Dict:
+        """Stop timing SQL statements; method timing stays until the manager is recreated"""
+        if self.instrumentation is None:
+            return {'success': False, 'message': 'Instrumentation is not enabled'}
+        self.instrumentation.uninstall(self.pool)
+        return {'success': True}
+    
+    def get_instrumentation_report(self, limit: int = 20) -> Dict:
+        """Get the slowest methods and statements by total time and the newest slow queries"""
+        if self.instrumentation is None:
+            return {'success': False, 'message': 'Instrumentation is not enabled'}
+        
+        return {
+            'success': True,
+            'stats': self.instrumentation.stats(),
+            'methods': self.instrumentation.method_summary()[:limit],
+            'statements': self.instrumentation.query_summary()[:limit],
+            'slow_queries': self.instrumentation.slow_queries(limit)
+        }
+    
+    def export_instrumentation(self, reset: bool = True) -> Dict:
+        """Write the method/statement histograms into server_performance_logs"""
+        if self.instrumentation is None:
+            return {'success': False, 'message': 'Instrumentation is not enabled'}
+        
+        try:
+            with self.pool.connection() as conn:
+                rows = self.instrumentation.export(conn, reset)
+            self._latency_schema_ready = True
+            return {'success': True, 'rows_written': rows}
+            
+        except Exception as e:
+            self.logger.error(f"Error exporting instrumentation: {str(e)}")
+            return {'success': False, 'message': str(e)}
+    
     # =====================================================
     # MAINTENANCE AND BACKUP
     # =====================================================
     
-    def create_backup(self, backup_type: str = 'full', initiated_by: int = None) -> Dict:
-        """Create database backup"""
+    def create_backup(self, backup_type: str = 'full', initiated_by: int = None, verify: bool = False) -> Dict:
+        """Create an online database backup ('full' gzip copy or 'incremental' chunk snapshot)"""
+        log_id = None
         try:
-            backup_dir = 'backups'
-            if not os.path.exists(backup_dir):
-                os.makedirs(backup_dir)
-            
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            backup_path = f"{backup_dir}/backup_{backup_type}_{timestamp}.db"
-            
-            # Copy database file
-            shutil.copy2(self.db_path, backup_path)
-            
-            # Get file size
-            file_size = os.path.getsize(backup_path)
+            with self.pool.connection() as conn:
+                ensure_backup_schema(conn)
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    INSERT INTO backup_logs (backup_type, status, initiated_by)
+                    VALUES (?, 'in_progress', ?)
+                ''', (backup_type, initiated_by))
+                log_id = cursor.lastrowid
+                
+                conn.commit()
+            
+            result = self.backups.create_backup(backup_type)
+            manifest = result['manifest']
+            
+            verified = None
+            if verify:
+                verified = self.backups.verify(result['manifest_path'])['ok']
+                if not verified:
+                    raise ValueError(f"Backup {manifest['name']} failed verification")
             
             # Log backup
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    UPDATE backup_logs SET
+                        backup_path = ?, backup_size_bytes = ?, backup_duration_seconds = ?,
+                        database_size_bytes = ?, throughput_bytes_per_second = ?, verified = ?,
+                        status = 'success', completed_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                ''', (result['manifest_path'], result['bytes_written'], result['duration_seconds'],
+                      manifest['database_size_bytes'], result['throughput_bytes_per_second'],
+                      verified, log_id))
+                
+                conn.commit()
+                
+                self.logger.info(f"Backup created: {result['manifest_path']}")
+                return {
+                    'success': True,
+                    'backup_path': result['manifest_path'],
+                    'file_size': result['bytes_written'],
+                    'database_size': manifest['database_size_bytes'],
+                    'duration_seconds': result['duration_seconds'],
+                    'throughput_bytes_per_second': result['throughput_bytes_per_second'],
+                    'verified': verified
+                }
             
-            cursor.execute('''
-                INSERT INTO backup_logs 
-                (backup_type, backup_path, backup_size_bytes, status, completed_at, initiated_by)
-                VALUES (?, ?, ?, 'success', CURRENT_TIMESTAMP, ?)
-            ''', (backup_type, backup_path, file_size, initiated_by))
+        except Exception as e:
+            self.logger.error(f"Error creating backup: {str(e)}")
+            if log_id is not None:
+                try:
+                    with self.pool.connection() as conn:
+                        conn.execute('''
+                            UPDATE backup_logs SET status = 'failed', error_message = ?, completed_at = CURRENT_TIMESTAMP
+                            WHERE id = ?
+                        ''', (str(e), log_id))
+                        conn.commit()
+                except Exception as log_error:
+                    self.logger.error(f"Error logging failed backup: {str(log_error)}")
+            return {'success': False, 'message': str(e)}
+    
+    def verify_backup(self, backup_path: str) -> Dict:
+        """Restore a backup into a scratch file and check its checksum and integrity"""
+        try:
+            return dict(success=True, **self.backups.verify(backup_path))
             
-            conn.commit()
-            conn.close()
+        except Exception as e:
+            self.logger.error(f"Backup verification failed: {str(e)}")
+            return {'success': False, 'ok': False, 'message': str(e)}
+    
+    def restore_backup(self, backup_path: str, target_path: str) -> Dict:
+        """Restore a verified backup into target_path (which must not be in use)"""
+        try:
+            result = self.backups.restore(backup_path, target_path)
+            self.logger.info(f"Backup {result['name']} restored to {target_path}")
+            return dict(success=True, **result)
             
-            self.logger.info(f"Backup created: {backup_path}")
-            return {
-                'success': True,
-                'backup_path': backup_path,
-                'file_size': file_size
-            }
+        except Exception as e:
+            self.logger.error(f"Error restoring backup: {str(e)}")
+            return {'success': False, 'message': str(e)}
+    
+    def apply_backup_retention(self, keep_last: int = 7, max_age_days: float = None) -> Dict:
+        """Delete backups beyond the retention policy and unreferenced chunks"""
+        try:
+            result = self.backups.apply_retention(keep_last, max_age_days)
+            self.logger.info(f"Backup retention removed {len(result['removed'])} backups")
+            return dict(success=True, **result)
             
         except Exception as e:
-            self.logger.error(f"Error creating backup: {str(e)}")
+            self.logger.error(f"Error applying backup retention: {str(e)}")
             return {'success': False, 'message': str(e)}
     
     def cleanup_old_logs(self, days_to_keep: int = 30) -> Dict:
-        """Clean up old log entries"""
+        """Clean up old log entries in short batches, archiving them first if log_archive_dir is set"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            report = self.log_retention.run(days_to_keep)
+            tables = report['tables']
             
-            cutoff_date = datetime.now() - timedelta(days=days_to_keep)
-            
-            # Clean up access logs
-            cursor.execute('''
-                DELETE FROM server_access_logs 
-                WHERE timestamp < ?
-            ''', (cutoff_date,))
-            access_logs_deleted = cursor.rowcount
-            
-            # Clean up error logs (keep resolved ones longer)
-            cursor.execute('''
-                DELETE FROM server_error_logs 
-                WHERE timestamp < ? AND resolved = 1
-            ''', (cutoff_date,))
-            error_logs_deleted = cursor.rowcount
-            
-            # Clean up activity logs
-            cursor.execute('''
-                DELETE FROM user_activity_logs 
-                WHERE timestamp < ?
-            ''', (cutoff_date,))
-            activity_logs_deleted = cursor.rowcount
-            
-            conn.commit()
-            conn.close()
+            access_logs_deleted = tables['server_access_logs']['deleted']
+            error_logs_deleted = tables['server_error_logs']['deleted']
+            activity_logs_deleted = tables['user_activity_logs']['deleted']
             
             self.logger.info(f"Cleaned up {access_logs_deleted} access logs, {error_logs_deleted} error logs, {activity_logs_deleted} activity logs")
             
@@ -460,13 +965,35 @@ class ServerManager:
                 'success': True,
                 'access_logs_deleted': access_logs_deleted,
                 'error_logs_deleted': error_logs_deleted,
-                'activity_logs_deleted': activity_logs_deleted
+                'activity_logs_deleted': activity_logs_deleted,
+                'elapsed_seconds': report['elapsed_seconds'],
+                'rows_per_second': report['rows_per_second']
             }
             
         except Exception as e:
             self.logger.error(f"Error cleaning up logs: {str(e)}")
             return {'success': False, 'message': str(e)}
     
+    def start_log_retention(self, days_to_keep: int = 30, interval_hours: float = 24) -> Dict:
+        """Run cleanup_old_logs in the background every interval_hours"""
+        try:
+            self.log_retention.start(days_to_keep, interval_hours * 3600)
+            self.logger.info(f"Log retention scheduled every {interval_hours}h keeping {days_to_keep} days")
+            return {'success': True}
+            
+        except Exception as e:
+            self.logger.error(f"Error scheduling log retention: {str(e)}")
+            return {'success': False, 'message': str(e)}
+    
+    def stop_log_retention(self) -> Dict:
+        """Stop scheduled log retention after the current batch"""
+        self.log_retention.stop()
+        return {'success': True}
+    
+    def get_log_retention_status(self) -> Dict:
+        """Get progress of the running log cleanup and the last run's report"""
+        return {'success': True, 'status': self.log_retention.status()}
+    
     # =====================================================
     # HELPER METHODS
     # =====================================================
@@ -474,28 +1001,27 @@ class ServerManager:
     def get_user_roles(self, user_id: int) -> List[Dict]:
         """Get roles for a user"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT r.id, r.role_name, r.description, ura.assigned_at
-                FROM user_roles r
-                JOIN user_role_assignments ura ON r.id = ura.role_id
-                WHERE ura.user_id = ? AND ura.is_active = 1 AND r.is_active = 1
-            ''', (user_id,))
-            
-            roles = cursor.fetchall()
-            conn.close()
-            
-            return [
-                {
-                    'id': role[0],
-                    'name': role[1],
-                    'description': role[2],
-                    'assigned_at': role[3]
-                }
-                for role in roles
-            ]
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    SELECT r.id, r.role_name, r.description, ura.assigned_at
+                    FROM user_roles r
+                    JOIN user_role_assignments ura ON r.id = ura.role_id
+                    WHERE ura.user_id = ? AND ura.is_active = 1 AND r.is_active = 1
+                ''', (user_id,))
+                
+                roles = cursor.fetchall()
+                
+                return [
+                    {
+                        'id': role[0],
+                        'name': role[1],
+                        'description': role[2],
+                        'assigned_at': role[3]
+                    }
+                    for role in roles
+                ]
             
         except Exception as e:
             self.logger.error(f"Error getting user roles: {str(e)}")
@@ -504,31 +1030,55 @@ class ServerManager:
     def get_all_roles(self) -> List[Dict]:
         """Get all available roles"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT id, role_name, description, is_active
-                FROM user_roles
-                ORDER BY role_name
-            ''')
-            
-            roles = cursor.fetchall()
-            conn.close()
-            
-            return [
-                {
-                    'id': role[0],
-                    'name': role[1],
-                    'description': role[2],
-                    'is_active': bool(role[3])
-                }
-                for role in roles
-            ]
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    SELECT id, role_name, description, is_active
+                    FROM user_roles
+                    ORDER BY role_name
+                ''')
+                
+                roles = cursor.fetchall()
+                
+                return [
+                    {
+                        'id': role[0],
+                        'name': role[1],
+                        'description': role[2],
+                        'is_active': bool(role[3])
+                    }
+                    for role in roles
+                ]
             
         except Exception as e:
             self.logger.error(f"Error getting all roles: {str(e)}")
             return []
+    
+    def close(self):
+        """Flush queued audit logs and latency windows and stop background threads"""
+        # Drop the exit hooks too, or they keep this manager alive until the process ends
+        if self.audit_log is not None:
+            self.audit_log.close()
+            atexit.unregister(self.audit_log.close)
+        if self.latency is not None:
+            self.latency.close()
+            atexit.unregister(self.latency.close)
+        self.log_retention.stop()
+    
+    def get_pool_stats(self) -> Dict:
+        """Get connection pool statistics"""
+        return {'success': True, 'stats': self.pool.stats()}
+    
+    def get_feature_flag_stats(self) -> Dict:
+        """Get feature flag engine reload and evaluation counters"""
+        return {'success': True, 'stats': self.feature_flags.stats()}
+    
+    def get_permission_cache_stats(self) -> Dict:
+        """Get permission cache hit rate and size"""
+        if self.permission_cache is None:
+            return {'success': False, 'message': 'Permission cache is disabled'}
+        return {'success': True, 'stats': self.permission_cache.stats()}
 
 # Example usage
 if __name__ == "__main__":
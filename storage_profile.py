@@ -0,0 +1,110 @@
+import sqlite3
+from typing import Dict, Optional, Union
+
+# Named PRAGMA presets. journal_mode is persistent in the database file,
+# the rest are per-connection and are re-applied to every pooled connection.
+STORAGE_PROFILES = {
+    "durable": {
+        "journal_mode": "wal",
+        "synchronous": "full",
+        "cache_size": -16000,
+        "mmap_size": 0,
+        "temp_store": "default",
+        "busy_timeout": 10000
+    },
+    "balanced": {
+        "journal_mode": "wal",
+        "synchronous": "normal",
+        "cache_size": -32000,
+        "mmap_size": 134217728,
+        "temp_store": "memory",
+        "busy_timeout": 5000
+    },
+    "throughput": {
+        "journal_mode": "wal",
+        "synchronous": "off",
+        "cache_size": -131072,
+        "mmap_size": 1073741824,
+        "temp_store": "memory",
+        "busy_timeout": 5000
+    },
+    "legacy": {
+        "journal_mode": "delete",
+        "synchronous": "full",
+        "cache_size": -2000,
+        "mmap_size": 0,
+        "temp_store": "default",
+        "busy_timeout": 5000
+    }
+}
+
+DEFAULT_STORAGE_PROFILE = "balanced"
+
+_SYNCHRONOUS = {0: "off", 1: "normal", 2: "full", 3: "extra"}
+_TEMP_STORE = {0: "default", 1: "file", 2: "memory"}
+
+
+def resolve_profile(profile: Union[str, Dict, None]) -> Dict:
+    """Turn a preset name or a partial dict of overrides into a full profile"""
+    if profile is None:
+        profile = DEFAULT_STORAGE_PROFILE
+
+    if isinstance(profile, str):
+        if profile not in STORAGE_PROFILES:
+            raise ValueError(
+                f"Unknown storage profile '{profile}', expected one of {sorted(STORAGE_PROFILES)}"
+            )
+        return dict(STORAGE_PROFILES[profile], name=profile)
+
+    overrides = dict(profile)
+    resolved = resolve_profile(overrides.pop("base", DEFAULT_STORAGE_PROFILE))
+    resolved.update(overrides)
+    resolved["name"] = overrides.get("name", "custom")
+    return resolved
+
+
+def apply_profile(conn: sqlite3.Connection, profile: Dict):
+    """Apply a resolved profile's PRAGMAs to a connection"""
+    # journal_mode cannot change inside a transaction, and WAL is a no-op for :memory:
+    if not conn.in_transaction:
+        conn.execute(f"PRAGMA journal_mode = {profile['journal_mode']}")
+
+    conn.execute(f"PRAGMA synchronous = {profile['synchronous']}")
+    conn.execute(f"PRAGMA cache_size = {int(profile['cache_size'])}")
+    conn.execute(f"PRAGMA mmap_size = {int(profile['mmap_size'])}")
+    conn.execute(f"PRAGMA temp_store = {profile['temp_store']}")
+    conn.execute(f"PRAGMA busy_timeout = {int(profile['busy_timeout'])}")
+
+
+def read_profile(conn: sqlite3.Connection) -> Dict:
+    """Read the PRAGMA values a connection is actually running with"""
+    actual = {
+        "journal_mode": conn.execute("PRAGMA journal_mode").fetchone()[0].lower(),
+        "synchronous": _SYNCHRONOUS.get(conn.execute("PRAGMA synchronous").fetchone()[0]),
+        "cache_size": conn.execute("PRAGMA cache_size").fetchone()[0],
+        "temp_store": _TEMP_STORE.get(conn.execute("PRAGMA temp_store").fetchone()[0]),
+        "busy_timeout": conn.execute("PRAGMA busy_timeout").fetchone()[0]
+    }
+
+    # mmap_size returns no row when memory mapping is compiled out
+    row = conn.execute("PRAGMA mmap_size").fetchone()
+    actual["mmap_size"] = row[0] if row else 0
+
+    return actual
+
+
+def match_profile(actual: Dict) -> Optional[str]:
+    """Return the name of the preset the actual settings match, if any"""
+    for name, preset in STORAGE_PROFILES.items():
+        if all(actual.get(key) == value for key, value in preset.items()):
+            return name
+    return None
+
+
+def diff_profile(actual: Dict, expected: Dict) -> Dict:
+    """Return {pragma: {"expected": ..., "actual": ...}} for settings that differ"""
+    return {
+        key: {"expected": value, "actual": actual.get(key)}
+        for key, value in expected.items()
+        if key != "name" and actual.get(key) != value
+    }
@@ -101,7 +101,12 @@ CREATE TABLE IF NOT EXISTS server_performance_logs (
     max_response_time_ms INTEGER,
     request_count INTEGER,
     error_count INTEGER,
-    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    p50_ms REAL,
+    p95_ms REAL,
+    p99_ms REAL,
+    window_seconds INTEGER,
+    histogram TEXT, -- JSON latency histogram, mergeable across windows
+    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP -- start of the aggregation window
 );
 
 -- =====================================================
@@ -151,6 +156,10 @@ CREATE TABLE IF NOT EXISTS user_security_events (
     FOREIGN KEY (resolved_by) REFERENCES users (id)
 );
 
+-- Per-user activity counters (user_activity_counters), their triggers and the
+-- user_activity_summary view are defined once in activity_counters.py;
+-- ServerManager installs them on first use and backfills them from the logs.
+
 -- =====================================================
 -- USER MANAGEMENT AND ADMINISTRATION
 -- =====================================================
@@ -286,8 +295,11 @@ CREATE TABLE IF NOT EXISTS backup_logs (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     backup_type VARCHAR(50) NOT NULL,
     backup_path TEXT,
-    backup_size_bytes INTEGER,
+    backup_size_bytes INTEGER, -- bytes written by this backup (new chunks only for incremental)
     backup_duration_seconds INTEGER,
+    database_size_bytes INTEGER,
+    throughput_bytes_per_second REAL,
+    verified INTEGER,
     status ENUM('success', 'failed', 'in_progress') DEFAULT 'in_progress',
     started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     completed_at TIMESTAMP,
@@ -392,7 +404,8 @@ INSERT OR IGNORE INTO system_config (config_key, config_value, config_type, desc
 ('maintenance_mode', 'false', 'boolean', 'Enable maintenance mode'),
 ('max_portfolio_size', '1000000', 'integer', 'Maximum portfolio value in USD'),
 ('trading_commission', '9.99', 'decimal', 'Default trading commission'),
-('support_email', 'support@protrader.com', 'string', 'Support email address');
+('support_email', 'support@protrader.com', 'string', 'Support email address'),
+('feature_flags_version', '0', 'integer', 'Bumped on every feature flag change');
 
 -- Insert email templates
 INSERT OR IGNORE INTO email_templates (template_name, subject, body_html, variables) VALUES
@@ -430,6 +443,7 @@ CREATE INDEX IF NOT EXISTS idx_access_logs_timestamp ON server_access_logs(times
 CREATE INDEX IF NOT EXISTS idx_access_logs_ip_address ON server_access_logs(ip_address);
 CREATE INDEX IF NOT EXISTS idx_error_logs_timestamp ON server_error_logs(timestamp);
 CREATE INDEX IF NOT EXISTS idx_error_logs_resolved ON server_error_logs(resolved);
+CREATE INDEX IF NOT EXISTS idx_performance_logs_endpoint_timestamp ON server_performance_logs(endpoint, method, timestamp);
 
 -- User activity indexes
 CREATE INDEX IF NOT EXISTS idx_login_history_user_id ON user_login_history(user_id);
@@ -467,30 +481,12 @@ JOIN role_permissions rp ON r.id = rp.role_id
 JOIN permissions p ON rp.permission_id = p.id
 WHERE ura.is_active = 1 AND r.is_active = 1 AND p.is_active = 1;
 
--- User activity summary view
-CREATE VIEW IF NOT EXISTS user_activity_summary AS
-SELECT 
-    u.id as user_id,
-    u.username,
-    u.first_name,
-    u.last_name,
-    COUNT(ual.id) as total_activities,
-    COUNT(ulh.id) as total_logins,
-    MAX(ulh.login_timestamp) as last_login,
-    COUNT(use.id) as security_events,
-    u.created_at as account_created
-FROM users u
-LEFT JOIN user_activity_logs ual ON u.id = ual.user_id
-LEFT JOIN user_login_history ulh ON u.id = ulh.user_id
-LEFT JOIN user_security_events use ON u.id = use.user_id
-GROUP BY u.id, u.username, u.first_name, u.last_name;
-
 -- Server performance summary view
 CREATE VIEW IF NOT EXISTS server_performance_summary AS
 SELECT 
     endpoint,
     method,
-    AVG(avg_response_time_ms) as avg_response_time,
+    SUM(avg_response_time_ms * request_count) / SUM(request_count) as avg_response_time,
     SUM(request_count) as total_requests,
     SUM(error_count) as total_errors,
     (SUM(error_count) * 100.0 / SUM(request_count)) as error_rate_percent,
@@ -555,6 +551,28 @@ BEGIN
     WHERE id = NEW.id;
 END;
 
+-- Triggers to bump the feature flag version polled by the flag engine
+CREATE TRIGGER IF NOT EXISTS bump_feature_flags_version_insert
+AFTER INSERT ON feature_flags
+BEGIN
+    UPDATE system_config SET config_value = CAST(config_value AS INTEGER) + 1
+    WHERE config_key = 'feature_flags_version';
+END;
+
+CREATE TRIGGER IF NOT EXISTS bump_feature_flags_version_update
+AFTER UPDATE ON feature_flags
+BEGIN
+    UPDATE system_config SET config_value = CAST(config_value AS INTEGER) + 1
+    WHERE config_key = 'feature_flags_version';
+END;
+
+CREATE TRIGGER IF NOT EXISTS bump_feature_flags_version_delete
+AFTER DELETE ON feature_flags
+BEGIN
+    UPDATE system_config SET config_value = CAST(config_value AS INTEGER) + 1
+    WHERE config_key = 'feature_flags_version';
+END;
+
 -- =====================================================
 -- COMMENTS AND DOCUMENTATION
 -- =====================================================
@@ -0,0 +1,385 @@
+import logging
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Columns added by ensure_valuation_schema; total_value already exists
+_BALANCE_COLUMNS = (('holdings_value', 'REAL'), ('unrealized_pnl', 'REAL'))
+_PORTFOLIO_COLUMNS = (('market_value', 'REAL'), ('unrealized_pnl', 'REAL'), ('allocation', 'REAL'))
+
+
+def _mark_dirty(table: str, event: str, columns: str = '') -> str:
+    old = event in ('UPDATE', 'DELETE')
+    new = event in ('INSERT', 'UPDATE')
+    marks = []
+    if old:
+        marks.append('SELECT OLD.user_id WHERE OLD.user_id IS NOT NULL')
+    if new:
+        marks.append('SELECT NEW.user_id WHERE NEW.user_id IS NOT NULL')
+    return f'''
+    CREATE TRIGGER IF NOT EXISTS valuation_dirty_{table}_{event.lower()}
+    AFTER {event}{columns} ON {table}
+    BEGIN
+        INSERT OR IGNORE INTO valuation_dirty_users (user_id) {' UNION '.join(marks)};
+    END
+    '''
+
+
+# Accounts whose cash or positions changed since the last valuation, kept by
+# triggers so a revaluation after a few trades reloads only those accounts
+VALUATION_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS valuation_dirty_users (
+        user_id INTEGER PRIMARY KEY
+    )
+    ''',
+    _mark_dirty('user_portfolios', 'INSERT'),
+    _mark_dirty('user_portfolios', 'UPDATE', ' OF user_id, symbol, shares, average_price'),
+    _mark_dirty('user_portfolios', 'DELETE'),
+    _mark_dirty('user_balances', 'INSERT'),
+    _mark_dirty('user_balances', 'UPDATE', ' OF user_id, cash_balance'),
+    _mark_dirty('user_balances', 'DELETE')
+)
+
+
+def ensure_valuation_schema(conn):
+    """Add the valuation columns, dirty-account table and triggers"""
+    for table, columns in (('user_balances', _BALANCE_COLUMNS), ('user_portfolios', _PORTFOLIO_COLUMNS)):
+        existing = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+        for column, column_type in columns:
+            if column not in existing:
+                conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+
+    for statement in VALUATION_SCHEMA:
+        conn.execute(statement)
+    conn.commit()
+
+
+class PortfolioValuator:
+    """Mark-to-market of every account as array operations
+
+    Cash balances and open positions are held in NumPy arrays (one element
+    per account / per position, positions grouped by account). A
+    revaluation gathers each position's price from a per-symbol price
+    vector and sums market value per account with ``numpy.bincount``, so a
+    price tick costs a few passes over the position arrays however many
+    users there are. Symbols without a known price are valued at their
+    average cost.
+
+    The arrays are loaded once; after that only the accounts listed in
+    ``valuation_dirty_users`` (filled by triggers on trades) are reread,
+    unless more than ``reload_ratio`` of all accounts changed.
+
+    Results are written to ``user_balances.total_value`` (plus
+    ``holdings_value``/``unrealized_pnl``) for accounts whose value moved
+    by at least ``min_change``; per-position market value, P&L and
+    allocation are written only on request.
+    """
+
+    def __init__(self, db, min_change: float = 0.005, reload_ratio: float = 0.05):
+        self.db = db
+        self.min_change = min_change
+        self.reload_ratio = reload_ratio
+
+        self._lock = threading.Lock()
+        self._schema_ready = False
+        self._loaded = False
+
+        # Per account
+        self.user_ids = np.empty(0, dtype=np.int64)
+        self._balance_rowids = np.empty(0, dtype=np.int64)
+        self._cash = np.empty(0)
+        self._written = np.empty(0)
+        self.total_value = np.empty(0)
+        self.holdings_value = np.empty(0)
+        self.unrealized_pnl = np.empty(0)
+
+        # Per position
+        self._position_rowids = np.empty(0, dtype=np.int64)
+        self._position_users = np.empty(0, dtype=np.int64)
+        self._position_symbols = np.empty(0, dtype=np.int64)
+        self._shares = np.empty(0)
+        self._average_price = np.empty(0)
+        self._cost = np.empty(0)
+        self._account_cost = np.empty(0)
+        self._held_symbols = np.empty(0, dtype=np.int64)
+        self.market_value = np.empty(0)
+        self.allocation = np.empty(0)
+
+        # Per symbol
+        self.symbols: List[str] = []
+        self._symbol_index: Dict[str, int] = {}
+        self._prices = np.empty(0)
+
+        self._full_loads = 0
+        self._partial_loads = 0
+        self._runs = 0
+        self._last_run: Optional[Dict] = None
+
+    def update_prices(self, prices: Dict[str, float]):
+        """Set the latest price for some symbols (e.g. from a tick)"""
+        with self._lock:
+            for symbol, price in prices.items():
+                index = self._symbol_index.get(symbol)
+                if index is None:
+                    index = self._add_symbol(symbol)
+                self._prices[index] = price
+
+    def load_latest_prices(self, symbols: List[str] = None):
+        """Fetch the newest close of every held (or the given) symbol from price history"""
+        with self._lock:
+            self._load_latest_prices(symbols if symbols is not None else list(self.symbols))
+
+    def revalue(self, prices: Dict[str, float] = None, write: bool = True,
+                write_positions: bool = False) -> Dict:
+        """Recompute every account's value; returns a summary of the run
+
+        ``prices`` are merged into the current price vector first; without
+        them the newest closes are read from price history. With ``write``
+        the run holds the write lock from reading the changed accounts to
+        the commit, so trades cannot interleave with the values written.
+        """
+        started = time.perf_counter()
+        if prices:
+            self.update_prices(prices)
+
+        with self._lock, self.db.pool.connection() as conn:
+            if not self._schema_ready:
+                ensure_valuation_schema(conn)
+                self._schema_ready = True
+            if not prices:
+                self._load_latest_prices(self.symbols)
+
+            if write:
+                conn.execute('BEGIN IMMEDIATE')
+            try:
+                dirty = [row[0] for row in conn.execute('SELECT user_id FROM valuation_dirty_users')]
+                if not self._loaded or len(dirty) > self.reload_ratio * len(self.user_ids):
+                    reloaded = 'full'
+                    self._load_all(conn)
+                elif dirty:
+                    reloaded = 'partial' if self._load_users(conn, dirty) else 'full'
+                else:
+                    reloaded = None
+
+                if reloaded:
+                    # Only symbols never priced before need a lookup
+                    self._load_latest_prices([self.symbols[index] for index in self._held_symbols
+                                              if np.isnan(self._prices[index])])
+
+                unpriced = self._compute()
+                computed = time.perf_counter()
+
+                accounts_written = positions_written = 0
+                if write:
+                    accounts_written = self._write_balances(conn)
+                    if write_positions:
+                        positions_written = self._write_positions(conn)
+                    if dirty:
+                        # Other writers are locked out, so this is exactly what was read
+                        conn.execute('DELETE FROM valuation_dirty_users')
+                    conn.commit()
+            except Exception:
+                if write:
+                    conn.rollback()
+                self._loaded = False
+                raise
+
+            self._runs += 1
+            self._last_run = {
+                'accounts': len(self.user_ids),
+                'positions': len(self._shares),
+                'symbols': len(self.symbols),
+                'unpriced_symbols': unpriced,
+                'reloaded': reloaded,
+                'changed_accounts': len(dirty),
+                'accounts_written': accounts_written,
+                'positions_written': positions_written,
+                'compute_ms': round((computed - started) * 1000, 3),
+                'elapsed_ms': round((time.perf_counter() - started) * 1000, 3)
+            }
+            return dict(self._last_run)
+
+    def get_valuation(self, user_id: int) -> Optional[Dict]:
+        """Latest computed value, P&L and allocation of one account"""
+        with self._lock:
+            index = np.searchsorted(self.user_ids, user_id)
+            if index >= len(self.total_value) or self.user_ids[index] != user_id:
+                return None
+
+            start, end = np.searchsorted(self._position_users, [index, index + 1])
+            return {
+                'user_id': user_id,
+                'cash_balance': float(self._cash[index]),
+                'holdings_value': float(self.holdings_value[index]),
+                'total_value': float(self.total_value[index]),
+                'unrealized_pnl': float(self.unrealized_pnl[index]),
+                'positions': [
+                    {
+                        'symbol': self.symbols[self._position_symbols[i]],
+                        'shares': float(self._shares[i]),
+                        'average_price': float(self._average_price[i]),
+                        'price': float(self.market_value[i] / self._shares[i]),
+                        'market_value': float(self.market_value[i]),
+                        'unrealized_pnl': float(self.market_value[i] - self._cost[i]),
+                        'allocation': float(self.allocation[i])
+                    }
+                    for i in range(start, end)
+                ]
+            }
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'runs': self._runs,
+                'full_loads': self._full_loads,
+                'partial_loads': self._partial_loads,
+                'last_run': self._last_run
+            }
+
+    def _add_symbol(self, symbol: str) -> int:
+        index = self._symbol_index[symbol] = len(self.symbols)
+        self.symbols.append(symbol)
+        self._prices = np.append(self._prices, np.nan)
+        return index
+
+    def _load_all(self, conn):
+        balances = conn.execute('''
+            SELECT user_id, id, cash_balance, total_value FROM user_balances
+            WHERE user_id IS NOT NULL ORDER BY user_id
+        ''').fetchall()
+        if balances:
+            user_ids, rowids, cash, written = zip(*balances)
+        else:
+            user_ids = rowids = cash = written = ()
+        self.user_ids = np.array(user_ids, dtype=np.int64)
+        self._balance_rowids = np.array(rowids, dtype=np.int64)
+        self._cash = np.array(cash, dtype=float)
+        self._written = np.array([np.nan if value is None else value for value in written], dtype=float)
+
+        positions = conn.execute('''
+            SELECT user_id, id, symbol, shares, average_price FROM user_portfolios WHERE shares > 0
+        ''').fetchall()
+        self._set_positions(*self._position_arrays(positions))
+        self._loaded = True
+        self._full_loads += 1
+
+    def _load_users(self, conn, user_ids: List[int]) -> bool:
+        """Reread cash and positions of a few accounts; falls back to a full load for new/removed accounts"""
+        user_ids = np.array(sorted(user_ids), dtype=np.int64)
+        indices = np.searchsorted(self.user_ids, user_ids)
+
+        balances = {}
+        positions = []
+        for i in range(0, len(user_ids), 500):
+            chunk = user_ids[i:i + 500].tolist()
+            placeholders = ','.join('?' * len(chunk))
+            balances.update((row[0], row[1:]) for row in conn.execute(f'''
+                SELECT user_id, id, cash_balance FROM user_balances WHERE user_id IN ({placeholders})
+            ''', chunk))
+            positions.extend(conn.execute(f'''
+                SELECT user_id, id, symbol, shares, average_price FROM user_portfolios
+                WHERE user_id IN ({placeholders}) AND shares > 0
+            ''', chunk))
+
+        known = (indices < len(self.user_ids)) & (self.user_ids[np.minimum(indices, len(self.user_ids) - 1)]
+                                                 == user_ids)
+        if not known.all() or len(balances) != len(user_ids):
+            self._load_all(conn)
+            return False
+
+        for index, user_id in zip(indices.tolist(), user_ids.tolist()):
+            rowid, cash = balances[user_id]
+            self._balance_rowids[index] = rowid
+            self._cash[index] = cash
+
+        keep = ~np.isin(self._position_users, indices)
+        fresh = self._position_arrays(positions)
+        self._set_positions(*(np.concatenate((current[keep], new)) for current, new in zip(
+            (self._position_users, self._position_rowids, self._position_symbols,
+             self._shares, self._average_price), fresh)))
+        self._partial_loads += 1
+        return True
+
+    def _position_arrays(self, positions: List[tuple]):
+        if positions:
+            position_users, rowids, symbols, shares, average_price = zip(*positions)
+        else:
+            position_users = rowids = symbols = shares = average_price = ()
+
+        # Positions of users without a balance row cannot be written back
+        position_users = np.array(position_users, dtype=np.int64)
+        users = np.searchsorted(self.user_ids, position_users)
+        known = np.zeros(len(users), dtype=bool)
+        in_range = users < len(self.user_ids)
+        known[in_range] = self.user_ids[users[in_range]] == position_users[in_range]
+
+        symbol_codes = np.fromiter(
+            (self._symbol_index[symbol] if symbol in self._symbol_index else self._add_symbol(symbol)
+             for symbol in symbols),
+            dtype=np.int64, count=len(symbols)
+        )
+
+        return (users[known], np.array(rowids, dtype=np.int64)[known], symbol_codes[known],
+                np.array(shares, dtype=float)[known], np.array(average_price, dtype=float)[known])
+
+    def _set_positions(self, users, rowids, symbols, shares, average_price):
+        # Group positions by account (cheaper here than ORDER BY in SQLite)
+        order = np.argsort(users, kind='stable')
+        self._position_users = users[order]
+        self._position_rowids = rowids[order]
+        self._position_symbols = symbols[order]
+        self._shares = shares[order]
+        self._average_price = average_price[order]
+        self._cost = self._shares * self._average_price
+        self._account_cost = np.bincount(self._position_users, weights=self._cost, minlength=len(self.user_ids))
+        self._held_symbols = np.unique(self._position_symbols)
+
+    def _load_latest_prices(self, symbols: List[str]):
+        for symbol in symbols:
+            result = self.db.get_stock_history(symbol, 1)
+            if result["success"] and result["history"]:
+                index = self._symbol_index.get(symbol)
+                if index is None:
+                    index = self._add_symbol(symbol)
+                self._prices[index] = result["history"][0]["close"]
+
+    def _compute(self) -> int:
+        prices = self._prices[self._position_symbols]
+        prices = np.where(np.isnan(prices), self._average_price, prices)
+
+        self.market_value = self._shares * prices
+        self.holdings_value = np.bincount(self._position_users, weights=self.market_value,
+                                          minlength=len(self.user_ids))
+        self.unrealized_pnl = self.holdings_value - self._account_cost
+        self.total_value = self._cash + self.holdings_value
+
+        totals = self.total_value[self._position_users]
+        self.allocation = np.divide(self.market_value, totals, out=np.zeros_like(self.market_value),
+                                    where=totals != 0)
+
+        return int(np.isnan(self._prices[self._held_symbols]).sum())
+
+    def _write_balances(self, conn) -> int:
+        changed = ~(np.abs(self.total_value - self._written) < self.min_change)
+        indices = np.flatnonzero(changed)
+        if len(indices):
+            conn.executemany('''
+                UPDATE user_balances
+                SET total_value = ?, holdings_value = ?, unrealized_pnl = ?, last_updated = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', zip(self.total_value[indices].tolist(), self.holdings_value[indices].tolist(),
+                     self.unrealized_pnl[indices].tolist(), self._balance_rowids[indices].tolist()))
+            self._written[indices] = self.total_value[indices]
+        return len(indices)
+
+    def _write_positions(self, conn) -> int:
+        conn.executemany('''
+            UPDATE user_portfolios SET market_value = ?, unrealized_pnl = ?, allocation = ? WHERE id = ?
+        ''', zip(self.market_value.tolist(), (self.market_value - self._cost).tolist(),
+                 self.allocation.tolist(), self._position_rowids.tolist()))
+        return len(self._position_rowids)